@@ -1,11 +1,14 @@
 """ETL for combining users' balances (vtokens and atokens) with the events data"""
 
 import boto3
+import concurrent.futures
 import pandas as pd
 import io
 import os
+import traceback
 from dotenv import load_dotenv
 from src.utils.logger import Logger
+from src.utils.parallel import workers_for_memory_budget
 from src.users_balances.users_balances_processing_functions import (
     extract_events_data,
     clean_atokens_vtokens_balances,
@@ -21,26 +24,60 @@ AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_SESSION_TOKEN = os.getenv("AWS_SESSION_TOKEN")
 
-client_s3 = boto3.client(
-    "s3",
-    endpoint_url="https://" + "minio.lab.sspcloud.fr",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    aws_session_token=AWS_SESSION_TOKEN,
-)
-
 # Run parameters
 balances_inputs_path = "aave-data/data-prod/aave-v2/users-positions/"
 events_inputs_path = "aave-data/data-prod/aave-v2/events/"
 output_path = "aave-data/data-prod/aave-v2/users-positions-combined/"
 year = 2024
 months = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+# The months are processed in parallel, one process per month. The number of
+# processes is bounded by `max_workers` and by the available memory, given the
+# peak memory of one month (`worker_memory_gb`). The budget only sizes the pool:
+# a month that needs more memory than `worker_memory_gb` is not stopped.
+max_workers = 4
+worker_memory_gb = 8
+
+
+def get_client_s3():
+    return boto3.client(
+        "s3",
+        endpoint_url="https://" + "minio.lab.sspcloud.fr",
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        aws_session_token=AWS_SESSION_TOKEN,
+    )
 
-logger.log("Starting ETL...")
 
-for month in months:
-    logger.log(f"Treating year={year}, month={month}")
-    logger.log("   --> Extracting events and balances data...")
+def upload_csv(client_s3, data: pd.DataFrame, key: str) -> None:
+    csv_buffer = io.StringIO()
+    data.to_csv(csv_buffer, index=False)
+    client_s3.put_object(
+        Body=csv_buffer.getvalue(),
+        Bucket="llatournerie",
+        Key=key,
+    )
+
+
+def process_month(year: int, month: int) -> list[str]:
+    """
+    Extracts, cleans and matches the balances and the events of a month, and
+    uploads the outputs. Runs in a worker process, with its own s3 client. The
+    downloads of the month run concurrently, and so do its two uploads, once
+    both the atokens and the vtokens are matched. The matching itself overlaps
+    with the downloads and uploads of the other months only, in the other
+    worker processes.
+
+    Args:
+        year (int): The year of the month
+        month (int): The month
+    Returns:
+        list[str]: The log messages of the month, logged by the main process so
+            that the logs stay in month order.
+    """
+    messages = [f"Treating year={year}, month={month}"]
+    client_s3 = get_client_s3()
+
+    messages.append("   --> Extracting events and balances data...")
     month_atoken_balances_path = (
         "https://minio.lab.sspcloud.fr/llatournerie/"
         + balances_inputs_path
@@ -55,23 +92,29 @@ for month in months:
         "https://minio.lab.sspcloud.fr/llatournerie/" + events_inputs_path
     )
 
-    atokens = pd.read_csv(month_atoken_balances_path)
-    vtokens = pd.read_csv(month_vtoken_balances_path)
-    interaction_events, liquidation_events = extract_events_data(
-        month_events_path, year, month
-    )
-
-    logger.log("   --> Clean atokens and vtokens...")
+    # The three downloads run concurrently
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as downloader:
+        atokens_download = downloader.submit(pd.read_csv, month_atoken_balances_path)
+        vtokens_download = downloader.submit(pd.read_csv, month_vtoken_balances_path)
+        events_download = downloader.submit(
+            extract_events_data, month_events_path, year, month
+        )
+        atokens = atokens_download.result()
+        vtokens = vtokens_download.result()
+        interaction_events, liquidation_events = events_download.result()
+
+    messages.append("   --> Clean atokens and vtokens...")
     clean_atoken_balances = clean_atokens_vtokens_balances(token_balances=atokens)
     clean_vtoken_balances = clean_atokens_vtokens_balances(token_balances=vtokens)
+    del atokens, vtokens
 
-    logger.log("   --> Cleaning interaction events...")
+    messages.append("   --> Cleaning interaction events...")
     interaction_events_clean = clean_events(events=interaction_events)
 
-    logger.log("   --> Cleaning liquidation events...")
+    messages.append("   --> Cleaning liquidation events...")
     liquidation_events_clean = clean_liquidation_events(liquidations=liquidation_events)
 
-    logger.log("   --> Matching balances and events...")
+    messages.append("   --> Matching balances and events...")
     combined_atoken_data = match_balances_with_events(
         combined_atokens_vtokens_balances=clean_atoken_balances,
         clean_interaction_events=interaction_events_clean,
@@ -82,7 +125,7 @@ for month in months:
         combined_atoken_data[combined_atoken_data.action.isin(["Borrow", "Repay"])]
     ) / len(combined_atoken_data)
 
-    print(
+    messages.append(
         f"   INFO: Weird events matching for atoken balances: {atokens_weird_event_matching}"
     )
 
@@ -98,45 +141,67 @@ for month in months:
         ]
     ) / len(combined_vtoken_data)
 
-    print(
+    messages.append(
         f"   INFO: Weird events matching for vtoken balances: {vtokens_weird_event_matching}"
     )
 
-    missing_a_events_ratio = len(
-        combined_atoken_data[combined_atoken_data.action.isna()]
-    ) / len(combined_atoken_data)
-    logger.log(
+    missing_a_events_ratio = combined_atoken_data.attrs["unmatched_ratio"]
+    messages.append(
         f"   INFO: Fraction of unmatched balances for atoken balances: {missing_a_events_ratio}"
     )
 
-    missing_v_events_ratio = len(
-        combined_vtoken_data[combined_vtoken_data.action.isna()]
-    ) / len(combined_vtoken_data)
-    logger.log(
+    missing_v_events_ratio = combined_vtoken_data.attrs["unmatched_ratio"]
+    messages.append(
         f"   INFO: Fraction of unmatched balances for vtoken balances: {missing_v_events_ratio}"
     )
 
-    logger.log("   --> Uploading output to s3...")
-    csv_buffer = io.StringIO()
-    combined_atoken_data.to_csv(csv_buffer, index=False)
-    client_s3.put_object(
-        Body=csv_buffer.getvalue(),
-        Bucket="llatournerie",
-        Key=output_path + f"combined_atoken_balances_{year}-{month}.csv",
+    # Nothing is uploaded before both matchings succeed, so that a failed month
+    # does not leave only one of its outputs on s3
+    messages.append("   --> Uploading output to s3...")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as uploader:
+        atoken_upload = uploader.submit(
+            upload_csv,
+            client_s3,
+            combined_atoken_data,
+            output_path + f"combined_atoken_balances_{year}-{month}.csv",
+        )
+        upload_csv(
+            client_s3,
+            combined_vtoken_data,
+            output_path + f"combined_vtoken_balances_{year}-{month}.csv",
+        )
+        atoken_upload.result()
+
+    return messages
+
+
+if __name__ == "__main__":
+    logger.log("Starting ETL...")
+
+    n_workers = workers_for_memory_budget(
+        worker_memory_gb * 2**30, max_workers=min(max_workers, len(months))
     )
-
-    csv_buffer = io.StringIO()
-    combined_vtoken_data.to_csv(csv_buffer, index=False)
-    client_s3.put_object(
-        Body=csv_buffer.getvalue(),
+    logger.log(f"Processing {len(months)} months with {n_workers} processes")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(process_month, year, month) for month in months]
+        # In month order: the logs of a month are written once it is done and
+        # all the previous months are logged
+        for month, future in zip(months, futures):
+            try:
+                for message in future.result():
+                    logger.log(message)
+            except Exception:
+                # Includes the traceback of the worker process
+                logger.log(
+                    f"Failed to process year={year}, month={month}:\n"
+                    + traceback.format_exc()
+                )
+
+    logger.log("Done!")
+
+    get_client_s3().put_object(
+        Body=logger.buffer.getvalue(),
         Bucket="llatournerie",
-        Key=output_path + f"combined_vtoken_balances_{year}-{month}.csv",
+        Key=output_path + f"logfile_{year}.log",
     )
-
-logger.log("Done!")
-
-client_s3.put_object(
-    Body=logger.buffer.getvalue(),
-    Bucket="llatournerie",
-    Key=output_path + f"logfile_{year}.log",
-)
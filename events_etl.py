@@ -1,11 +1,23 @@
 """ETL for extracting events data"""
 
 import boto3
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 import os
 import io
-from src.events.events_extraction_functions import fetch_events, clean_events_data
+from src.events.events_extraction_functions import (
+    fetch_events_batched,
+    clean_events_data,
+)
+from src.utils.sharding import fetch_sharded
+from src.utils.incremental import (
+    WatermarkStore,
+    read_output,
+    month_bounds,
+    incremental_months,
+    incremental_timestamp_min,
+    append_rows,
+)
 from src.utils.logger import Logger
 
 logger = Logger()
@@ -24,6 +36,12 @@ year = 2024
 months = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
 version_2 = True
 events_list = ["deposit", "borrow", "repay", "redeemUnderlying", "liquidationCall"]
+shard_window = "day"
+max_workers = 8
+# Incremental mode: only fetch the events more recent than the last extracted ones
+# (watermarks stored on s3, next to the outputs) and append them to the month's
+# output
+incremental = False
 
 
 if version_2:
@@ -41,32 +59,48 @@ client_s3 = boto3.client(
 )
 
 
-for month in months:
+watermarks = WatermarkStore(client_s3, "llatournerie", output_path + "watermarks.json")
+watermark_timestamp = None
+periods = [(year, month) for month in months]
+if incremental:
+    watermark_timestamp = watermarks.timestamp(output_path, events_list)
+    if watermark_timestamp is not None:
+        periods = incremental_months(watermark_timestamp)
+    logger.log(f"Incremental run from watermark {watermark_timestamp}: {periods}")
+failed_events = set()
+
+for year, month in periods:
     # Compute month dates
-    start_date = datetime(year, month, 1, tzinfo=timezone.utc)
-    next_date = start_date + timedelta(days=32)
-    end_date = datetime(next_date.year, next_date.month, 1, tzinfo=timezone.utc)
-    timestamp_min = datetime.timestamp(start_date)
-    timestamp_max = datetime.timestamp(end_date)
+    timestamp_min, timestamp_max = month_bounds(year, month)
+    if incremental:
+        timestamp_min = incremental_timestamp_min(year, month, watermark_timestamp)
+    start_date = datetime.fromtimestamp(timestamp_min, tz=timezone.utc)
+    end_date = datetime.fromtimestamp(timestamp_max, tz=timezone.utc)
     logger.log(f"min_date: {start_date}, max_date: {end_date}")
     logger.log(
         f"Starting data extraction with version_2 = {version_2} timestamp_min = {timestamp_min}, timestamp_max = {timestamp_max}"
     )
 
-    for event_name in events_list:
-        logger.log(f"   --> Fetching {event_name} events...")
-        raw_events = fetch_events(
-            api_endpoint=api_endpoint,
-            size=1000,
-            max_queries=300,
-            timestamp_min=timestamp_min,
-            timestamp_max=timestamp_max,
-            event=event_name,
-            version_2=version_2,
-            verbose=True,
-        )
+    logger.log(f"   --> Fetching {', '.join(events_list)} events...")
+    raw_events_by_type = fetch_sharded(
+        fetch_events_batched,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+        window=shard_window,
+        max_workers=max_workers,
+        api_endpoint=api_endpoint,
+        size=1000,
+        max_queries=300,
+        events=events_list,
+        version_2=version_2,
+    )
 
+    for event_name in events_list:
+        raw_events = raw_events_by_type[event_name]
         logger.log(len(raw_events))
+        if len(raw_events) == 0:
+            logger.log(f"   --> INFO: No new {event_name} events")
+            continue
 
         logger.log(f"   --> Cleaning {event_name} events...")
         clean_events = clean_events_data(
@@ -77,19 +111,30 @@ for month in months:
         logger.log(f"   --> INFO: Found {len(clean_events)} events")
 
         try:
+            key = (
+                output_path
+                + f"{event_name}/"
+                + file_name
+                + f"_{event_name}_{year}-{month}"
+                + ".csv"
+            )
+            output_events = clean_events
+            if incremental:
+                output_events = append_rows(
+                    read_output(client_s3, "llatournerie", key), clean_events
+                )
             csv_buffer = io.StringIO()
-            clean_events.to_csv(csv_buffer, index=False)
+            output_events.to_csv(csv_buffer, index=False)
             client_s3.put_object(
                 Body=csv_buffer.getvalue(),
                 Bucket="llatournerie",
-                Key=output_path
-                + f"{event_name}/"
-                + file_name
-                + f"_{event_name}_{year}-{month}"
-                + ".csv",
+                Key=key,
             )
             logger.log(f"   --> Outputs successfully generated at {output_path}")
+            if event_name not in failed_events:
+                watermarks.update(output_path, event_name, clean_events)
         except Exception as e:
+            failed_events.add(event_name)
             logger.log(f"Failed to upload files to s3, with error: {e}")
 
 client_s3.put_object(
@@ -1,7 +1,7 @@
 """ETL for extracting prices data"""
 
 import boto3
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 import io
 import os
 from dotenv import load_dotenv
@@ -10,6 +10,15 @@ from src.prices.prices_extraction_functions import (
     clean_prices_data,
 )
 from src.utils.logger import Logger
+from src.utils.sharding import fetch_sharded
+from src.utils.incremental import (
+    WatermarkStore,
+    read_output,
+    month_bounds,
+    incremental_months,
+    incremental_timestamp_min,
+    append_rows,
+)
 
 logger = Logger()
 
@@ -24,6 +33,12 @@ output_path = "aave-data/data-prod/aave-v3/messari-prices/"
 file_name = "hourly_prices"
 year = 2024
 months = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+shard_window = "day"
+max_workers = 8
+# Incremental mode: only fetch the snapshots more recent than the last extracted
+# ones (watermarks stored on s3, next to the outputs) and append them to the
+# month's output
+incremental = False
 
 api_endpoint = f"https://gateway.thegraph.com/api/{API_SECRET_KEY}/subgraphs/id/JCNWRypm7FYwV8fx5HhzZPSFaMxgkPuw4TnR3Gpi81zk"
 
@@ -38,12 +53,22 @@ client_s3 = boto3.client(
 
 logger.log("Starting ETL...")
 
-for month in months:
-    start_date = datetime(year, month, 1, tzinfo=timezone.utc)
-    next_date = start_date + timedelta(days=32)
-    end_date = datetime(next_date.year, next_date.month, 1, tzinfo=timezone.utc)
-    timestamp_min = datetime.timestamp(start_date)
-    timestamp_max = datetime.timestamp(end_date)
+watermarks = WatermarkStore(client_s3, "llatournerie", output_path + "watermarks.json")
+watermark_timestamp = None
+periods = [(year, month) for month in months]
+if incremental:
+    watermark_timestamp = watermarks.timestamp(output_path, ["prices"])
+    if watermark_timestamp is not None:
+        periods = incremental_months(watermark_timestamp)
+    logger.log(f"Incremental run from watermark {watermark_timestamp}: {periods}")
+failed = False
+
+for year, month in periods:
+    timestamp_min, timestamp_max = month_bounds(year, month)
+    if incremental:
+        timestamp_min = incremental_timestamp_min(year, month, watermark_timestamp)
+    start_date = datetime.fromtimestamp(timestamp_min, tz=timezone.utc)
+    end_date = datetime.fromtimestamp(timestamp_max, tz=timezone.utc)
     logger.log(f"min_date: {start_date}, max_date: {end_date}")
     logger.log(
         f"Starting data extraction with timestamp_min = {timestamp_min}, timestamp_max = {timestamp_max}"
@@ -51,29 +76,48 @@ for month in months:
 
     logger.log("   --> STEP 1: Extracting raw data...")
 
-    monthly_raw_prices = fetch_hourly_prices(
+    monthly_raw_prices = fetch_sharded(
+        fetch_hourly_prices,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+        window=shard_window,
+        max_workers=max_workers,
         api_endpoint=api_endpoint,
         size=1000,
         max_queries=100,
-        timestamp_min=timestamp_min,
-        timestamp_max=timestamp_max,
-        verbose=True,
     )
 
+    if len(monthly_raw_prices) == 0:
+        logger.log("   --> INFO: No new prices")
+        continue
+
     logger.log("   --> STEP 2: Cleaning data...")
 
     monthly_clean_prices = clean_prices_data(monthly_raw_prices)
 
     logger.log("   --> Uploading data to s3...")
     try:
+        key = output_path + file_name + f"_{year}_{month}.csv"
+        if incremental:
+            monthly_clean_prices = append_rows(
+                read_output(client_s3, "llatournerie", key), monthly_clean_prices
+            )
         csv_buffer = io.StringIO()
         monthly_clean_prices.to_csv(csv_buffer, index=False)
         client_s3.put_object(
             Body=csv_buffer.getvalue(),
             Bucket="llatournerie",
-            Key=output_path + file_name + f"_{year}_{month}.csv",
+            Key=key,
         )
+        if not failed:
+            watermarks.update(
+                output_path,
+                "prices",
+                monthly_clean_prices,
+                timestamp_column="snapshot_timestamp",
+            )
     except Exception as e:
+        failed = True
         logger.log(f"Failed to upload files to s3, with error: {e}")
 
 client_s3.put_object(
@@ -14,11 +14,13 @@ from src.reserves_features.reserves_features import (
 )
 
 from src.reserves_features.reserves_features_quality_check import (
-    reserve_data_quality_check,
+    reserves_quality_report,
     add_clean_data,
 )
+from src.reserves_features.reserves_tail_state import ReservesTailState
 
 from src.utils.logger import Logger
+from src.utils.sharding import fetch_sharded
 
 logger = Logger()
 
@@ -36,6 +38,13 @@ version_2 = True
 max_queries_number = 300
 year = 2023
 months_to_extract = [3]
+shard_window = "day"
+max_workers = 8
+# Also keep the indexes and balances as exact fixed-point values, for the checks
+exact_units = False
+# The state of the reserves at the end of each month is saved next to the
+# month's output (`tail_state_{year}-{month}.json`), and continues the panel of
+# the next month (forward fill and index filters) when it exists
 
 assets_list = [
     "Wrapped Ether",
@@ -55,6 +64,15 @@ client_s3 = boto3.client(
     aws_session_token=AWS_SESSION_TOKEN,
 )
 
+
+def read_tail_state(key: str):
+    try:
+        output = client_s3.get_object(Bucket="llatournerie", Key=key)
+    except client_s3.exceptions.NoSuchKey:
+        return None
+    return ReservesTailState.from_json(output["Body"].read().decode())
+
+
 logger.log("Starting ETL")
 
 for month in months_to_extract:
@@ -64,6 +82,20 @@ for month in months_to_extract:
     timestamp_min = datetime.timestamp(start_date)
     timestamp_max = datetime.timestamp(end_date)
     logger.log(f"min_date: {start_date}, max_date: {end_date}")
+    previous_date = start_date - timedelta(days=1)
+    previous_month = f"{previous_date.year}-{previous_date.month}"
+    tail_state = read_tail_state(output_path + f"tail_state_{previous_month}.json")
+    if tail_state is None:
+        logger.log(
+            f"   WARNING ! No tail state for {previous_month}: the first hours are not filled and the indexes fill value is 1"
+        )
+    elif tail_state.version_2 != version_2:
+        logger.log(
+            f"   WARNING ! The tail state of {previous_month} comes from version_2 = {tail_state.version_2}: ignored"
+        )
+        tail_state = None
+    else:
+        logger.log(f"Continuing from the tail state of {previous_month}")
     logger.log(
         f"Starting data extraction with version_2 = {version_2} timestamp_min = {timestamp_min}, timestamp_max = {timestamp_max}"
     )
@@ -71,13 +103,15 @@ for month in months_to_extract:
     logger.log("Step 1 - Extracting reserves' features")
 
     logger.log("   [1] - Querying Aave Protocol subgraph from Thegraph...")
-    reserves_table = fetch_reserves_data(
+    reserves_table = fetch_sharded(
+        fetch_reserves_data,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+        window=shard_window,
+        max_workers=max_workers,
         size=1000,
         n_iter=max_queries_number,
         version_2=version_2,
-        verbose=True,
-        timestamp_min=timestamp_min,
-        timestamp_max=timestamp_max,
     )
 
     logger.log("   [2] - Cleaning dataframe and selecting main assets...")
@@ -86,6 +120,7 @@ for month in months_to_extract:
         reserves_table=reserves_table,
         version_2=version_2,
         logger=logger,
+        exact=exact_units,
     )
 
     reserves_history_selected_assets = reserves_history[
@@ -99,31 +134,39 @@ for month in months_to_extract:
         logger=logger,
         version_2=version_2,
         verbose=True,
+        tail_state=tail_state,
     )
 
     logger.log("   [4] - Filling the missing rows with the latest available data...")
     reserves_history_hourly_selected_assets_completed = fill_missing_data(
         reserves_history_hourly_selected_assets,
         logger=logger,
+        tail_state=tail_state,
     )
 
     logger.log("   [5] - Running quality checks...")
+    quality_report = reserves_quality_report(
+        reserves_history_hourly_selected_assets_completed, version_2=version_2
+    ).set_index("reserve_name")
     for asset_name in assets_list:
         logger.log(f"   Checking asset {asset_name}")
-        try:
-            outcome, score = reserve_data_quality_check(
-                reserves_history_hourly_selected_assets_completed[
-                    reserves_history_hourly_selected_assets_completed.reserve_name
-                    == asset_name
-                ],
-                version_2=version_2,
+        if asset_name not in quality_report.index:
+            logger.log("   WARNING ! Quality check failed with FATAL ERROR: No data")
+            continue
+        asset_report = quality_report.loc[asset_name]
+        score = asset_report.quality_score
+        if not asset_report.valid_length:
+            logger.log(
+                f"   WARNING ! Quality check failed with FATAL ERROR: Invalid length: {asset_report.n_rows}"
+            )
+        elif asset_report.n_duplicates > 0:
+            logger.log(
+                "   WARNING ! Quality check failed with FATAL ERROR: Found duplicates"
             )
-            if not outcome:
-                logger.log(f"   WARNING ! Quality check failed, with score: {score}")
-            else:
-                logger.log(f"   Passed quality check successfully, with score: {score}")
-        except AssertionError as e:
-            logger.log(f"   WARNING ! Quality check failed with FATAL ERROR: {e}")
+        elif not asset_report.passed:
+            logger.log(f"   WARNING ! Quality check failed, with score: {score}")
+        else:
+            logger.log(f"   Passed quality check successfully, with score: {score}")
 
     if version_2:
         logger.log("   [6] - Consolidate data...")
@@ -131,6 +174,7 @@ for month in months_to_extract:
             reserves_history_hourly_selected_assets_completed,
             verbose=True,
             logger=logger,
+            tail_state=tail_state,
         )
 
     logger.log("Uploading files to s3...")
@@ -145,6 +189,18 @@ for month in months_to_extract:
             Bucket="llatournerie",
             Key=output_path + file_name + f"_{year}-{month}" + ".csv",
         )
+        client_s3.put_object(
+            Body=quality_report.to_csv(),
+            Bucket="llatournerie",
+            Key=output_path + f"quality_report_{year}-{month}.csv",
+        )
+        client_s3.put_object(
+            Body=ReservesTailState.from_panel(
+                reserves_history_hourly_selected_assets_completed, version_2=version_2
+            ).to_json(),
+            Bucket="llatournerie",
+            Key=output_path + f"tail_state_{year}-{month}.json",
+        )
         logger.log(f"   --> Outputs successfully generated at {output_path}")
     except Exception as e:
         logger.log(f"Failed to upload files to s3, with error: {e}")
@@ -1,14 +1,24 @@
 """Functions for extracting events data"""
 
-from ..utils.utils import run_query
+import asyncio
+from httpx import AsyncClient
+from ..utils.utils import (
+    run_query,
+    run_query_async,
+    get_async_client,
+    is_closed_window,
+)
+from ..utils.pagination import paginate, paginate_async, time_windows
+from ..utils.page_buffer import PageBuffer
+from ..utils.graphql import selection_paths
+from ..utils.units import to_units
 from ..utils.logger import Logger
-import pandas as pd
 from pandas import DataFrame
 
 
-def extract_deposit(
-    api_endpoint: str, size: int, offset: int, timestamp_min: int, timestamp_max: int, version_2: bool = False,
-) -> dict:
+def deposit_query(
+    size: int, last_id: str, timestamp_min: int, timestamp_max: int, version_2: bool = False,
+) -> tuple[str, str]:
     if version_2:
         event_keyword = "deposits"
         pool_keyword = "lendingPool"
@@ -16,13 +26,12 @@ def extract_deposit(
         event_keyword = "supplies"
         pool_keyword = "pool"
     
-    query = f"""\u007b
-        {event_keyword}(
+    query_block = f"""{event_keyword}(
             first: {size},
-            skip: {offset},
-            orderBy: timestamp,
-            orderDirection: desc,
+            orderBy: id,
+            orderDirection: asc,
             where: \u007b
+                id_gt: "{last_id}",
                 timestamp_gt: {timestamp_min},
                 timestamp_lt: {timestamp_max},
             \u007d
@@ -47,25 +56,23 @@ def extract_deposit(
             amount
             assetPriceUSD
             timestamp
-        \u007d
-    \u007d"""
-    return run_query(api=api_endpoint, query=query)["data"][event_keyword]
+        \u007d"""
+    return event_keyword, query_block
 
 
-def extract_borrow(
-    api_endpoint: str, size: int, offset: int, timestamp_min: int, timestamp_max: int, version_2: bool = False,
-) -> dict:
+def borrow_query(
+    size: int, last_id: str, timestamp_min: int, timestamp_max: int, version_2: bool = False,
+) -> tuple[str, str]:
     if version_2:
         pool_keyword = "lendingPool"
     else:
         pool_keyword = "pool"
-    query = f"""\u007b
-        borrows(
+    query_block = f"""borrows(
             first: {size},
-            skip: {offset},
-            orderBy: timestamp,
-            orderDirection: desc,
+            orderBy: id,
+            orderDirection: asc,
             where: \u007b
+                id_gt: "{last_id}",
                 timestamp_gt: {timestamp_min},
                 timestamp_lt: {timestamp_max},
             \u007d
@@ -90,25 +97,23 @@ def extract_borrow(
             amount
             assetPriceUSD
             timestamp
-        \u007d
-    \u007d"""
-    return run_query(api=api_endpoint, query=query)["data"]["borrows"]
+        \u007d"""
+    return "borrows", query_block
 
 
-def extract_redeemUnderlying(
-    api_endpoint: str, size: int, offset: int, timestamp_min: int, timestamp_max: int, version_2: bool = False,
-) -> dict:
+def redeemUnderlying_query(
+    size: int, last_id: str, timestamp_min: int, timestamp_max: int, version_2: bool = False,
+) -> tuple[str, str]:
     if version_2:
         pool_keyword = "lendingPool"
     else:
         pool_keyword = "pool"
-    query = f"""\u007b
-        redeemUnderlyings(
+    query_block = f"""redeemUnderlyings(
             first: {size},
-            skip: {offset},
-            orderBy: timestamp,
-            orderDirection: desc,
+            orderBy: id,
+            orderDirection: asc,
             where: \u007b
+                id_gt: "{last_id}",
                 timestamp_gt: {timestamp_min},
                 timestamp_lt: {timestamp_max},
             \u007d
@@ -133,25 +138,23 @@ def extract_redeemUnderlying(
             amount
             assetPriceUSD
             timestamp
-        \u007d
-    \u007d"""
-    return run_query(api=api_endpoint, query=query)["data"]["redeemUnderlyings"]
+        \u007d"""
+    return "redeemUnderlyings", query_block
 
 
-def extract_usageAsCollateral(
-    api_endpoint: str, size: int, offset: int, timestamp_min: int, timestamp_max: int, version_2: bool = False,
-) -> dict:
+def usageAsCollateral_query(
+    size: int, last_id: str, timestamp_min: int, timestamp_max: int, version_2: bool = False,
+) -> tuple[str, str]:
     if version_2:
         pool_keyword = "lendingPool"
     else:
         pool_keyword = "pool"
-    query = f"""\u007b
-        usageAsCollaterals(
+    query_block = f"""usageAsCollaterals(
             first: {size},
-            skip: {offset},
-            orderBy: timestamp,
-            orderDirection: desc,
+            orderBy: id,
+            orderDirection: asc,
             where: \u007b
+                id_gt: "{last_id}",
                 timestamp_gt: {timestamp_min},
                 timestamp_lt: {timestamp_max},
             \u007d
@@ -173,27 +176,25 @@ def extract_usageAsCollateral(
             fromState
             toState
             timestamp
-        \u007d
-    \u007d"""
-    return run_query(api=api_endpoint, query=query)["data"]["usageAsCollaterals"]
+        \u007d"""
+    return "usageAsCollaterals", query_block
 
 
-def extract_repay(
-    api_endpoint: str, size: int, offset: int, timestamp_min: int, timestamp_max: int, version_2: bool = False,
-) -> dict:
+def repay_query(
+    size: int, last_id: str, timestamp_min: int, timestamp_max: int, version_2: bool = False,
+) -> tuple[str, str]:
     if version_2:
         pool_keyword = "lendingPool"
         use_atokens = ""
     else:
         pool_keyword = "pool"
         use_atokens = "useATokens"
-    query = f"""\u007b
-        repays(
+    query_block = f"""repays(
             first: {size},
-            skip: {offset},
-            orderBy: timestamp,
-            orderDirection: desc,
+            orderBy: id,
+            orderDirection: asc,
             where: \u007b
+                id_gt: "{last_id}",
                 timestamp_gt: {timestamp_min},
                 timestamp_lt: {timestamp_max},
             \u007d
@@ -219,25 +220,23 @@ def extract_repay(
             {use_atokens}
             assetPriceUSD
             timestamp
-        \u007d
-    \u007d"""
-    return run_query(api=api_endpoint, query=query)["data"]["repays"]
+        \u007d"""
+    return "repays", query_block
 
 
-def extract_flashloan(
-    api_endpoint: str, size: int, offset: int, timestamp_min: int, timestamp_max: int, version_2: bool = False,
-) -> dict:
+def flashloan_query(
+    size: int, last_id: str, timestamp_min: int, timestamp_max: int, version_2: bool = False,
+) -> tuple[str, str]:
     if version_2:
         pool_keyword = "lendingPool"
     else:
         pool_keyword = "pool"
-    query = f"""\u007b
-        flashLoans(
+    query_block = f"""flashLoans(
             first: {size},
-            skip: {offset},
-            orderBy: timestamp,
-            orderDirection: desc,
+            orderBy: id,
+            orderDirection: asc,
             where: \u007b
+                id_gt: "{last_id}",
                 timestamp_gt: {timestamp_min},
                 timestamp_lt: {timestamp_max},
             \u007d
@@ -260,25 +259,23 @@ def extract_flashloan(
             protocolFee
             assetPriceUSD
             timestamp
-        \u007d
-    \u007d"""
-    return run_query(api=api_endpoint, query=query)["data"]["flashLoans"]
+        \u007d"""
+    return "flashLoans", query_block
 
 
-def extract_liquidationCall(
-    api_endpoint: str, size: int, offset: int, timestamp_min: int, timestamp_max: int, version_2: bool = False,
-) -> dict:
+def liquidationCall_query(
+    size: int, last_id: str, timestamp_min: int, timestamp_max: int, version_2: bool = False,
+) -> tuple[str, str]:
     if version_2:
         pool_keyword = "lendingPool"
     else:
         pool_keyword = "pool"
-    query = f"""\u007b
-        liquidationCalls(
+    query_block = f"""liquidationCalls(
             first: {size},
-            skip: {offset},
-            orderBy: timestamp,
-            orderDirection: desc,
+            orderBy: id,
+            orderDirection: asc,
             where: \u007b
+                id_gt: "{last_id}",
                 timestamp_gt: {timestamp_min},
                 timestamp_lt: {timestamp_max},
             \u007d
@@ -308,9 +305,84 @@ def extract_liquidationCall(
             collateralAssetPriceUSD
             borrowAssetPriceUSD
             timestamp
-        \u007d
-    \u007d"""
-    return run_query(api=api_endpoint, query=query)["data"]["liquidationCalls"]
+        \u007d"""
+    return "liquidationCalls", query_block
+
+
+event_queries = {
+    "deposit": deposit_query,
+    "redeemUnderlying": redeemUnderlying_query,
+    "borrow": borrow_query,
+    "usageAsCollateral": usageAsCollateral_query,
+    "repay": repay_query,
+    "flashloan": flashloan_query,
+    "liquidationCall": liquidationCall_query,
+}
+
+
+def get_event_query(event: str):
+    try:
+        return event_queries[event]
+    except KeyError:
+        raise ValueError(f"Unknown event type: {event}")
+
+
+def event_fields(event: str, version_2: bool = False) -> list[str]:
+    """Returns the field paths (`pd.json_normalize` column names) of an event."""
+    response_key, query_block = get_event_query(event)(
+        size=0, last_id="", timestamp_min=0, timestamp_max=0, version_2=version_2
+    )
+    return selection_paths(f"\u007b {query_block} \u007d")[response_key]
+
+
+def extract_event(
+    api_endpoint: str,
+    event: str,
+    size: int,
+    last_id: str,
+    timestamp_min: int,
+    timestamp_max: int,
+    version_2: bool = False,
+) -> list[dict]:
+    response_key, query_block = get_event_query(event)(
+        size=size,
+        last_id=last_id,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+        version_2=version_2,
+    )
+    query = f"\u007b {query_block} \u007d"
+    query_output = run_query(
+        api=api_endpoint, query=query, cacheable=is_closed_window(timestamp_max)
+    )
+    return query_output["data"][response_key]
+
+
+async def extract_event_async(
+    client: AsyncClient,
+    api_endpoint: str,
+    event: str,
+    size: int,
+    last_id: str,
+    timestamp_min: int,
+    timestamp_max: int,
+    version_2: bool = False,
+) -> list[dict]:
+    response_key, query_block = get_event_query(event)(
+        size=size,
+        last_id=last_id,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+        version_2=version_2,
+    )
+    query = f"\u007b {query_block} \u007d"
+    query_output = await run_query_async(
+        client=client,
+        api=api_endpoint,
+        query=query,
+        cacheable=is_closed_window(timestamp_max),
+    )
+    return query_output["data"][response_key]
 
 
 def fetch_events(
@@ -322,43 +394,194 @@ def fetch_events(
     event: str,
     version_2: bool = False,
     verbose: bool = False,
+    max_concurrency: int = 1,
+    n_slices: int = 32,
 ) -> DataFrame:
-    event_functions = {
-        "deposit": extract_deposit,
-        "redeemUnderlying": extract_redeemUnderlying,
-        "borrow": extract_borrow,
-        "usageAsCollateral": extract_usageAsCollateral,
-        "repay": extract_repay,
-        "flashloan": extract_flashloan,
-        "liquidationCall": extract_liquidationCall,
-    }
+    """
+    Fetches all the `event` items with timestamp_min < timestamp < timestamp_max.
 
-    try:
-        extraction_function = event_functions[event]
-    except KeyError:
-        raise ValueError(f"Unknown event type: {event}")
+    With max_concurrency > 1, the window is split in `n_slices` sub-windows that
+    are paginated concurrently by `fetch_events_async`.
 
-    events_data = pd.DataFrame()
-    for iter in range(max_queries):
-        if verbose:
-            if iter % 10 == 0:
-                print(f"      [Iteration {iter + 1}/{max_queries}]")
-        query_output = extraction_function(
+    Args:
+        api_endpoint (str): The SubGraph endpoint url
+        size (int): The number of items per query
+        max_queries (int): The maximum number of queries (per sub-window in async mode)
+        timestamp_min (int): Used to filter items with a greater timestamp
+        timestamp_max (int): Used to filter items with a lower timestamp
+        event (str): The event type, one of the keys of `event_queries`
+        version_2 (bool): Whether the endpoint is the Aave V2 subgraph
+        verbose (bool): Wether to print execution details
+        max_concurrency (int): The maximum number of queries in flight
+        n_slices (int): The number of sub-windows in async mode
+    Returns:
+        DataFrame: The events, ordered by id.
+    """
+    if max_concurrency > 1:
+        return asyncio.run(
+            fetch_events_async(
+                api_endpoint=api_endpoint,
+                size=size,
+                max_queries=max_queries,
+                timestamp_min=timestamp_min,
+                timestamp_max=timestamp_max,
+                event=event,
+                version_2=version_2,
+                verbose=verbose,
+                max_concurrency=max_concurrency,
+                n_slices=n_slices,
+            )
+        )
+
+    events_buffer = PageBuffer(event_fields(event, version_2))
+    pages = paginate(
+        fetch_page=lambda last_id: extract_event(
             api_endpoint=api_endpoint,
+            event=event,
             size=size,
-            offset=iter * size,
+            last_id=last_id,
             timestamp_min=timestamp_min,
             timestamp_max=timestamp_max,
-            version_2 = version_2,
+            version_2=version_2,
+        ),
+        size=size,
+        max_queries=max_queries,
+        verbose=verbose,
+    )
+    for page in pages:
+        events_buffer.append(page)
+    return events_buffer.to_frame()
+
+
+async def fetch_events_async(
+    api_endpoint: str,
+    size: int,
+    max_queries: int,
+    timestamp_min: int,
+    timestamp_max: int,
+    event: str,
+    version_2: bool = False,
+    verbose: bool = False,
+    max_concurrency: int = 8,
+    n_slices: int = 32,
+) -> DataFrame:
+    """
+    Async version of `fetch_events`: the window is split in `n_slices` time
+    sub-windows, each one paginated on its own cursor, with at most
+    `max_concurrency` queries in flight. Returns once every sub-window is exhausted.
+
+    Returns:
+        DataFrame: The events, ordered by id (same output as `fetch_events`).
+    """
+    step = -(-(int(timestamp_max) - int(timestamp_min)) // n_slices)
+    windows = time_windows(timestamp_min, timestamp_max, step=max(step, 1))
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async with get_async_client(max_connections=max_concurrency) as client:
+
+        async def fetch_page(last_id: str, window: tuple[int, int]) -> list[dict]:
+            async with semaphore:
+                return await extract_event_async(
+                    client=client,
+                    api_endpoint=api_endpoint,
+                    event=event,
+                    size=size,
+                    last_id=last_id,
+                    timestamp_min=window[0],
+                    timestamp_max=window[1],
+                    version_2=version_2,
+                )
+
+        async def fetch_window(window: tuple[int, int]) -> list[list[dict]]:
+            pages = await paginate_async(
+                fetch_page=lambda last_id: fetch_page(last_id, window),
+                size=size,
+                max_queries=max_queries,
+            )
+            if verbose:
+                print(f"      [Window {window}: {len(pages)} pages]")
+            return pages
+
+        windows_pages = await asyncio.gather(
+            *(fetch_window(window) for window in windows)
         )
-        current_events = pd.json_normalize(query_output)
-        if len(current_events) == 0:
-            print("All data has been already extracted")
-            break
-        events_data = pd.concat((events_data, current_events))
+
+    events_buffer = PageBuffer(event_fields(event, version_2))
+    for pages in windows_pages:
+        for page in pages:
+            events_buffer.append(page)
+    events_data = events_buffer.to_frame()
+    if len(events_data) > 0:
+        events_data = events_data.sort_values("id").reset_index(drop=True)
     return events_data
 
 
+def fetch_events_batched(
+    api_endpoint: str,
+    size: int,
+    max_queries: int,
+    timestamp_min: int,
+    timestamp_max: int,
+    events: list[str],
+    version_2: bool = False,
+    verbose: bool = False,
+) -> dict[str, DataFrame]:
+    """
+    Fetches several event types at once: each query requests one page of every
+    event type that is not exhausted yet, using GraphQL aliases (the event names).
+    Each event type advances on its own id cursor until it is exhausted.
+
+    Args:
+        api_endpoint (str): The SubGraph endpoint url
+        size (int): The number of items per event type and per query
+        max_queries (int): The maximum number of queries
+        timestamp_min (int): Used to filter items with a greater timestamp
+        timestamp_max (int): Used to filter items with a lower timestamp
+        events (list[str]): The event types, keys of `event_queries`
+        version_2 (bool): Whether the endpoint is the Aave V2 subgraph
+        verbose (bool): Wether to print execution details
+    Returns:
+        dict[str, DataFrame]: The events of each type, ordered by id.
+    """
+    cursors = {event: "" for event in events}
+    events_buffers = {
+        event: PageBuffer(event_fields(event, version_2)) for event in events
+    }
+    remaining_events = list(events)
+    for iter in range(max_queries):
+        if len(remaining_events) == 0:
+            break
+        if verbose:
+            if iter % 10 == 0:
+                print(
+                    f"      [Iteration {iter + 1}/{max_queries}, {len(remaining_events)} event types]"
+                )
+        query_blocks = list()
+        for event in remaining_events:
+            _, query_block = get_event_query(event)(
+                size=size,
+                last_id=cursors[event],
+                timestamp_min=timestamp_min,
+                timestamp_max=timestamp_max,
+                version_2=version_2,
+            )
+            query_blocks.append(f"{event}: {query_block}")
+        query = "\u007b " + "\n".join(query_blocks) + " \u007d"
+        query_output = run_query(
+            api=api_endpoint, query=query, cacheable=is_closed_window(timestamp_max)
+        )["data"]
+        for event in list(remaining_events):
+            page = query_output[event]
+            events_buffers[event].append(page)
+            if len(page) < size:
+                remaining_events.remove(event)
+            else:
+                cursors[event] = page[-1]["id"]
+    if len(remaining_events) == 0:
+        print("All data has been already extracted")
+    return {event: events_buffers[event].to_frame() for event in events}
+
+
 def clean_events_data(
     event_name: str, events_data: DataFrame, logger: Logger
 ) -> DataFrame:
@@ -382,9 +605,7 @@ def clean_events_data(
 
     if event_name not in ["liquidationCall", "usageAsCollateral"]:
         clean_data.reserve_decimals = clean_data.reserve_decimals.astype(int)
-        clean_data.amount = (
-            clean_data.amount.apply(int) / 10**clean_data.reserve_decimals
-        )
+        clean_data.amount = to_units(clean_data.amount, clean_data.reserve_decimals)
 
     if event_name == "liquidationCall":
         clean_data.collateral_reserve_decimals = (
@@ -393,13 +614,11 @@ def clean_events_data(
         clean_data.principal_reserve_decimals = (
             clean_data.principal_reserve_decimals.astype(int)
         )
-        clean_data.collateralAmount = (
-            clean_data.collateralAmount.apply(int)
-            / 10**clean_data.collateral_reserve_decimals
+        clean_data.collateralAmount = to_units(
+            clean_data.collateralAmount, clean_data.collateral_reserve_decimals
         )
-        clean_data.principalAmount = (
-            clean_data.principalAmount.apply(int)
-            / 10**clean_data.principal_reserve_decimals
+        clean_data.principalAmount = to_units(
+            clean_data.principalAmount, clean_data.principal_reserve_decimals
         )
 
     clean_data_ = clean_data.drop_duplicates()
@@ -2,36 +2,37 @@
 
 import pandas as pd
 from pandas import DataFrame
-from ..utils.utils import run_query
+from ..utils.utils import run_query, is_closed_window
+from ..utils.pagination import paginate
+from ..utils.page_buffer import PageBuffer
+from ..utils.graphql import selection_paths
 
 
-def run_query_prices_v3(
-    api_endpoint: str,
+def prices_query_v3(
     size: int,
-    offset: int,
+    last_id: str,
     timestamp_min: int,
     timestamp_max: int,
-) -> dict:
+) -> str:
     """
-    Calls the `run_query` function to query the prices data.
+    Builds the query of the prices data.
 
     Args:
-        api_endpoint (str): The SubGraph endpoint url
         size (int): The number of items per query
-        offset (int): The number of items to skip to start the query
+        last_id (str): The id of the last item already fetched (query starts after it)
         timestamp_min (int): Used to filter items with a greater timestamp
         timestamp_max (int): Used to filter items with a greater timestamp
     Returns:
-        dict: the output of the query
+        str: the query
     """
-    query = f"""
+    return f"""
         \u007b
             marketHourlySnapshots(
                 first: {size},
-                skip: {offset},
-                orderBy: timestamp,
-                orderDirection: desc,
+                orderBy: id,
+                orderDirection: asc,
                 where: \u007b
+                    id_gt: "{last_id}"
                     timestamp_lt: {timestamp_max}
                     timestamp_gt: {timestamp_min}
                 \u007d
@@ -52,7 +53,36 @@ def run_query_prices_v3(
             \u007d
         \u007d
     """
-    return run_query(api=api_endpoint, query=query)
+
+
+def run_query_prices_v3(
+    api_endpoint: str,
+    size: int,
+    last_id: str,
+    timestamp_min: int,
+    timestamp_max: int,
+) -> dict:
+    """
+    Calls the `run_query` function to query the prices data.
+
+    Args:
+        api_endpoint (str): The SubGraph endpoint url
+        size (int): The number of items per query
+        last_id (str): The id of the last item already fetched (query starts after it)
+        timestamp_min (int): Used to filter items with a greater timestamp
+        timestamp_max (int): Used to filter items with a greater timestamp
+    Returns:
+        dict: the output of the query
+    """
+    query = prices_query_v3(
+        size=size,
+        last_id=last_id,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+    )
+    return run_query(
+        api=api_endpoint, query=query, cacheable=is_closed_window(timestamp_max)
+    )
 
 
 def fetch_hourly_prices(
@@ -64,8 +94,8 @@ def fetch_hourly_prices(
     verbose: bool = False,
 ) -> DataFrame:
     """
-    Calls `run_query_prices_v3` in a loop and returns the concatenated outputs
-    in a dataframe.
+    Calls `run_query_prices_v3` in a loop (keyset pagination on `id`) and
+    returns the concatenated outputs in a dataframe.
 
     Args:
         api_endpoint (str): The SubGraph endpoint url
@@ -77,26 +107,25 @@ def fetch_hourly_prices(
     Returns:
         DataFrame: The dataframe containing the concatenated outputs of the queries.
     """
-    users_balances = pd.DataFrame()
-    for iter in range(max_queries):
-        if verbose:
-            if iter % 10 == 0:
-                print(f"      [Iteration {iter + 1}/{max_queries}]")
-        query_output = run_query_prices_v3(
+    fields = selection_paths(
+        prices_query_v3(size, "", timestamp_min, timestamp_max)
+    )["marketHourlySnapshots"]
+    prices_buffer = PageBuffer(fields)
+    pages = paginate(
+        fetch_page=lambda last_id: run_query_prices_v3(
             api_endpoint=api_endpoint,
             size=size,
-            offset=iter * size,
+            last_id=last_id,
             timestamp_min=timestamp_min,
             timestamp_max=timestamp_max,
-        )
-        current_balances = pd.json_normalize(
-            query_output["data"]["marketHourlySnapshots"]
-        )
-        if len(current_balances) == 0:
-            print("All data has been already extracted")
-            break
-        users_balances = pd.concat((users_balances, current_balances))
-    return users_balances
+        )["data"]["marketHourlySnapshots"],
+        size=size,
+        max_queries=max_queries,
+        verbose=verbose,
+    )
+    for page in pages:
+        prices_buffer.append(page)
+    return prices_buffer.to_frame()
 
 
 def clean_prices_data(prices_raw_data: DataFrame) -> DataFrame:
@@ -2,11 +2,18 @@
 
 from dotenv import load_dotenv
 import os
+from typing import Optional
 import pandas as pd
 from pandas import DataFrame
 import numpy as np
 from ..utils.logger import Logger
-from ..utils.utils import run_query
+from ..utils.utils import run_query, is_closed_window
+from ..utils.units import parse_integers, to_units, RAY
+from ..utils.fixed_point import add_fixed_columns, parse_fixed
+from ..utils.pagination import paginate
+from ..utils.page_buffer import PageBuffer
+from ..utils.graphql import selection_paths
+from .reserves_tail_state import ReservesTailState
 
 load_dotenv()
 
@@ -26,17 +33,29 @@ outliers_index_threshold = {
     "Aave Token": 5e-3,
 }
 
-
-def run_query_reserves_statistics_protocol_v3(
-    size: int, offset: int, timestamp_min: int, timestamp_max: int
-) -> dict:
-    query = f"""
+# Columns also kept as exact fixed-point values by `convert_units(exact=True)`
+exact_columns = [
+    "liquidityIndex",
+    "variableBorrowIndex",
+    "totalATokenSupply",
+    "accruedToTreasury",
+    "availableLiquidity",
+    "totalCurrentVariableDebt",
+]
+
+
+def reserves_statistics_query_protocol_v3(
+    size: int, last_id: str, timestamp_min: int, timestamp_max: int
+) -> str:
+    return f"""
         \u007b
             reserveParamsHistoryItems(
                 first: {size},
-                skip: {offset},
-                where: \u007b timestamp_gt: {timestamp_min}, timestamp_lt: {timestamp_max} \u007d
+                orderBy: id,
+                orderDirection: asc,
+                where: \u007b id_gt: "{last_id}", timestamp_gt: {timestamp_min}, timestamp_lt: {timestamp_max} \u007d
             ) \u007b
+                id
                 reserve \u007b
                     name
                     pool \u007b
@@ -64,19 +83,34 @@ def run_query_reserves_statistics_protocol_v3(
             \u007d
         \u007d
     """
-    return run_query(api_endpoint_v3, query)
 
 
-def run_query_reserves_statistics_protocol_v2(
-    size: int, offset: int, timestamp_min: int, timestamp_max: int
+def run_query_reserves_statistics_protocol_v3(
+    size: int, last_id: str, timestamp_min: int, timestamp_max: int
 ) -> dict:
-    query = f"""
+    query = reserves_statistics_query_protocol_v3(
+        size=size,
+        last_id=last_id,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+    )
+    return run_query(
+        api_endpoint_v3, query, cacheable=is_closed_window(timestamp_max)
+    )
+
+
+def reserves_statistics_query_protocol_v2(
+    size: int, last_id: str, timestamp_min: int, timestamp_max: int
+) -> str:
+    return f"""
         \u007b
             reserveParamsHistoryItems(
                 first: {size},
-                skip: {offset},
-                where: \u007b timestamp_gt: {timestamp_min}, timestamp_lt: {timestamp_max} \u007d
+                orderBy: id,
+                orderDirection: asc,
+                where: \u007b id_gt: "{last_id}", timestamp_gt: {timestamp_min}, timestamp_lt: {timestamp_max} \u007d
             ) \u007b
+                id
                 reserve \u007b
                     name
                     decimals
@@ -100,7 +134,20 @@ def run_query_reserves_statistics_protocol_v2(
             \u007d
         \u007d
     """
-    return run_query(api_endpoint_v2, query)
+
+
+def run_query_reserves_statistics_protocol_v2(
+    size: int, last_id: str, timestamp_min: int, timestamp_max: int
+) -> dict:
+    query = reserves_statistics_query_protocol_v2(
+        size=size,
+        last_id=last_id,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+    )
+    return run_query(
+        api_endpoint_v2, query, cacheable=is_closed_window(timestamp_max)
+    )
 
 
 def fetch_reserves_data(
@@ -111,33 +158,31 @@ def fetch_reserves_data(
     version_2: bool = False,
     verbose: bool = False,
 ) -> DataFrame:
-    reserves_table = pd.DataFrame()
-    for iter in range(n_iter):
-        if verbose:
-            if iter % 10 == 0:
-                print(f"      [Iteration {iter + 1}/{n_iter}]")
-        if version_2:
-            query_output = run_query_reserves_statistics_protocol_v2(
-                size=size,
-                offset=iter * size,
-                timestamp_min=timestamp_min,
-                timestamp_max=timestamp_max,
-            )
-        else:
-            query_output = run_query_reserves_statistics_protocol_v3(
-                size=size,
-                offset=iter * size,
-                timestamp_min=timestamp_min,
-                timestamp_max=timestamp_max,
-            )
-        current_reserves_table = pd.json_normalize(
-            query_output["data"]["reserveParamsHistoryItems"]
-        )
-        if len(current_reserves_table) == 0:
-            print("All data has been already extracted")
-            break
-        reserves_table = pd.concat((reserves_table, current_reserves_table))
-    return reserves_table
+    if version_2:
+        reserves_statistics_query = reserves_statistics_query_protocol_v2
+        run_query_reserves_statistics = run_query_reserves_statistics_protocol_v2
+    else:
+        reserves_statistics_query = reserves_statistics_query_protocol_v3
+        run_query_reserves_statistics = run_query_reserves_statistics_protocol_v3
+
+    fields = selection_paths(
+        reserves_statistics_query(size, "", timestamp_min, timestamp_max)
+    )["reserveParamsHistoryItems"]
+    reserves_buffer = PageBuffer(fields)
+    pages = paginate(
+        fetch_page=lambda last_id: run_query_reserves_statistics(
+            size=size,
+            last_id=last_id,
+            timestamp_min=timestamp_min,
+            timestamp_max=timestamp_max,
+        )["data"]["reserveParamsHistoryItems"],
+        size=size,
+        max_queries=n_iter,
+        verbose=verbose,
+    )
+    for page in pages:
+        reserves_buffer.append(page)
+    return reserves_buffer.to_frame()
 
 
 def convert_units(
@@ -145,8 +190,24 @@ def convert_units(
     logger: Logger,
     version_2: bool = False,
     verbose: bool = True,
+    exact: bool = False,
 ) -> DataFrame:
-    reserves_history = reserves_table.copy()
+    """
+    Cleans the raw reserves data and converts the amounts to token units, and
+    the rates and indexes from rays.
+
+    Args:
+        reserves_table (DataFrame): The output of `fetch_reserves_data`
+        logger (Logger): The logger
+        version_2 (bool): Whether the data comes from the Aave V2 subgraph
+        verbose (bool): Whether to print logs
+        exact (bool): Whether to also keep the raw integer values of the
+            `exact_columns` in the `{column}_hi` and `{column}_lo` fixed-point
+            columns (see `utils.fixed_point`), used by the quality checks
+    Returns:
+        DataFrame: The converted reserves data.
+    """
+    reserves_history = reserves_table.drop(columns="id", errors="ignore")
     reserves_history = reserves_history.reset_index(drop=True)
     reserves_history = reserves_history.drop_duplicates()
     if verbose:
@@ -178,54 +239,60 @@ def convert_units(
 
     reserves_history = reserves_history.astype(columns_types)
 
+    if exact:
+        for column in exact_columns:
+            if column in reserves_history.columns:
+                add_fixed_columns(
+                    reserves_history, column, parse_fixed(reserves_history[column])
+                )
+
     # Change units
-    reserves_history.reserve_decimals = reserves_history.reserve_decimals.apply(int)
+    reserves_history.reserve_decimals = reserves_history.reserve_decimals.astype(
+        np.int64
+    )
 
     if not version_2:
-        reserves_history.accruedToTreasury = (
-            reserves_history.accruedToTreasury.apply(int)
-            / 10**reserves_history.reserve_decimals
+        reserves_history.accruedToTreasury = to_units(
+            reserves_history.accruedToTreasury, reserves_history.reserve_decimals
         )
 
-    reserves_history.availableLiquidity = (
-        reserves_history.availableLiquidity.apply(int)
-        / 10**reserves_history.reserve_decimals
+    reserves_history.availableLiquidity = to_units(
+        reserves_history.availableLiquidity, reserves_history.reserve_decimals
     )
     reserves_history.averageStableBorrowRate = (
-        reserves_history.averageStableBorrowRate.apply(int) * 1e-27
+        parse_integers(reserves_history.averageStableBorrowRate) * RAY
+    )
+    reserves_history.liquidityIndex = (
+        parse_integers(reserves_history.liquidityIndex) * RAY
+    )
+    reserves_history.liquidityRate = (
+        parse_integers(reserves_history.liquidityRate) * RAY
     )
-    reserves_history.liquidityIndex = reserves_history.liquidityIndex.apply(int) * 1e-27
-    reserves_history.liquidityRate = reserves_history.liquidityRate.apply(int) * 1e-27
     reserves_history.priceInEth = reserves_history.priceInEth.apply(int)
     reserves_history.stableBorrowRate = (
-        reserves_history.stableBorrowRate.apply(int) * 1e-27
+        parse_integers(reserves_history.stableBorrowRate) * RAY
     )
 
-    reserves_history.totalATokenSupply = (
-        reserves_history.totalATokenSupply.apply(int)
-        / 10**reserves_history.reserve_decimals
+    reserves_history.totalATokenSupply = to_units(
+        reserves_history.totalATokenSupply, reserves_history.reserve_decimals
     )
-    reserves_history.totalCurrentVariableDebt = (
-        reserves_history.totalCurrentVariableDebt.apply(int)
-        / 10**reserves_history.reserve_decimals
+    reserves_history.totalCurrentVariableDebt = to_units(
+        reserves_history.totalCurrentVariableDebt, reserves_history.reserve_decimals
     )
-    reserves_history.totalLiquidity = (
-        reserves_history.totalLiquidity.apply(int)
-        / 10**reserves_history.reserve_decimals
+    reserves_history.totalLiquidity = to_units(
+        reserves_history.totalLiquidity, reserves_history.reserve_decimals
     )
-    reserves_history.totalPrincipalStableDebt = (
-        reserves_history.totalPrincipalStableDebt.apply(int)
-        / 10**reserves_history.reserve_decimals
+    reserves_history.totalPrincipalStableDebt = to_units(
+        reserves_history.totalPrincipalStableDebt, reserves_history.reserve_decimals
     )
-    reserves_history.totalScaledVariableDebt = (
-        reserves_history.totalScaledVariableDebt.apply(int)
-        / 10**reserves_history.reserve_decimals
+    reserves_history.totalScaledVariableDebt = to_units(
+        reserves_history.totalScaledVariableDebt, reserves_history.reserve_decimals
     )
     reserves_history.variableBorrowIndex = (
-        reserves_history.variableBorrowIndex.apply(int) * 1e-27
+        parse_integers(reserves_history.variableBorrowIndex) * RAY
     )
     reserves_history.variableBorrowRate = (
-        reserves_history.variableBorrowRate.apply(int) * 1e-27
+        parse_integers(reserves_history.variableBorrowRate) * RAY
     )
 
     return reserves_history
@@ -236,63 +303,84 @@ def get_hourly_granularity(
     logger: Logger,
     version_2: bool = False,
     verbose: bool = True,
+    tail_state: Optional[ReservesTailState] = None,
 ) -> DataFrame:
+    """
+    Keeps the last row of each (reserve, hour), after removing the index
+    outliers for the V2 reserves.
+
+    For V2, the rows are sorted once by reserve and timestamp (with a stable
+    sort, so the ties keep their original order) and the outliers are flagged
+    on the slices of each reserve, without building a dataframe per reserve.
+    The last row of each hour is then selected with a single groupby on
+    integer keys.
+
+    Args:
+        reserves_table (DataFrame): The output of `convert_units`
+        logger (Logger): The logger
+        version_2 (bool): Whether the data comes from the Aave V2 subgraph
+        verbose (bool): Whether to print logs
+        tail_state (ReservesTailState, optional): The state of the previous
+            month. With V2, the filters start from its last valid indexes
+            instead of restarting on the first rows of the month.
+    Returns:
+        DataFrame: The hourly reserves data. With V2, the rows are ordered by
+            reserve and timestamp, otherwise they keep their original order.
+    """
     reserves_history = reserves_table.copy()
     reserves_history["datetime"] = pd.to_datetime(
         reserves_history.timestamp, unit="s", utc=True
     ).dt.floor("h")
+    if len(reserves_history) == 0:
+        return reserves_history
+
+    reserve_codes, reserve_names = pd.factorize(reserves_history.reserve_name)
+    timestamps = reserves_history.timestamp.to_numpy(dtype=np.int64)
+    positions = np.arange(len(reserves_history))
 
     if version_2:
-        reserves_history_ = DataFrame()
-        for reserve_name in reserves_history.reserve_name.unique().tolist():
-            reserve_asset = reserves_history[
-                reserves_history.reserve_name == reserve_name
-            ]
-            reserve_asset = reserve_asset.sort_values(["datetime"])
-            reserve_asset = flag_outlier_indexes(
-                reserves_data=reserve_asset,
-                column_name="liquidityIndex",
-                variation_threshold=outliers_index_threshold[reserve_name],
-            )
-            reserve_asset = flag_outlier_indexes(
-                reserves_data=reserve_asset,
-                column_name="variableBorrowIndex",
-                variation_threshold=outliers_index_threshold[reserve_name],
-            )
-            reserves_history_ = pd.concat((reserves_history_, reserve_asset))
-        assert len(reserves_history_) == len(reserves_history)
-        reserves_history = reserves_history_
-        reserves_history = reserves_history[
-            reserves_history.is_not_outlier_liquidityIndex
-        ]
-        reserves_history = reserves_history[
-            reserves_history.is_not_outlier_variableBorrowIndex
-        ]
-        reserves_history = reserves_history.drop(
-            columns=[
-                "is_not_outlier_liquidityIndex",
-                "is_not_outlier_variableBorrowIndex",
-            ]
+        # Sort by reserve, in order of appearance, then by timestamp
+        positions = np.argsort(
+            reserve_codes.astype(np.int64) * 2**40 + timestamps, kind="stable"
         )
+        codes = reserve_codes[positions]
+        group_starts = np.flatnonzero(np.diff(codes, prepend=-1))
+        group_ends = np.append(group_starts[1:], len(codes))
+        is_not_outlier = np.ones(len(positions), dtype=bool)
+        for column_name in ["liquidityIndex", "variableBorrowIndex"]:
+            index_data = reserves_history[column_name].to_numpy()[positions]
+            for group_start, group_end in zip(group_starts, group_ends):
+                reserve_name = reserve_names[codes[group_start]]
+                is_not_outlier[group_start:group_end] &= outlier_mask(
+                    index_data[group_start:group_end],
+                    outliers_index_threshold[reserve_name],
+                    last_valid_value=(
+                        tail_state.last_index(reserve_name, column_name)
+                        if tail_state is not None
+                        else None
+                    ),
+                )
+        n_rows = len(positions)
+        positions = positions[is_not_outlier]
         if verbose:
             logger.log(
-                f"      --> Dropped {len(reserves_history_) - len(reserves_history)} lines when removing indexes outliers"
+                f"      --> Dropped {n_rows - len(positions)} lines when removing indexes outliers"
             )
 
-    # Keep Hour Granularity
-    reserves_history_last_data_per_hour = reserves_history.groupby(
-        ["reserve_name", "datetime"]
-    )["timestamp"].transform("max")
-    reserves_history_last_data_per_hour_mask = (
-        reserves_history.timestamp == reserves_history_last_data_per_hour
-    )
-    reserves_history_hourly = reserves_history[reserves_history_last_data_per_hour_mask]
-    reserves_history_hourly = reserves_history_hourly.drop_duplicates(
-        subset=["reserve_name", "datetime"]
+    # Keep Hour Granularity: the row with the last timestamp of each (reserve,
+    # hour), the first one in case of ties
+    timestamps = timestamps[positions]
+    hourly_keys = reserve_codes[positions].astype(np.int64) * 2**32 + timestamps // 3600
+    last_timestamps = (
+        pd.Series(timestamps).groupby(hourly_keys).transform("max").to_numpy()
     )
+    is_last = timestamps == last_timestamps
+    is_duplicate = pd.Series(hourly_keys[is_last]).duplicated().to_numpy()
+    hourly_positions = positions[is_last][~is_duplicate]
+    reserves_history_hourly = reserves_history.iloc[hourly_positions]
     if verbose:
         logger.log(
-            f"      --> Dropped {len(reserves_history) - len(reserves_history_hourly)} rows when getting the hour granularity"
+            f"      --> Dropped {len(positions) - len(reserves_history_hourly)} rows when getting the hour granularity"
         )
         logger.log(f"      --> Total of {len(reserves_history_hourly)} rows")
     return reserves_history_hourly
@@ -320,87 +408,189 @@ def flag_outlier_indexes(
             that flags outliers.
     """
     fixed_reserves_data = reserves_data.sort_values("timestamp").reset_index(drop=True)
-    if start >= 7:
-        return flag_outlier_indexes(
-            reserves_data,
-            column_name,
-            variation_threshold,
-            start=0,
-            force=True,
+    fixed_reserves_data[f"is_not_outlier_{column_name}"] = outlier_mask(
+        fixed_reserves_data[column_name].to_numpy(),
+        variation_threshold,
+        start=start,
+        force=force,
+    )
+    return fixed_reserves_data
+
+
+def outlier_mask(
+    index_data: np.ndarray,
+    variation_threshold: float,
+    start: int = 1,
+    force: bool = False,
+    last_valid_value: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Flags the outliers of an index with False (see `outlier_filter_mask`). The
+    filter restarts from the next row while it keeps 15 values or less, and
+    from the first row (whatever the outcome) after the 7th row.
+
+    Args:
+        index_data (np.ndarray): The index values, ordered by timestamp
+        variation_threshold (float): The maximum variation of the index
+        start (int): The first row of the first attempt
+        force (bool): Whether to keep the first attempt anyway
+        last_valid_value (float, optional): The last kept value of the previous
+            month. If given, the filter continues from it, in a single attempt.
+    Returns:
+        np.ndarray: The mask of the kept rows.
+    """
+    if last_valid_value is not None:
+        return outlier_filter_mask(
+            np.append(last_valid_value, index_data), 0, variation_threshold
+        )[1:]
+    for candidate_start in range(start, 7):
+        filter_mask = outlier_filter_mask(
+            index_data, candidate_start, variation_threshold
         )
+        if np.sum(filter_mask) > 15 or force:
+            return filter_mask
+    return outlier_filter_mask(index_data, 0, variation_threshold)
 
-    n = len(fixed_reserves_data)
-    index_data = fixed_reserves_data[column_name]
-    filter_mask = np.ones(n, dtype=bool)
-    filter_mask[:start] = False
-    last_valid_value = index_data[start]
-    for current_position in range(start + 1, n):
-        current_value = index_data[current_position]
-        if (current_value < last_valid_value) or (
-            abs(current_value - last_valid_value) > variation_threshold
-        ):
-            filter_mask[current_position] = False
-        else:
-            last_valid_value = current_value
-
-    # Remove
-    if np.sum(filter_mask) > 15 or force:
-        fixed_reserves_data[f"is_not_outlier_{column_name}"] = filter_mask
-        return fixed_reserves_data
-    else:
-        return flag_outlier_indexes(
-            reserves_data,
-            column_name,
-            variation_threshold,
-            start=start + 1,
-            force=False,
+
+def outlier_filter_mask(
+    index_data: np.ndarray, start: int, variation_threshold: float
+) -> np.ndarray:
+    """
+    Running filter of `flag_outlier_indexes`: starting from the row `start`, a
+    value is kept if it is not lower than the last kept value, and not higher
+    by more than `variation_threshold`. The rows before `start` are flagged.
+
+    Instead of walking the rows one by one, the consecutive values that pass
+    the test against the previous row are kept by slices; only the rejected
+    rows are handled separately, by searching the next value that passes the
+    test against the last kept value.
+
+    Args:
+        index_data (np.ndarray): The index values, ordered by timestamp
+        start (int): The first row, always kept
+        variation_threshold (float): The maximum variation of the index
+    Returns:
+        np.ndarray: The mask of the kept rows.
+    """
+
+    def is_kept(current_values, last_valid_values):
+        return ~(
+            (current_values < last_valid_values)
+            | (np.abs(current_values - last_valid_values) > variation_threshold)
         )
 
+    n = len(index_data)
+    filter_mask = np.zeros(n, dtype=bool)
+    if start >= n:
+        return filter_mask
+    # The rows rejected when the previous row is kept, followed by n
+    breaks = np.append(
+        np.flatnonzero(~is_kept(index_data[1:], index_data[:-1])) + 1, n
+    )
+    filter_mask[start] = True
+    position = start + 1
+    while position < n:
+        # The previous row is kept, so are the rows up to the next break
+        next_break = breaks[np.searchsorted(breaks, position)]
+        filter_mask[position:next_break] = True
+        if next_break == n:
+            break
+        # Search the next value kept against the last kept value, in windows
+        # of increasing size
+        last_valid_value = index_data[next_break - 1]
+        position = next_break + 1
+        window = 64
+        while position < n:
+            kept = np.flatnonzero(
+                is_kept(index_data[position : position + window], last_valid_value)
+            )
+            if len(kept) > 0:
+                position += kept[0]
+                break
+            position += window
+            window *= 2
+        if position >= n:
+            break
+        filter_mask[position] = True
+        position += 1
+    return filter_mask
+
 
 def fill_missing_data(
-    hourly_reserves_snapshots: DataFrame, logger: Logger, verbose: bool = True
+    hourly_reserves_snapshots: DataFrame,
+    logger: Logger,
+    verbose: bool = True,
+    tail_state: Optional[ReservesTailState] = None,
 ) -> DataFrame:
-    starting_datetime = min(pd.to_datetime(hourly_reserves_snapshots.datetime))
-    ending_datetime = max(pd.to_datetime(hourly_reserves_snapshots.datetime))
+    """
+    Completes the hourly snapshots into a (reserve, hour) panel, from the first
+    to the last hour of the data: the missing hours are filled with the last
+    available data of the reserve, and flagged with `true_value` = 0.
+
+    The snapshots are indexed by (reserve_name, regular_datetime) and
+    reindexed on the full panel at once, then forward filled per reserve.
+
+    Args:
+        hourly_reserves_snapshots (DataFrame): The output of
+            `get_hourly_granularity`
+        logger (Logger): The logger
+        verbose (bool): Whether to print logs
+        tail_state (ReservesTailState, optional): The state of the previous
+            month. The hours before the first snapshot of a reserve are filled
+            with its last row, instead of being left empty.
+    Returns:
+        DataFrame: The panel, with the `regular_datetime` and `true_value`
+            columns, ordered by reserve and hour.
+    """
+    datetimes = pd.to_datetime(hourly_reserves_snapshots.datetime)
+    starting_datetime = datetimes.min()
+    ending_datetime = datetimes.max()
     if verbose:
         logger.log(f"      --> Minimum datetime: {starting_datetime}")
         logger.log(f"      --> Maximum datetime: {ending_datetime}")
     reserves_list = hourly_reserves_snapshots.reserve_name.unique()
-    regular_outputs_list = list()
-    # current_hour = starting_datetime
     delta_hours = int((ending_datetime - starting_datetime).total_seconds() / 3600)
-    output_datetimes_list = [
-        starting_datetime + pd.Timedelta(hours=k) for k in range(delta_hours + 1)
-    ]
-    base_output = DataFrame({"regular_datetime": output_datetimes_list})
-    for reserve in reserves_list:
-        if verbose:
+    output_datetimes = pd.date_range(
+        starting_datetime, periods=delta_hours + 1, freq="h"
+    )
+    assert not hourly_reserves_snapshots.assign(datetime=datetimes).duplicated(
+        ["reserve_name", "datetime"]
+    ).any(), "Same datetime appears several times for a given asset"
+    if verbose:
+        rows_per_reserve = hourly_reserves_snapshots.reserve_name.value_counts()
+        for reserve in reserves_list:
             logger.log(f"      --> Reserve_name: {reserve}")
-        reserve_data = hourly_reserves_snapshots[
-            hourly_reserves_snapshots.reserve_name == reserve
-        ]
-        assert len(reserve_data.datetime.unique()) == len(
-            reserve_data.datetime
-        ), "Same datetime appears several times for a given asset"
-        if verbose:
             logger.log(
-                f"      --> {len(base_output) - len(reserve_data)} rows are missing"
+                f"      --> {len(output_datetimes) - rows_per_reserve[reserve]} rows are missing"
             )
-        # reserve_data = reserve_data.sort_values("datetime").reset_index(drop=True)
-        reserve_output = base_output.merge(
-            reserve_data, how="left", left_on="regular_datetime", right_on="datetime"
-        )
-        reserve_output = reserve_output.infer_objects(copy=False).ffill()
-        reserve_output.reserve_name = reserve
 
-        # Add a "filled_value" flag
-        true_values = DataFrame(
-            {"regular_datetime": reserve_data.datetime, "true_value": 1}
-        )
-        reserve_output = reserve_output.merge(
-            true_values, how="left", on="regular_datetime"
+    panel_index = pd.MultiIndex.from_product(
+        [reserves_list, output_datetimes], names=["reserve_name", "regular_datetime"]
+    )
+    snapshots = hourly_reserves_snapshots.drop(columns="datetime")
+    snapshots.index = pd.MultiIndex.from_arrays(
+        [snapshots.reserve_name, datetimes], names=panel_index.names
+    )
+    panel = snapshots.reindex(panel_index).infer_objects(copy=False)
+    n_seeds = 0
+    if tail_state is not None:
+        # The last rows of the previous month, one hour before the panel, so
+        # that the forward fill carries them
+        seeds = tail_state.seed_rows(list(reserves_list), panel.dtypes)
+        n_seeds = len(seeds)
+        seeds.index = pd.MultiIndex.from_arrays(
+            [
+                seeds.index,
+                np.repeat(starting_datetime - pd.Timedelta(hours=1), n_seeds),
+            ],
+            names=panel_index.names,
         )
-        reserve_output[["true_value"]] = reserve_output[["true_value"]].fillna(value=0)
-        reserve_output = reserve_output.drop(columns="datetime")
-        regular_outputs_list.append(reserve_output)
-    return pd.concat(regular_outputs_list)
+        panel = pd.concat([seeds, panel])
+    panel = panel.groupby(level="reserve_name", sort=False).ffill().iloc[n_seeds:]
+    panel["reserve_name"] = panel_index.get_level_values("reserve_name")
+    panel.insert(
+        0, "regular_datetime", panel_index.get_level_values("regular_datetime")
+    )
+    panel["true_value"] = panel_index.isin(snapshots.index).astype(float)
+    panel.index = np.tile(np.arange(len(output_datetimes)), len(reserves_list))
+    return panel
@@ -1,12 +1,134 @@
 """Data quality check functions for the reserves features extraction"""
 
+from typing import Optional
 import pandas as pd
-from pandas import DataFrame, Timedelta
+from pandas import DataFrame
 import numpy as np
 from ..utils.logger import Logger
+from ..utils.fixed_point import (
+    fixed_add,
+    fixed_compare,
+    fixed_cummax,
+    fixed_scalar,
+    fixed_sub,
+    fixed_to_float,
+    get_fixed_columns,
+    has_fixed_columns,
+)
+from .reserves_tail_state import ReservesTailState
 
 logger = Logger()
 
+# 1 in rays
+RAY_ONE = 10**27
+# Number of hours in a month
+valid_lengths = [28 * 24, 29 * 24, 30 * 24, 31 * 24]
+balance_columns = [
+    "totalATokenSupply",
+    "accruedToTreasury",
+    "availableLiquidity",
+    "totalCurrentVariableDebt",
+]
+
+
+def exact_index_mask(
+    hourly_reserve: DataFrame, index_column: str, groups: np.ndarray
+) -> np.ndarray:
+    """
+    Exact version of the index condition, on the fixed-point columns kept by
+    `convert_units(exact=True)`: the index should be equal to its cummax (per
+    group), and higher than 1. The missing values do not pass, like NaNs.
+    """
+    index, valid = get_fixed_columns(hourly_reserve, index_column)
+    index = (index[0][valid], index[1][valid])
+    mask = np.zeros(len(valid), dtype=bool)
+    mask[valid] = (fixed_compare(index, fixed_cummax(index, groups[valid])) == 0) & (
+        fixed_compare(index, fixed_scalar(RAY_ONE, len(index[0]))) >= 0
+    )
+    return mask
+
+
+def exact_balance_mask(hourly_reserve: DataFrame) -> np.ndarray:
+    """
+    Exact version of the balance sheet condition: the equilibrium is computed
+    on the raw integer amounts, so that it does not suffer from cancellation.
+    """
+    amounts = dict()
+    valid = np.ones(len(hourly_reserve), dtype=bool)
+    for column in balance_columns:
+        amounts[column], column_valid = get_fixed_columns(hourly_reserve, column)
+        valid &= column_valid
+    assets = fixed_add(amounts["totalATokenSupply"], amounts["accruedToTreasury"])
+    balance_equilibrium = fixed_sub(
+        fixed_sub(assets, amounts["availableLiquidity"]),
+        amounts["totalCurrentVariableDebt"],
+    )
+    return valid & (
+        np.abs(fixed_to_float(balance_equilibrium)) <= 0.05 * fixed_to_float(assets)
+    )
+
+
+def quality_masks(hourly_reserve: DataFrame, version_2: bool = False) -> DataFrame:
+    """
+    Computes, for each row of the hourly reserves panel, whether it passes the
+    index, rate and balance sheet conditions of `reserve_data_quality_check`.
+    The index cummax is computed per reserve. The conditions are checked on
+    the exact fixed-point values when the panel has them (see `convert_units`).
+
+    Args:
+        hourly_reserve (DataFrame): The hourly reserves panel, with one or
+            several reserves
+        version_2 (bool): Whether the data comes from the Aave V2 subgraph,
+            which does not have the balance sheet condition
+    Returns:
+        DataFrame: The boolean masks `borrow_index`, `liquidity_index`,
+            `borrow_rate`, `liquidity_rate` and `balance` (except with V2), with
+            the same index as hourly_reserve.
+    """
+    groups = pd.factorize(hourly_reserve.reserve_name)[0]
+    masks = DataFrame(index=hourly_reserve.index)
+
+    exact_indexes = has_fixed_columns(
+        hourly_reserve, "variableBorrowIndex"
+    ) and has_fixed_columns(hourly_reserve, "liquidityIndex")
+    for mask_name, index_column in [
+        ("borrow_index", "variableBorrowIndex"),
+        ("liquidity_index", "liquidityIndex"),
+    ]:
+        if exact_indexes:
+            masks[mask_name] = exact_index_mask(hourly_reserve, index_column, groups)
+        else:
+            index = hourly_reserve[index_column].reset_index(drop=True)
+            masks[mask_name] = (
+                (index == index.groupby(groups).cummax()) & (index >= 1)
+            ).to_numpy()
+
+    for mask_name, rate_column in [
+        ("borrow_rate", "variableBorrowRate"),
+        ("liquidity_rate", "liquidityRate"),
+    ]:
+        rate = hourly_reserve[rate_column]
+        masks[mask_name] = ((rate >= 0) & (rate <= 1)).to_numpy()
+
+    if version_2:
+        return masks
+    if all(has_fixed_columns(hourly_reserve, column) for column in balance_columns):
+        masks["balance"] = exact_balance_mask(hourly_reserve)
+    else:
+        balance_equilibrium_threshold = 0.05 * (
+            hourly_reserve.totalATokenSupply + hourly_reserve.accruedToTreasury
+        )
+        balance_equilibrium = (
+            hourly_reserve.totalATokenSupply
+            + hourly_reserve.accruedToTreasury
+            - hourly_reserve.availableLiquidity
+            - hourly_reserve.totalCurrentVariableDebt
+        )
+        masks["balance"] = (
+            np.abs(balance_equilibrium) <= balance_equilibrium_threshold
+        ).to_numpy()
+    return masks
+
 
 def reserve_data_quality_check(
     hourly_asset_reserve_completed: DataFrame,
@@ -19,6 +141,10 @@ def reserve_data_quality_check(
     3. The variable borrow, liquidity and utilization rates should lie between 0 and 1
     4. The balance sheet equilibrium should be 'close' to 0
 
+    The conditions 3 and 4 are checked on the exact fixed-point values when
+    the table has them (see `convert_units`). To check several reserves at
+    once, use `reserves_quality_report`.
+
     Args:
         hourly_asset_reserve_completed (DataFrame): The hourly
             reserve data (completed with previous hours) to check.
@@ -27,55 +153,19 @@ def reserve_data_quality_check(
         float: The quality score
     """
     # Conditions 1 and 2
-    valid_lengths = [28 * 24, 29 * 24, 30 * 24, 31 * 24]
     l = len(hourly_asset_reserve_completed)
     assert l in valid_lengths, f"Invalid length: {l}"
     assert len(hourly_asset_reserve_completed.drop_duplicates()) == len(
         hourly_asset_reserve_completed
     ), "Found duplicates"
 
-    # Condition 3
-    borrow_index_mask = (
-        hourly_asset_reserve_completed.variableBorrowIndex
-        == hourly_asset_reserve_completed.variableBorrowIndex.cummax()
-    ) & (hourly_asset_reserve_completed.variableBorrowIndex >= 1)
-
-    liquidity_index_mask = (
-        hourly_asset_reserve_completed.liquidityIndex
-        == hourly_asset_reserve_completed.liquidityIndex.cummax()
-    ) & (hourly_asset_reserve_completed.liquidityIndex >= 1)
-
-    index_score = (np.mean(borrow_index_mask) + np.mean(liquidity_index_mask)) / 2
-
-    # Condition 4
-    borrow_rate_mask = (hourly_asset_reserve_completed.variableBorrowRate >= 0) & (
-        hourly_asset_reserve_completed.variableBorrowRate <= 1
-    )
-    liquidity_rate_mask = (hourly_asset_reserve_completed.liquidityRate >= 0) & (
-        hourly_asset_reserve_completed.liquidityRate <= 1
-    )
-
-    rate_score = (np.mean(borrow_rate_mask) + np.mean(liquidity_rate_mask)) / 2
-
-    # Condition 5
+    # Conditions 3, 4 and 5
+    masks = quality_masks(hourly_asset_reserve_completed, version_2=version_2)
+    index_score = (np.mean(masks.borrow_index) + np.mean(masks.liquidity_index)) / 2
+    rate_score = (np.mean(masks.borrow_rate) + np.mean(masks.liquidity_rate)) / 2
     if not version_2:
-        balance_equilibrium_threshold = 0.05 * (
-            hourly_asset_reserve_completed.totalATokenSupply
-            + hourly_asset_reserve_completed.accruedToTreasury
-        )
-        balance_equilibrium = (
-            hourly_asset_reserve_completed.totalATokenSupply
-            + hourly_asset_reserve_completed.accruedToTreasury
-            - hourly_asset_reserve_completed.availableLiquidity
-            - hourly_asset_reserve_completed.totalCurrentVariableDebt
-        )
-
-        balance_score = np.mean(
-            np.abs(balance_equilibrium) <= balance_equilibrium_threshold
-        )
-
+        balance_score = np.mean(masks.balance)
         quality_score = float((index_score + rate_score + balance_score) / 3)
-
         return quality_score > 0.95, quality_score
 
     else:
@@ -83,7 +173,58 @@ def reserve_data_quality_check(
         return quality_score > 0.95, quality_score
 
 
-def add_clean_data_per_asset(hourly_asset_reserve_completed: DataFrame) -> DataFrame:
+def reserves_quality_report(
+    hourly_reserve_completed: DataFrame, version_2: bool = False
+) -> DataFrame:
+    """
+    Runs the checks of `reserve_data_quality_check` on all the reserves of the
+    panel at once, with a single groupby. Instead of raising, the fatal
+    conditions are reported in the table.
+
+    Args:
+        hourly_reserve_completed (DataFrame): The hourly reserves panel
+            (completed with previous hours) to check
+        version_2 (bool): Whether the data comes from the Aave V2 subgraph
+    Returns:
+        DataFrame: One row per reserve, with the number of rows, whether it is
+            a valid length (`valid_length`), the number of duplicated rows,
+            the index, rate and balance (except with V2) scores, the quality
+            score and whether the reserve passes all the checks (`passed`).
+    """
+    reserve_names = hourly_reserve_completed.reserve_name.to_numpy()
+    masks = quality_masks(hourly_reserve_completed, version_2=version_2)
+    masks["duplicated"] = hourly_reserve_completed.duplicated().to_numpy()
+    scores = masks.groupby(reserve_names, sort=False).agg(["mean", "sum", "size"])
+
+    report = DataFrame({"reserve_name": scores.index})
+    report["n_rows"] = scores[("duplicated", "size")].to_numpy()
+    report["valid_length"] = report.n_rows.isin(valid_lengths)
+    report["n_duplicates"] = scores[("duplicated", "sum")].to_numpy()
+    report["index_score"] = (
+        scores[("borrow_index", "mean")].to_numpy()
+        + scores[("liquidity_index", "mean")].to_numpy()
+    ) / 2
+    report["rate_score"] = (
+        scores[("borrow_rate", "mean")].to_numpy()
+        + scores[("liquidity_rate", "mean")].to_numpy()
+    ) / 2
+    if not version_2:
+        report["balance_score"] = scores[("balance", "mean")].to_numpy()
+        report["quality_score"] = (
+            report.index_score + report.rate_score + report.balance_score
+        ) / 3
+    else:
+        report["quality_score"] = (report.index_score + report.rate_score) / 2
+    report["passed"] = (
+        report.valid_length & (report.n_duplicates == 0) & (report.quality_score > 0.95)
+    )
+    return report
+
+
+def add_clean_data_per_asset(
+    hourly_asset_reserve_completed: DataFrame,
+    tail_state: Optional[ReservesTailState] = None,
+) -> DataFrame:
     """
     Add extra columns to the hourly_asset_reserve_completed with consolidated values.
     The extra columns are:
@@ -95,7 +236,8 @@ def add_clean_data_per_asset(hourly_asset_reserve_completed: DataFrame) -> DataF
 
     Args:
         hourly_asset_reserve_completed (DataFrame): The table to complete with fixed values
-        verbose (bool): Whether to print logs, default to False
+        tail_state (ReservesTailState, optional): The state of the previous
+            month, whose last fixed indexes are carried to the first day
     Returns:
         DataFrame: The input table with extra columns for fixed values
     """
@@ -103,11 +245,21 @@ def add_clean_data_per_asset(hourly_asset_reserve_completed: DataFrame) -> DataF
     clean_reserve_data = remove_indexes_outliers(
         reserve_data=hourly_asset_reserve_completed,
         index_column="liquidityIndex",
+        fill_values=(
+            tail_state.fixed_index_fill_values("liquidityIndex")
+            if tail_state is not None
+            else None
+        ),
     )
 
     clean_reserve_data = remove_indexes_outliers(
         reserve_data=clean_reserve_data,
         index_column="variableBorrowIndex",
+        fill_values=(
+            tail_state.fixed_index_fill_values("variableBorrowIndex")
+            if tail_state is not None
+            else None
+        ),
     )
 
     # Fix rates
@@ -124,7 +276,10 @@ def add_clean_data_per_asset(hourly_asset_reserve_completed: DataFrame) -> DataF
 
 
 def add_clean_data(
-    hourly_reserve_completed: DataFrame, logger: Logger, verbose: bool = False
+    hourly_reserve_completed: DataFrame,
+    logger: Logger,
+    verbose: bool = False,
+    tail_state: Optional[ReservesTailState] = None,
 ) -> DataFrame:
     """
     Loop over the assets and call the `add_clean_data_per_asset` function on each asset
@@ -133,6 +288,7 @@ def add_clean_data(
         hourly_reserve_completed (DataFrame): The dataset to add clean data on.
         logger (Logger): The logger
         verbose (bool): Wether to print details during execution
+        tail_state (ReservesTailState, optional): The state of the previous month
     Returns:
          DataFrame: The table with extra columns with clean data.
     """
@@ -142,7 +298,7 @@ def add_clean_data(
         hourly_asset_reserve = hourly_reserve_completed[
             hourly_reserve_completed.reserve_name == asset_name
         ].copy()
-        clean_asset_data = add_clean_data_per_asset(hourly_asset_reserve)
+        clean_asset_data = add_clean_data_per_asset(hourly_asset_reserve, tail_state)
         clean_hourly_reserve = pd.concat((clean_hourly_reserve, clean_asset_data))
 
     if verbose:
@@ -188,50 +344,147 @@ def add_clean_data(
     return clean_hourly_reserve
 
 
-def remove_indexes_outliers(reserve_data: DataFrame, index_column: str) -> DataFrame:
+def grouped_quantile(
+    sorted_values: np.ndarray, group_starts: np.ndarray, counts: np.ndarray, q: float
+) -> np.ndarray:
+    """
+    Computes the `q` quantile of each group with the same linear interpolation
+    as `Series.quantile` (i.e. `np.nanpercentile`), so that the results are
+    identical.
+
+    Args:
+        sorted_values (np.ndarray): The values, sorted by group then by value,
+            without NaNs
+        group_starts (np.ndarray): The position of the first value of each group
+        counts (np.ndarray): The number of values of each group
+        q (float): The quantile, between 0 and 1
+    Returns:
+        np.ndarray: The quantile of each group, NaN for the empty groups.
+    """
+    virtual_indexes = counts * q + (1 + q * -1) - 1
+    previous_indexes = np.clip(np.floor(virtual_indexes), 0, np.maximum(counts - 1, 0))
+    next_indexes = np.minimum(previous_indexes + 1, np.maximum(counts - 1, 0))
+    gamma = virtual_indexes - previous_indexes
+    non_empty = counts > 0
+    previous_values = np.full(len(counts), np.nan)
+    next_values = np.full(len(counts), np.nan)
+    previous_values[non_empty] = sorted_values[
+        group_starts[non_empty] + previous_indexes[non_empty].astype(np.int64)
+    ]
+    next_values[non_empty] = sorted_values[
+        group_starts[non_empty] + next_indexes[non_empty].astype(np.int64)
+    ]
+    # Same formula as numpy's `_lerp`
+    difference = next_values - previous_values
+    return np.where(
+        gamma >= 0.5,
+        next_values - difference * (1 - gamma),
+        previous_values + difference * gamma,
+    )
+
+
+def remove_indexes_outliers(
+    reserve_data: DataFrame,
+    index_column: str,
+    fill_values: Optional[dict[str, float]] = None,
+) -> DataFrame:
     """
     Adds a column to reserve_data called `fixed_{index_column}` where the index outliers
     from index_column have been removed.
 
+    The outliers are the values outside of the 1.5 IQR bounds of their (day,
+    asset) group. They are replaced by the previous value of the group, or for
+    the first row of a day, by the maximum fixed value of the previous day
+    (1 on the first day, unless `fill_values` carries the value of the previous
+    month). The rows are ordered by day, then by asset.
+
     Args:
         reserve_data (DataFrame): The dataframe from with the index outliers should be removed
         index_column (str): The name of the index column to process
+        fill_values (dict[str, float], optional): Per asset, the maximum fixed
+            value of the day before the data (see `ReservesTailState`)
     Returns:
         DataFrame: A Dataframe similar to reserve_data, but with a extra column named
             `fixed_{index_column}`
     """
-    reserve_data_fixed = DataFrame()
     reserve_data["regular_datetime"] = pd.to_datetime(reserve_data.regular_datetime)
-    day_min = min(reserve_data.regular_datetime.dt.date)
-    day_max = max(reserve_data.regular_datetime.dt.date)
-    day = day_min
-    assets_list = reserve_data.reserve_name.unique().tolist()
-    dict_fill_values = {asset: 1 for asset in assets_list}
-    while day <= day_max:
-        reserve_data_day = reserve_data[
-            reserve_data.regular_datetime.dt.date == day
-        ].copy()
-        for asset in assets_list:
-            reserve_data_day_asset = reserve_data_day[
-                reserve_data_day.reserve_name == asset
-            ].copy()
-            q1 = reserve_data_day_asset[index_column].quantile(0.25)
-            q3 = reserve_data_day_asset[index_column].quantile(0.75)
-            iqr = q3 - q1
-            limit_low = q1 - 1.5 * iqr
-            limit_high = q3 + 1.5 * iqr
-            reserve_data_day_asset[f"fixed_{index_column}"] = np.where(
-                (reserve_data_day_asset[index_column] > limit_high)
-                | (reserve_data_day_asset[index_column] < limit_low),
-                reserve_data_day_asset[index_column].shift(
-                    periods=1, fill_value=dict_fill_values[asset]
-                ),
-                reserve_data_day_asset[index_column],
-            )
-            reserve_data_fixed = pd.concat((reserve_data_fixed, reserve_data_day_asset))
-            dict_fill_values[asset] = max(
-                reserve_data_day_asset[f"fixed_{index_column}"]
-            )
-        day += Timedelta(days=1)
+    day_codes = pd.factorize(reserve_data.regular_datetime.dt.normalize(), sort=True)[0]
+    asset_codes, asset_names = pd.factorize(reserve_data.reserve_name)
+    order = np.lexsort((asset_codes, day_codes))
+    values = reserve_data[index_column].to_numpy(dtype=np.float64)[order]
+    day_codes = day_codes[order]
+    asset_codes = asset_codes[order]
+
+    # (day, asset) groups
+    is_first = np.ones(len(values), dtype=bool)
+    is_first[1:] = (day_codes[1:] != day_codes[:-1]) | (
+        asset_codes[1:] != asset_codes[:-1]
+    )
+    group_starts = np.flatnonzero(is_first)
+    group_ids = np.cumsum(is_first) - 1
+
+    # IQR bounds, on the values sorted within each group (NaNs excluded)
+    is_valid = ~np.isnan(values)
+    sorted_positions = np.lexsort((values, group_ids))
+    sorted_positions = sorted_positions[is_valid[sorted_positions]]
+    counts = np.bincount(group_ids[is_valid], minlength=len(group_starts))
+    valid_starts = np.cumsum(counts) - counts
+    q1 = grouped_quantile(values[sorted_positions], valid_starts, counts, 0.25)
+    q3 = grouped_quantile(values[sorted_positions], valid_starts, counts, 0.75)
+    iqr = q3 - q1
+    limit_low = (q1 - 1.5 * iqr)[group_ids]
+    limit_high = (q3 + 1.5 * iqr)[group_ids]
+    is_outlier = (values > limit_high) | (values < limit_low)
+
+    # The outliers take the previous value, except on the first row of a group
+    previous_values = np.roll(values, 1)
+    fixed_values = np.where(is_outlier & ~is_first, previous_values, values)
+
+    # Fill values of the first rows. The fixed maximum of a day is carried to
+    # the next day of the asset: it is the maximum of the first fixed value and
+    # of the following ones. When the first value is not an outlier, it does
+    # not depend on the previous days, so the carried values are a cumulative
+    # maximum over the runs of days starting with a valid first value. A
+    # leading NaN makes the maximum NaN, as with the builtin `max`.
+    following_max = np.fmax.reduceat(
+        np.where(is_first, -np.inf, fixed_values), group_starts
+    )
+    first_values = values[group_starts]
+    first_outliers = is_outlier[group_starts]
+    group_days = day_codes[group_starts]
+    group_assets = asset_codes[group_starts]
+    asset_order = np.lexsort((group_days, group_assets))
+    is_asset_start = np.ones(len(asset_order), dtype=bool)
+    group_assets = group_assets[asset_order]
+    is_asset_start[1:] = group_assets[1:] != group_assets[:-1]
+    fill_values = fill_values if fill_values is not None else dict()
+    initial_values = np.array(
+        [fill_values.get(asset_name, 1.0) for asset_name in asset_names],
+        dtype=np.float64,
+    )[group_assets]
+    # In the order of the days of each asset
+    first_outliers_per_asset = first_outliers[asset_order]
+    following_max_per_asset = following_max[asset_order]
+    daily_max = np.where(
+        first_outliers_per_asset,
+        np.where(
+            is_asset_start,
+            np.maximum(initial_values, following_max_per_asset),
+            following_max_per_asset,
+        ),
+        np.maximum(first_values[asset_order], following_max_per_asset),
+    )
+    runs = np.cumsum(is_asset_start | ~first_outliers_per_asset)
+    carried_max = pd.Series(daily_max).groupby(runs).cummax(skipna=False).to_numpy()
+    group_fill_values = np.empty(len(asset_order))
+    group_fill_values[asset_order] = np.where(
+        is_asset_start, initial_values, np.roll(carried_max, 1)
+    )
+    fixed_values[group_starts] = np.where(
+        first_outliers, group_fill_values, first_values
+    )
+
+    reserve_data_fixed = reserve_data.iloc[order].copy()
+    reserve_data_fixed[f"fixed_{index_column}"] = fixed_values
     assert len(reserve_data_fixed) == len(reserve_data)
     return reserve_data_fixed
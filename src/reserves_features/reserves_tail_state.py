@@ -0,0 +1,140 @@
+"""State of the reserves at the end of a month, carried to the next month"""
+
+import json
+from typing import Optional
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+index_columns = ["liquidityIndex", "variableBorrowIndex"]
+
+
+def _to_json_value(value):
+    """Converts a cell of a dataframe to a JSON value, without rounding floats."""
+    if value is None or (np.ndim(value) == 0 and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class ReservesTailState:
+    """
+    Per reserve state at the end of a monthly reserves panel: its last row, and
+    the values carried by the index filters (the last valid index values, and
+    the maximum fixed index value of the last day). The next month's run seeds
+    the forward fill and the filters with it, so that the months can be built
+    independently without fetching the previous month again.
+
+    The same reserve names exist in the V2 and V3 subgraphs, so the state
+    records the version of the data it comes from.
+    """
+
+    def __init__(
+        self, states: Optional[dict] = None, version_2: Optional[bool] = None
+    ) -> None:
+        self.states = states if states is not None else dict()
+        self.version_2 = version_2
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {"version_2": self.version_2, "reserves": self.states}, indent=2
+        )
+
+    @classmethod
+    def from_json(cls, text: str) -> "ReservesTailState":
+        content = json.loads(text)
+        return cls(content["reserves"], version_2=content["version_2"])
+
+    @classmethod
+    def from_panel(
+        cls, hourly_reserve_completed: DataFrame, version_2: Optional[bool] = None
+    ) -> "ReservesTailState":
+        """
+        Builds the state from the output of a month, i.e. the output of
+        `fill_missing_data`, or of `add_clean_data` for V2.
+        """
+        panel = hourly_reserve_completed.sort_values("regular_datetime", kind="stable")
+        last_rows = panel.groupby("reserve_name", sort=False).tail(1)
+        row_columns = [
+            column
+            for column in panel.columns
+            if column not in ["regular_datetime", "true_value"]
+            and not column.startswith("fixed_")
+        ]
+        rows = [
+            {column: _to_json_value(value) for column, value in row.items()}
+            for row in last_rows[row_columns].to_dict("records")
+        ]
+
+        states = dict()
+        for reserve_name, row in zip(last_rows.reserve_name, rows):
+            states[reserve_name] = {
+                "row": row,
+                "index": {
+                    column: row[column] for column in index_columns if column in row
+                },
+                "fixed_index": dict(),
+            }
+
+        # The maximum fixed value of the last day, as in `remove_indexes_outliers`
+        days = pd.to_datetime(panel.regular_datetime).dt.normalize()
+        last_day = panel[days == days.groupby(panel.reserve_name).transform("max")]
+        for column in index_columns:
+            if f"fixed_{column}" not in panel.columns:
+                continue
+            for reserve_name, fixed_values in last_day.groupby(
+                "reserve_name", sort=False
+            )[f"fixed_{column}"]:
+                fixed_value = max(fixed_values)
+                states[reserve_name]["fixed_index"][column] = (
+                    None if np.isnan(fixed_value) else float(fixed_value)
+                )
+        return cls(states, version_2=version_2)
+
+    def seed_rows(self, reserves: list[str], dtypes: pd.Series) -> DataFrame:
+        """
+        Returns the last rows of `reserves`, indexed by reserve name, with the
+        columns and types of `dtypes`. The reserves without a state are skipped.
+        """
+        rows = [
+            self.states[reserve_name]["row"]
+            for reserve_name in reserves
+            if reserve_name in self.states
+        ]
+        seeds = DataFrame(rows).reindex(columns=dtypes.index)
+        for column, dtype in dtypes.items():
+            if pd.api.types.is_datetime64_any_dtype(dtype):
+                seeds[column] = pd.to_datetime(seeds[column]).astype(dtype)
+            elif not (
+                isinstance(dtype, np.dtype)
+                and dtype.kind in "iub"
+                and seeds[column].isna().any()
+            ):
+                seeds[column] = seeds[column].astype(dtype)
+        seeds.index = pd.Index(
+            [reserve_name for reserve_name in reserves if reserve_name in self.states],
+            name="reserve_name",
+        )
+        return seeds
+
+    def last_index(self, reserve_name: str, column: str) -> Optional[float]:
+        """Returns the last valid value of the index of the reserve, if any."""
+        return self.states.get(reserve_name, dict()).get("index", dict()).get(column)
+
+    def fixed_index_fill_values(self, column: str) -> dict[str, float]:
+        """
+        Returns, for each reserve, the value that `remove_indexes_outliers`
+        carries to the first day of the month (NaN for an undefined value).
+        """
+        return {
+            reserve_name: (
+                np.nan
+                if state["fixed_index"][column] is None
+                else state["fixed_index"][column]
+            )
+            for reserve_name, state in self.states.items()
+            if column in state["fixed_index"]
+        }
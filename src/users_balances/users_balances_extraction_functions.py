@@ -1,24 +1,31 @@
 """Functions for extracting the users' balances"""
 
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
 from datetime import datetime, timedelta, timezone
 from io import StringIO
-from ..utils.utils import run_query
+import os
+from typing import Iterator, Optional
+from ..utils.utils import run_query, is_closed_window
+from ..utils.units import parse_integers, to_units
+from ..utils.pagination import paginate
+from ..utils.checkpoint import Checkpoint
+from ..utils.page_buffer import PageBuffer
+from ..utils.graphql import selection_paths
 from ..utils.logger import Logger
 
 logger = Logger()
 
 
-def run_query_users_balances_protocol_v3(
-    api_endpoint: str,
+def users_balances_query(
     size: int,
-    offset: int,
+    last_id: str,
     timestamp_min: int,
     timestamp_max: int,
     token: str,
     version_2: bool = False,
-) -> dict:
+) -> tuple[str, str]:
     if not version_2:
         pool_keyword = "pool \u007b pool \u007d"
     else: 
@@ -38,10 +45,10 @@ def run_query_users_balances_protocol_v3(
     query = f"""\u007b
         {query_name}(
             first: {size}
-            skip: {offset}
-            orderBy: timestamp
-            orderDirection: desc
+            orderBy: id
+            orderDirection: asc
             where: \u007b
+                id_gt: "{last_id}"
                 timestamp_gt: {timestamp_min}
                 timestamp_lt: {timestamp_max}
             \u007d
@@ -65,10 +72,32 @@ def run_query_users_balances_protocol_v3(
         \u007d
     \u007d
     """
-    return run_query(api=api_endpoint, query=query)
+    return query_name, query
 
 
-def fetch_users_balances(
+def run_query_users_balances_protocol_v3(
+    api_endpoint: str,
+    size: int,
+    last_id: str,
+    timestamp_min: int,
+    timestamp_max: int,
+    token: str,
+    version_2: bool = False,
+) -> dict:
+    _, query = users_balances_query(
+        size=size,
+        last_id=last_id,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+        token=token,
+        version_2=version_2,
+    )
+    return run_query(
+        api=api_endpoint, query=query, cacheable=is_closed_window(timestamp_max)
+    )
+
+
+def users_balances_pages(
     api_endpoint: str,
     size: int,
     max_queries: int,
@@ -77,37 +106,177 @@ def fetch_users_balances(
     token: str,
     version_2: bool = False,
     verbose: bool = False,
-):
-    if token == "atoken":
-        response_key = "atokenBalanceHistoryItems"
-    elif token == "vtoken":
-        response_key = "vtokenBalanceHistoryItems"
-    else:
-        raise ValueError(
-            f"Undefined token value, expected atoken or vtoken, got {token}"
-        )
-    users_balances = pd.DataFrame()
-    for iter in range(max_queries):
-        if verbose:
-            if iter % 10 == 0:
-                print(f"      [Iteration {iter + 1}/{max_queries}]")
-        query_output = run_query_users_balances_protocol_v3(
+    checkpoint: Optional[Checkpoint] = None,
+) -> tuple[list[str], Iterator[list[dict]]]:
+    """
+    Returns the field paths of the users balances (see `selection_paths`) and
+    the iterator over their pages.
+    """
+    response_key, query = users_balances_query(
+        size=size,
+        last_id="",
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+        token=token,
+        version_2=version_2,
+    )
+    pages = paginate(
+        fetch_page=lambda last_id: run_query_users_balances_protocol_v3(
             api_endpoint=api_endpoint,
             size=size,
-            offset=iter * size,
+            last_id=last_id,
             timestamp_min=timestamp_min,
             timestamp_max=timestamp_max,
             token=token,
             version_2=version_2,
-        )
-        current_balances = pd.json_normalize(query_output["data"][response_key])
-        if len(current_balances) == 0:
-            print("All data has been already extracted")
-            break
-        users_balances = pd.concat((users_balances, current_balances))
+        )["data"][response_key],
+        size=size,
+        max_queries=max_queries,
+        verbose=verbose,
+        checkpoint=checkpoint,
+    )
+    return selection_paths(query)[response_key], pages
+
+
+def users_balances_checkpoint(
+    checkpoint_directory: Optional[str],
+    timestamp_min: int,
+    timestamp_max: int,
+    token: str,
+    version_2: bool = False,
+) -> Optional[Checkpoint]:
+    if checkpoint_directory is None:
+        return None
+    return Checkpoint(
+        directory=checkpoint_directory,
+        name=f"{'v2' if version_2 else 'v3'}_{token}_{int(timestamp_min)}_{int(timestamp_max)}",
+    )
+
+
+def fetch_users_balances(
+    api_endpoint: str,
+    size: int,
+    max_queries: int,
+    timestamp_min: int,
+    timestamp_max: int,
+    token: str,
+    version_2: bool = False,
+    verbose: bool = False,
+    checkpoint_directory: Optional[str] = None,
+):
+    """
+    Fetches the users balances updated in (timestamp_min, timestamp_max).
+
+    With a `checkpoint_directory`, the cursor and the fetched pages are saved
+    after each page, so that a failed run restarted with the same arguments
+    resumes from its last page. The checkpoint is removed once all the pages
+    have been fetched.
+
+    Args:
+        api_endpoint (str): The SubGraph endpoint url
+        size (int): The number of items per query
+        max_queries (int): The maximum number of queries
+        timestamp_min (int): Used to filter items with a greater timestamp
+        timestamp_max (int): Used to filter items with a lower timestamp
+        token (str): Either "atoken" or "vtoken"
+        version_2 (bool): Whether to query the Aave V2 subgraph
+        verbose (bool): Wether to print execution details
+        checkpoint_directory (str): Where to save the checkpoints, if any
+    Returns:
+        DataFrame: The raw users balances.
+    """
+    checkpoint = users_balances_checkpoint(
+        checkpoint_directory, timestamp_min, timestamp_max, token, version_2
+    )
+    fields, pages = users_balances_pages(
+        api_endpoint=api_endpoint,
+        size=size,
+        max_queries=max_queries,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+        token=token,
+        version_2=version_2,
+        verbose=verbose,
+        checkpoint=checkpoint,
+    )
+    balances_buffer = PageBuffer(fields)
+    for page in pages:
+        balances_buffer.append(page)
+    users_balances = balances_buffer.to_frame()
+    if checkpoint is not None:
+        checkpoint.clear()
     return users_balances
 
 
+def stream_users_balances(
+    api_endpoint: str,
+    size: int,
+    max_queries: int,
+    timestamp_min: int,
+    timestamp_max: int,
+    token: str,
+    spool_path: str,
+    version_2: bool = False,
+    verbose: bool = False,
+    checkpoint_directory: Optional[str] = None,
+) -> DataFrame:
+    """
+    Streaming version of `fetch_users_balances` followed by
+    `clean_users_balances_data`: each page is cleaned and appended to the CSV
+    file `spool_path` as soon as it is fetched, so that the memory used does
+    not depend on the number of pages. The file has the same content as the
+    CSV of the whole cleaned DataFrame.
+
+    Args:
+        api_endpoint (str): The SubGraph endpoint url
+        size (int): The number of items per query
+        max_queries (int): The maximum number of queries
+        timestamp_min (int): Used to filter items with a greater timestamp
+        timestamp_max (int): Used to filter items with a lower timestamp
+        token (str): Either "atoken" or "vtoken"
+        spool_path (str): The CSV file written, overwritten if it exists
+        version_2 (bool): Whether to query the Aave V2 subgraph
+        verbose (bool): Wether to print execution details
+        checkpoint_directory (str): Where to save the checkpoints, if any
+    Returns:
+        DataFrame: The id and timestamp of the most recent users balance
+            written (empty if no balance was found).
+    """
+    checkpoint = users_balances_checkpoint(
+        checkpoint_directory, timestamp_min, timestamp_max, token, version_2
+    )
+    fields, pages = users_balances_pages(
+        api_endpoint=api_endpoint,
+        size=size,
+        max_queries=max_queries,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+        token=token,
+        version_2=version_2,
+        verbose=verbose,
+        checkpoint=checkpoint,
+    )
+    spool_directory = os.path.dirname(spool_path)
+    if spool_directory:
+        os.makedirs(spool_directory, exist_ok=True)
+    last_item = None
+    with open(spool_path, "w", newline="") as spool:
+        for page in pages:
+            page_buffer = PageBuffer(fields)
+            page_buffer.append(page)
+            clean_page = clean_users_balances_data(page_buffer.to_frame(), token=token)
+            clean_page.to_csv(spool, index=False, header=spool.tell() == 0)
+            page_last_item = max(
+                zip(pd.to_numeric(clean_page.timestamp), clean_page.id)
+            )
+            last_item = max(last_item or page_last_item, page_last_item)
+    if checkpoint is not None:
+        checkpoint.clear()
+    if last_item is None:
+        return pd.DataFrame(columns=["id", "timestamp"])
+    return pd.DataFrame({"id": [last_item[1]], "timestamp": [last_item[0]]})
+
+
 def clean_users_balances_data(users_balances: DataFrame, token: str) -> DataFrame:
     clean_users_balances = users_balances.rename(
         columns={
@@ -121,10 +290,10 @@ def clean_users_balances_data(users_balances: DataFrame, token: str) -> DataFram
         }
     )
 
-    clean_users_balances.reserve_decimals = clean_users_balances.reserve_decimals.apply(
-        int
+    clean_users_balances.reserve_decimals = (
+        clean_users_balances.reserve_decimals.astype(np.int64)
     )
-    clean_users_balances.Index = clean_users_balances.Index.apply(int) / 1e27
+    clean_users_balances.Index = parse_integers(clean_users_balances.Index) / 1e27
 
     if token == "atoken":
         clean_users_balances = clean_users_balances.rename(
@@ -133,13 +302,13 @@ def clean_users_balances_data(users_balances: DataFrame, token: str) -> DataFram
                 "scaledATokenBalance": "user_scaled_atoken_balance",
             }
         )
-        clean_users_balances.user_current_atoken_balance = (
-            clean_users_balances.user_current_atoken_balance.apply(int)
-            / 10**clean_users_balances.reserve_decimals
+        clean_users_balances.user_current_atoken_balance = to_units(
+            clean_users_balances.user_current_atoken_balance,
+            clean_users_balances.reserve_decimals,
         )
-        clean_users_balances.user_scaled_atoken_balance = (
-            clean_users_balances.user_scaled_atoken_balance.apply(int)
-            / 10**clean_users_balances.reserve_decimals
+        clean_users_balances.user_scaled_atoken_balance = to_units(
+            clean_users_balances.user_scaled_atoken_balance,
+            clean_users_balances.reserve_decimals,
         )
 
     elif token == "vtoken":
@@ -149,13 +318,13 @@ def clean_users_balances_data(users_balances: DataFrame, token: str) -> DataFram
                 "currentVariableDebt": "user_current_variable_debt",
             }
         )
-        clean_users_balances.user_current_variable_debt = (
-            clean_users_balances.user_current_variable_debt.apply(int)
-            / 10**clean_users_balances.reserve_decimals
+        clean_users_balances.user_current_variable_debt = to_units(
+            clean_users_balances.user_current_variable_debt,
+            clean_users_balances.reserve_decimals,
         )
-        clean_users_balances.user_scaled_variable_debt = (
-            clean_users_balances.user_scaled_variable_debt.apply(int)
-            / 10**clean_users_balances.reserve_decimals
+        clean_users_balances.user_scaled_variable_debt = to_units(
+            clean_users_balances.user_scaled_variable_debt,
+            clean_users_balances.reserve_decimals,
         )
 
     else:
@@ -175,6 +344,9 @@ def extract_monthly_users_data(
     token: str,
     version_2: bool = False,
     verbose: bool = False,
+    checkpoint_directory: Optional[str] = None,
+    since: Optional[float] = None,
+    spool_path: Optional[str] = None,
 ) -> DataFrame:
     logger.log(f"Starting users balances ETL for year={year}, month={month}")
     # Computing beginning and end of month in timestamp format
@@ -185,6 +357,9 @@ def extract_monthly_users_data(
     )
     timestamp_min = start_datetime.timestamp()
     timestamp_max = end_datetime.timestamp()
+    # Incremental runs only fetch the items more recent than `since`
+    if since is not None:
+        timestamp_min = max(timestamp_min, since)
     if verbose:
         logger.log(
             f"   --> Starting datetime: {start_datetime}, Timestamp: {timestamp_min}"
@@ -193,6 +368,25 @@ def extract_monthly_users_data(
             f"   --> Ending datetime: {end_datetime}, Timestamp: {timestamp_max}"
         )
 
+    if spool_path is not None:
+        # Streaming mode: the clean balances are written to `spool_path` page
+        # by page, only the most recent item is returned
+        logger.log(f"[STEP 1-2] Streaming clean users balances to {spool_path}...")
+        last_item = stream_users_balances(
+            api_endpoint=api_endpoint,
+            size=size,
+            max_queries=max_queries,
+            timestamp_min=timestamp_min,
+            timestamp_max=timestamp_max,
+            token=token,
+            spool_path=spool_path,
+            version_2=version_2,
+            verbose=verbose,
+            checkpoint_directory=checkpoint_directory,
+        )
+        logger.log("Done!")
+        return last_item
+
     logger.log("[STEP1] Fetching users balances raw data...")
     users_balances = fetch_users_balances(
         api_endpoint=api_endpoint,
@@ -203,7 +397,11 @@ def extract_monthly_users_data(
         token=token,
         version_2=version_2,
         verbose=verbose,
+        checkpoint_directory=checkpoint_directory,
     )
+    if len(users_balances) == 0:
+        logger.log("No users balances found")
+        return users_balances
 
     logger.log("[STEP 2] Cleaning users balances data...")
     clean_users_balances = clean_users_balances_data(
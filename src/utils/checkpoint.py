@@ -0,0 +1,70 @@
+"""Checkpoints of the subgraph fetch loops"""
+
+import gzip
+import json
+import os
+import shutil
+from typing import Iterator
+
+
+class Checkpoint:
+    """
+    Persists the progress of a fetch loop in `directory`/`name`: the cursor,
+    the number of rows fetched so far and the fetched pages (spooled as gzip
+    JSON files), so that a restarted run resumes where the previous one stopped.
+    Every file is written to a temporary path first, then atomically renamed.
+    """
+
+    def __init__(self, directory: str, name: str) -> None:
+        self.path = os.path.join(directory, name)
+        os.makedirs(self.path, exist_ok=True)
+        self.state_path = os.path.join(self.path, "state.json")
+        self.state = {"cursor": "", "rows": 0, "pages": 0, "done": False}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as file:
+                self.state = json.load(file)
+
+    @property
+    def cursor(self) -> str:
+        return self.state["cursor"]
+
+    @property
+    def n_pages(self) -> int:
+        return self.state["pages"]
+
+    @property
+    def done(self) -> bool:
+        return self.state["done"]
+
+    def _page_path(self, page_number: int) -> str:
+        return os.path.join(self.path, f"page_{page_number:06d}.json.gz")
+
+    def _save_state(self) -> None:
+        temporary_path = self.state_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.state, file)
+        os.replace(temporary_path, self.state_path)
+
+    def load_pages(self) -> Iterator[list[dict]]:
+        """Yields the pages spooled by the previous runs."""
+        for page_number in range(self.n_pages):
+            with gzip.open(self._page_path(page_number), "rb") as file:
+                yield json.loads(file.read())
+
+    def save_page(self, page: list[dict], last_page: bool = False) -> None:
+        page_path = self._page_path(self.n_pages)
+        with gzip.open(page_path + ".tmp", "wb") as file:
+            file.write(json.dumps(page).encode("utf-8"))
+        os.replace(page_path + ".tmp", page_path)
+        self.state["cursor"] = page[-1]["id"]
+        self.state["rows"] += len(page)
+        self.state["pages"] += 1
+        self.state["done"] = last_page
+        self._save_state()
+
+    def finish(self) -> None:
+        self.state["done"] = True
+        self._save_state()
+
+    def clear(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,174 @@
+"""Exact fixed-point representation of the on-chain integer amounts"""
+
+from typing import Optional, Union
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+# The values are stored as two int64 limbs, `hi * 10**18 + lo` with
+# 0 <= lo < 10**18, which covers the integers up to about 9.2e36 (rays up to
+# 9.2e9, wei amounts up to 9.2e18 tokens)
+FIXED_DIGITS = 18
+BASE = 10**FIXED_DIGITS
+_powers = np.array([10**k for k in range(FIXED_DIGITS + 1)], dtype=np.int64)
+# The strings of up to 36 digits are split in two limbs of 18 digits
+MAX_DIGITS = 2 * FIXED_DIGITS
+
+Fixed = tuple[np.ndarray, np.ndarray]
+
+
+def fixed_scalar(value: int, length: int = 1) -> Fixed:
+    """Returns the fixed-point representation of the integer `value`."""
+    hi, lo = divmod(value, BASE)
+    return np.full(length, hi, dtype=np.int64), np.full(length, lo, dtype=np.int64)
+
+
+def parse_fixed(values: Union[Series, np.ndarray, list]) -> Fixed:
+    """
+    Parses the decimal strings (or integers) returned by the subgraphs into
+    their exact fixed-point representation, without going through Python ints
+    (except for the negative values).
+
+    Args:
+        values (Series | np.ndarray | list): Decimal strings (or integers)
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The int64 limbs (hi, lo).
+    Raises:
+        OverflowError: If a value does not fit in the two limbs.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in "iu":
+        hi, lo = np.divmod(values.astype(np.int64), BASE)
+        return hi, lo
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    strings = values.astype(f"S{MAX_DIGITS + 1}")
+    lengths = np.strings.str_len(strings)
+    not_decoded = (lengths == 0) | (lengths > MAX_DIGITS) | ~np.strings.isdigit(strings)
+    # Left-padded with zeros: the first 18 digits are `hi`, the last 18 `lo`
+    padded = np.strings.zfill(np.where(not_decoded, b"0", strings), MAX_DIGITS)
+    padded = padded.astype(f"S{MAX_DIGITS}")
+    hi = padded.astype(f"S{FIXED_DIGITS}").astype(np.int64)
+    digits = padded.view(np.uint8).reshape(len(padded), MAX_DIGITS)
+    lo = (
+        np.ascontiguousarray(digits[:, FIXED_DIGITS:])
+        .view(f"S{FIXED_DIGITS}")
+        .ravel()
+        .astype(np.int64)
+    )
+    for position in np.flatnonzero(not_decoded):
+        value_hi, value_lo = divmod(int(values[position]), BASE)
+        if not -(2**63) <= value_hi < 2**63:
+            raise OverflowError(
+                f"{values[position]} does not fit in the fixed-point representation"
+            )
+        hi[position], lo[position] = value_hi, value_lo
+    return hi, lo
+
+
+def fixed_compare(a: Fixed, b: Fixed) -> np.ndarray:
+    """Returns -1, 0 or 1 where `a` is lower than, equal to or greater than `b`."""
+    return np.where(a[0] != b[0], np.where(a[0] > b[0], 1, -1), np.sign(a[1] - b[1]))
+
+
+def fixed_add(a: Fixed, b: Fixed) -> Fixed:
+    lo = a[1] + b[1]
+    carry = lo >= BASE
+    return a[0] + b[0] + carry, lo - carry * BASE
+
+
+def fixed_sub(a: Fixed, b: Fixed) -> Fixed:
+    lo = a[1] - b[1]
+    borrow = lo < 0
+    return a[0] - b[0] - borrow, lo + borrow * BASE
+
+
+def fixed_diff(a: Fixed) -> Fixed:
+    """Exact equivalent of `np.diff`: the differences of consecutive values."""
+    return fixed_sub((a[0][1:], a[1][1:]), (a[0][:-1], a[1][:-1]))
+
+
+def fixed_abs(a: Fixed) -> Fixed:
+    negative = a[0] < 0
+    negated = fixed_sub(fixed_scalar(0, len(a[0])), a)
+    return np.where(negative, negated[0], a[0]), np.where(negative, negated[1], a[1])
+
+
+def fixed_cummax(a: Fixed, groups: Optional[np.ndarray] = None) -> Fixed:
+    """
+    Exact equivalent of `np.maximum.accumulate`, or of a grouped cummax if the
+    group of each value is given.
+    """
+    if len(a[0]) == 0:
+        return a
+    # The pairs are replaced by their rank, whose running maximum gives the
+    # position of the running maximum. With groups, the ranks are ordered by
+    # group first, so that the running maximum stays in the group.
+    if groups is None:
+        order = np.lexsort((a[1], a[0]))
+    else:
+        order = np.lexsort((a[1], a[0], groups))
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+    if groups is None:
+        max_ranks = np.maximum.accumulate(ranks)
+    else:
+        max_ranks = pd.Series(ranks).groupby(groups).cummax().to_numpy()
+    positions = order[max_ranks]
+    return a[0][positions], a[1][positions]
+
+
+def fixed_rescale(a: Fixed, shift: Union[int, np.ndarray]) -> Fixed:
+    """
+    Multiplies the values by 10**shift, with -18 <= shift <= 18 (per value or
+    for all of them). The negative shifts round down, like `//`.
+    """
+    shift = np.broadcast_to(np.asarray(shift, dtype=np.int64), a[0].shape)
+    if np.any(np.abs(shift) > FIXED_DIGITS):
+        raise ValueError(f"Unsupported shift, expected at most {FIXED_DIGITS} digits")
+    up = shift >= 0
+    up_power = _powers[np.where(up, shift, 0)]
+    down_power = _powers[np.where(up, 0, -shift)]
+    # Up: the digits of lo above 10**(18 - shift) move to hi
+    moved_power = _powers[FIXED_DIGITS - np.where(up, shift, 0)]
+    up_hi = a[0] * up_power + a[1] // moved_power
+    up_lo = (a[1] % moved_power) * up_power
+    # Down: the last digits of hi move to lo
+    kept_power = _powers[FIXED_DIGITS - np.where(up, 0, -shift)]
+    down_hi = a[0] // down_power
+    down_lo = (a[0] % down_power) * kept_power + a[1] // down_power
+    return np.where(up, up_hi, down_hi), np.where(up, up_lo, down_lo)
+
+
+def fixed_to_float(a: Fixed, decimals: Union[int, np.ndarray] = 0) -> np.ndarray:
+    """Converts the values to floats, divided by 10**decimals."""
+    return (a[0] * float(BASE) + a[1]) / 10.0 ** np.asarray(decimals)
+
+
+def add_fixed_columns(data: DataFrame, column: str, values: Fixed) -> None:
+    """
+    Stores the fixed-point values in the `{column}_hi` and `{column}_lo`
+    columns of `data`, as nullable integers so that they go through the merges
+    and forward fills without being converted to floats.
+    """
+    data[f"{column}_hi"] = pd.array(values[0], dtype="Int64")
+    data[f"{column}_lo"] = pd.array(values[1], dtype="Int64")
+
+
+def has_fixed_columns(data: DataFrame, column: str) -> bool:
+    return f"{column}_hi" in data.columns and f"{column}_lo" in data.columns
+
+
+def get_fixed_columns(data: DataFrame, column: str) -> tuple[Fixed, np.ndarray]:
+    """
+    Returns the fixed-point values stored by `add_fixed_columns`, and the mask
+    of the rows where they are not missing (the limbs are 0 elsewhere).
+    """
+    hi = data[f"{column}_hi"]
+    lo = data[f"{column}_lo"]
+    valid = (hi.notna() & lo.notna()).to_numpy()
+    return (
+        hi.to_numpy(dtype=np.int64, na_value=0),
+        lo.to_numpy(dtype=np.int64, na_value=0),
+    ), valid
@@ -0,0 +1,69 @@
+"""GraphQL query helpers"""
+
+import re
+
+_token_pattern = re.compile(r'"(?:[^"\\]|\\.)*"|\w+|[{}():]')
+
+
+def _parse_selection_set(tokens: list[str], position: int) -> tuple[list, int]:
+    """
+    Parses the selection set starting at tokens[position] == "{" and returns
+    the list of (response key, sub-selection or None) with the position after
+    the closing "}". Aliases are used as response keys and arguments are skipped.
+    """
+    fields = list()
+    position += 1
+    while tokens[position] != "}":
+        key = tokens[position]
+        position += 1
+        if tokens[position] == ":":
+            position += 2
+        if tokens[position] == "(":
+            depth = 0
+            while True:
+                if tokens[position] == "(":
+                    depth += 1
+                elif tokens[position] == ")":
+                    depth -= 1
+                position += 1
+                if depth == 0:
+                    break
+        sub_selection = None
+        if tokens[position] == "{":
+            sub_selection, position = _parse_selection_set(tokens, position)
+        fields.append((key, sub_selection))
+    return fields, position + 1
+
+
+def _leaf_paths(fields: list, prefix: str = "") -> list[str]:
+    paths = list()
+    for key, sub_selection in fields:
+        if sub_selection is None:
+            paths.append(prefix + key)
+        else:
+            paths.extend(_leaf_paths(sub_selection, prefix + key + "."))
+    return paths
+
+
+def selection_paths(query: str) -> dict[str, list[str]]:
+    """
+    Parses a GraphQL query and returns, for each root field (keyed by its
+    alias if any, i.e. by its key in the response), the dotted paths of the
+    leaf fields it selects. The paths are the column names that
+    `pd.json_normalize` gives to the response items, in the same order
+    (top-level fields first, then the nested ones, in query order).
+
+    Args:
+        query (str): The GraphQL query, e.g. "{ borrows(first: 10) { id user { id } } }"
+    Returns:
+        dict[str, list[str]]: The leaf paths of each root field.
+    """
+    tokens = _token_pattern.findall(query)
+    root_fields, _ = _parse_selection_set(tokens, 0)
+    roots = dict()
+    for key, sub_selection in root_fields:
+        paths = _leaf_paths(sub_selection)
+        roots[key] = [path for path in paths if "." not in path] + [
+            path for path in paths if "." in path
+        ]
+    return roots
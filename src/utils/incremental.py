@@ -0,0 +1,160 @@
+"""Watermarks of the incremental extractions"""
+
+from datetime import datetime, timedelta, timezone
+import json
+import time
+from typing import Optional
+import pandas as pd
+from pandas import DataFrame
+
+
+class WatermarkStore:
+    """
+    JSON object on s3 storing, for each dataset and entity (event type,
+    token...), the timestamp and id of the last extracted item. The incremental
+    runs of the ETLs only fetch the items that are more recent than the
+    watermark. The object is stored next to the outputs it describes, so that a
+    run on any machine starts from the same watermarks.
+
+    Each save merges the watermarks with the ones on s3, keeping the most
+    recent watermark of each entity, so that runs updating different entities
+    at the same time do not overwrite each other.
+    """
+
+    def __init__(self, client_s3, bucket: str, key: str) -> None:
+        self.client_s3 = client_s3
+        self.bucket = bucket
+        self.key = key
+        self.watermarks = self._read()
+
+    def get(self, dataset: str, entity: str) -> Optional[dict]:
+        return self.watermarks.get(dataset, dict()).get(entity)
+
+    def timestamp(self, dataset: str, entities: list[str]) -> Optional[int]:
+        """
+        Returns the oldest watermark timestamp of `entities`, or None if one of
+        them has never been extracted.
+        """
+        watermarks = [self.get(dataset, entity) for entity in entities]
+        if any(watermark is None for watermark in watermarks):
+            return None
+        return min(watermark["timestamp"] for watermark in watermarks)
+
+    def update(
+        self,
+        dataset: str,
+        entity: str,
+        data: DataFrame,
+        timestamp_column: str = "timestamp",
+    ) -> None:
+        """
+        Moves the watermark of (dataset, entity) to the most recent item of
+        `data`. The watermark never goes backward. It must not be moved past a
+        month whose upload failed, otherwise the next run skips that month.
+        """
+        if len(data) == 0:
+            return
+        timestamps = pd.to_numeric(data[timestamp_column])
+        last_item = data.loc[timestamps == timestamps.max()].sort_values("id").iloc[-1]
+        watermark = {
+            "timestamp": int(timestamps.max()),
+            "id": str(last_item["id"]),
+        }
+        previous_watermark = self.get(dataset, entity)
+        if previous_watermark is not None and (
+            previous_watermark["timestamp"],
+            previous_watermark["id"],
+        ) >= (watermark["timestamp"], watermark["id"]):
+            return
+        self.watermarks.setdefault(dataset, dict())[entity] = watermark
+        self._save()
+
+    def _read(self) -> dict:
+        try:
+            output = self.client_s3.get_object(Bucket=self.bucket, Key=self.key)
+        except self.client_s3.exceptions.NoSuchKey:
+            return dict()
+        return json.loads(output["Body"].read())
+
+    def _save(self) -> None:
+        self._merge(self._read())
+        self.client_s3.put_object(
+            Body=json.dumps(self.watermarks, indent=2),
+            Bucket=self.bucket,
+            Key=self.key,
+        )
+
+    def _merge(self, watermarks: dict) -> None:
+        """Adds the watermarks saved by other runs, if they are more recent."""
+        for dataset, entities in watermarks.items():
+            for entity, watermark in entities.items():
+                current_watermark = self.get(dataset, entity)
+                if current_watermark is None or (
+                    watermark["timestamp"],
+                    watermark["id"],
+                ) > (current_watermark["timestamp"], current_watermark["id"]):
+                    self.watermarks.setdefault(dataset, dict())[entity] = watermark
+
+
+def read_output(client_s3, bucket: str, key: str) -> Optional[DataFrame]:
+    """Returns the CSV output stored at `key` on s3, or None if there is none."""
+    try:
+        output = client_s3.get_object(Bucket=bucket, Key=key)
+    except client_s3.exceptions.NoSuchKey:
+        return None
+    return pd.read_csv(output["Body"])
+
+
+def month_bounds(year: int, month: int) -> tuple[float, float]:
+    """Returns the timestamps of the beginning and of the end of the month."""
+    start_date = datetime(year, month, 1, tzinfo=timezone.utc)
+    next_date = start_date + timedelta(days=32)
+    end_date = datetime(next_date.year, next_date.month, 1, tzinfo=timezone.utc)
+    return datetime.timestamp(start_date), datetime.timestamp(end_date)
+
+
+def incremental_months(
+    watermark_timestamp: int, now: Optional[float] = None
+) -> list[tuple[int, int]]:
+    """
+    Returns the (year, month) pairs from the month of the watermark to the
+    current month, i.e. the months that an incremental run has to update.
+    """
+    current_date = datetime.fromtimestamp(
+        now if now is not None else time.time(), tz=timezone.utc
+    )
+    date = datetime.fromtimestamp(watermark_timestamp, tz=timezone.utc)
+    months = list()
+    year, month = date.year, date.month
+    while (year, month) <= (current_date.year, current_date.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def incremental_timestamp_min(
+    year: int, month: int, watermark_timestamp: Optional[int]
+) -> float:
+    """
+    Returns the lower timestamp bound of an extraction of the month: the start
+    of the month, or the watermark if it is more recent. The bound is strict
+    (`timestamp_gt`), so the items at the watermark timestamp are fetched again
+    and deduplicated by `append_rows`.
+    """
+    timestamp_min, _ = month_bounds(year, month)
+    if watermark_timestamp is None:
+        return timestamp_min
+    return max(timestamp_min, watermark_timestamp - 1)
+
+
+def append_rows(previous_data: Optional[DataFrame], new_data: DataFrame) -> DataFrame:
+    """
+    Appends the newly extracted rows to the previous output of the month. Rows
+    fetched twice (same `id`) are kept once, with their latest values.
+    """
+    if previous_data is None or len(previous_data) == 0:
+        return new_data.reset_index(drop=True)
+    if len(new_data) == 0:
+        return previous_data.reset_index(drop=True)
+    data = pd.concat([previous_data, new_data], ignore_index=True)
+    return data.drop_duplicates("id", keep="last").reset_index(drop=True)
@@ -0,0 +1,118 @@
+"""Joins on integer-encoded keys"""
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+
+def factorize_columns(
+    frames: list[DataFrame], on: list[str], sort: bool = False
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Factorizes each column of `on` against a dictionary shared by all the
+    frames. The missing values get a code of their own, as in `merge`.
+
+    Args:
+        frames (list[DataFrame]): The dataframes whose keys are compared
+        on (list[str]): The key columns
+        sort (bool): Whether the codes follow the order of the values
+    Returns:
+        list[tuple[np.ndarray, np.ndarray]]: For each column, the codes of the
+            rows of the concatenated frames and the distinct values.
+    """
+    return [
+        pd.factorize(
+            np.concatenate([frame[column].to_numpy() for frame in frames]),
+            sort=sort,
+            use_na_sentinel=False,
+        )
+        for column in on
+    ]
+
+
+def pack_codes(
+    codes: list[np.ndarray], sizes: list[int], sort: bool = False
+) -> np.ndarray:
+    """
+    Packs the codes of several columns into a single int64 key per row, in
+    mixed radix. When the product of the sizes does not fit in 63 bits, the
+    keys packed so far are renumbered first.
+
+    Args:
+        codes (list[np.ndarray]): The codes of each column
+        sizes (list[int]): The number of distinct codes of each column
+        sort (bool): Whether the keys follow the lexicographic order of the codes
+    Returns:
+        np.ndarray: The keys.
+    """
+    keys = np.zeros(len(codes[0]) if len(codes) > 0 else 0, dtype=np.int64)
+    n_keys = 1
+    for column_codes, size in zip(codes, sizes):
+        if n_keys * size >= 2**63:
+            keys, packed_uniques = pd.factorize(keys, sort=sort)
+            n_keys = len(packed_uniques)
+        keys = keys * size + column_codes
+        n_keys *= size
+    return keys
+
+
+def encode_keys(
+    frames: list[DataFrame], on: list[str], sort: bool = False
+) -> list[np.ndarray]:
+    """
+    Encodes the key columns `on` of several dataframes into a single int64 key
+    per row, equal for two rows if and only if their keys are equal (missing
+    values included, as with `merge` and `drop_duplicates`). Each column is
+    factorized against a dictionary shared by all the frames, and the codes are
+    packed in mixed radix.
+
+    Args:
+        frames (list[DataFrame]): The dataframes whose keys are compared
+        on (list[str]): The key columns
+        sort (bool): Whether the keys follow the order of the key tuples
+    Returns:
+        list[np.ndarray]: The keys of the rows of each dataframe.
+    """
+    factorized = factorize_columns(frames, on, sort=sort)
+    keys = pack_codes(
+        [codes for codes, _ in factorized],
+        [len(uniques) for _, uniques in factorized],
+        sort=sort,
+    )
+    return np.split(keys, np.cumsum([len(frame) for frame in frames])[:-1])
+
+
+def left_join_unique(
+    left: DataFrame,
+    right: DataFrame,
+    left_keys: np.ndarray,
+    right_keys: np.ndarray,
+    columns: list[str],
+) -> tuple[DataFrame, np.ndarray]:
+    """
+    Left join of `left` with the `columns` of `right` on the keys returned by
+    `encode_keys`. Each row of `left` matches at most one row of `right`, so
+    the output has the rows of `left`, in the same order, as a left `merge`
+    whose right keys are unique.
+
+    Args:
+        left (DataFrame): The left dataframe
+        right (DataFrame): The right dataframe, whose keys are unique
+        left_keys (np.ndarray): The keys of `left`
+        right_keys (np.ndarray): The keys of `right`
+        columns (list[str]): The columns of `right` to add to `left`
+    Returns:
+        DataFrame: `left` with the extra columns, NaN for the unmatched rows
+        np.ndarray: The mask of the matched rows of `left`.
+    Raises:
+        ValueError: If the keys of `right` are not unique.
+    """
+    right_index = pd.Index(right_keys)
+    if not right_index.is_unique:
+        raise ValueError("The keys of the right dataframe are not unique")
+    positions = right_index.get_indexer(left_keys)
+    matched = right[columns].reset_index(drop=True).reindex(positions)
+    joined = left.reset_index(drop=True)
+    for column in columns:
+        joined[column] = matched[column].to_numpy()
+    return joined, positions >= 0
@@ -0,0 +1,55 @@
+"""Page accumulator for the subgraph fetch loops"""
+
+from typing import Optional
+import pandas as pd
+from pandas import DataFrame
+
+
+class PageBuffer:
+    """
+    Accumulates the fetched pages and builds the DataFrame once at the end,
+    instead of concatenating a new DataFrame per page (which copies everything
+    fetched so far at each page).
+
+    When the field paths of the entity are given (see `selection_paths`), the
+    items are decoded straight into one buffer per column, named like the
+    `pd.json_normalize` columns (e.g. "userReserve.reserve.name"). Otherwise the
+    raw records are kept and normalized by `pd.json_normalize` at the end.
+    """
+
+    def __init__(self, fields: Optional[list[str]] = None) -> None:
+        self.fields = fields
+        self.records = list()
+        self.size = 0
+        if fields is not None:
+            self.columns = {field: list() for field in fields}
+            self.keys = [tuple(field.split(".")) for field in fields]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, page: list[dict]) -> None:
+        self.size += len(page)
+        if self.fields is None:
+            self.records.extend(page)
+            return
+        for field, keys in zip(self.fields, self.keys):
+            column = self.columns[field]
+            if len(keys) == 1:
+                key = keys[0]
+                column.extend([item.get(key) for item in page])
+                continue
+            for item in page:
+                value = item
+                for key in keys:
+                    if value is None:
+                        break
+                    value = value.get(key)
+                column.append(value)
+
+    def to_frame(self) -> DataFrame:
+        if self.fields is None:
+            return pd.json_normalize(self.records)
+        if self.size == 0:
+            return pd.DataFrame()
+        return pd.DataFrame(self.columns)
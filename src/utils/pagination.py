@@ -0,0 +1,120 @@
+"""Keyset pagination utils for the subgraph fetch loops"""
+
+from typing import Awaitable, Callable, Iterator, Optional
+from .checkpoint import Checkpoint
+
+
+def paginate(
+    fetch_page: Callable[[str], list[dict]],
+    size: int,
+    max_queries: int,
+    verbose: bool = False,
+    checkpoint: Optional[Checkpoint] = None,
+) -> Iterator[list[dict]]:
+    """
+    Walks a subgraph entity with keyset (cursor) pagination on `id`.
+
+    Instead of skipping `iter * size` items, each query asks for the `size`
+    items whose id is greater than the last id of the previous page. The
+    indexer can then seek directly to the cursor, so every page costs the
+    same whatever its position, and the gateway skip limit does not apply.
+
+    With a checkpoint, the pages fetched by a previous run are yielded first,
+    the loop resumes from the saved cursor and each new page is saved before
+    being yielded.
+
+    Args:
+        fetch_page (Callable[[str], list[dict]]): Function returning the page of
+            items (ordered by ascending id) with an id greater than its argument
+        size (int): The number of items per query
+        max_queries (int): The maximum number of queries
+        verbose (bool): Wether to print execution details
+        checkpoint (Checkpoint): Where to persist the progress, if any
+    Returns:
+        Iterator[list[dict]]: The non-empty pages, in id order.
+    """
+    last_id = ""
+    first_iter = 0
+    if checkpoint is not None:
+        yield from checkpoint.load_pages()
+        if checkpoint.done:
+            print("All data has been already extracted")
+            return
+        last_id = checkpoint.cursor
+        first_iter = checkpoint.n_pages
+        if verbose and first_iter > 0:
+            print(f"      [Resuming after {first_iter} pages]")
+    for iter in range(first_iter, max_queries):
+        if verbose:
+            if iter % 10 == 0:
+                print(f"      [Iteration {iter + 1}/{max_queries}]")
+        page = fetch_page(last_id)
+        if len(page) == 0:
+            if checkpoint is not None:
+                checkpoint.finish()
+            print("All data has been already extracted")
+            return
+        if checkpoint is not None:
+            checkpoint.save_page(page, last_page=len(page) < size)
+        yield page
+        if len(page) < size:
+            print("All data has been already extracted")
+            return
+        last_id = page[-1]["id"]
+
+
+async def paginate_async(
+    fetch_page: Callable[[str], Awaitable[list[dict]]],
+    size: int,
+    max_queries: int,
+) -> list[list[dict]]:
+    """
+    Async version of `paginate`, returning the list of the non-empty pages.
+
+    Args:
+        fetch_page (Callable[[str], Awaitable[list[dict]]]): Coroutine function
+            returning the page of items with an id greater than its argument
+        size (int): The number of items per query
+        max_queries (int): The maximum number of queries
+    Returns:
+        list[list[dict]]: The non-empty pages, in id order.
+    """
+    pages = []
+    last_id = ""
+    for _ in range(max_queries):
+        page = await fetch_page(last_id)
+        if len(page) == 0:
+            break
+        pages.append(page)
+        if len(page) < size:
+            break
+        last_id = page[-1]["id"]
+    return pages
+
+
+def time_windows(
+    timestamp_min: int, timestamp_max: int, step: int
+) -> list[tuple[int, int]]:
+    """
+    Splits the (timestamp_min, timestamp_max) window of a query (both bounds
+    excluded, as in the `timestamp_gt`/`timestamp_lt` filters) into consecutive
+    sub-windows of `step` seconds. The sub-windows are returned in the same
+    (timestamp_gt, timestamp_lt) convention, do not overlap and cover exactly
+    the same timestamps as the input window.
+
+    Args:
+        timestamp_min (int): The lower bound of the window (excluded)
+        timestamp_max (int): The upper bound of the window (excluded)
+        step (int): The length of the sub-windows in seconds
+    Returns:
+        list[tuple[int, int]]: The (timestamp_gt, timestamp_lt) bounds of the sub-windows.
+    """
+    timestamp_min, timestamp_max = int(timestamp_min), int(timestamp_max)
+    windows = []
+    start = timestamp_min
+    while start < timestamp_max:
+        end = min(start + step, timestamp_max)
+        lower_bound = timestamp_min if start == timestamp_min else start - 1
+        windows.append((lower_bound, end))
+        start = end
+    return windows
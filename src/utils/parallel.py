@@ -0,0 +1,50 @@
+"""Sizing of the process pools of the ETLs"""
+
+import os
+from typing import Optional
+
+
+def available_memory() -> Optional[int]:
+    """
+    Returns the memory available for new processes, in bytes (`MemAvailable`
+    on Linux, the physical memory elsewhere), or None if it is unknown.
+    """
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def workers_for_memory_budget(
+    worker_memory: int,
+    max_workers: Optional[int] = None,
+    memory: Optional[int] = None,
+) -> int:
+    """
+    Returns the number of worker processes that fit in the memory, given the
+    peak memory of one worker. There is always at least one worker. This only
+    sizes the pool: the memory used by each worker is not limited.
+
+    Args:
+        worker_memory (int): The memory budget of one worker, in bytes
+        max_workers (int, optional): The maximum number of workers, by default
+            the number of CPUs
+        memory (int, optional): The memory to share, by default the available
+            memory of the machine
+    Returns:
+        int: The number of workers.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if memory is None:
+        memory = available_memory()
+    if memory is None:
+        return max(1, max_workers)
+    return max(1, min(max_workers, memory // worker_memory))
@@ -0,0 +1,84 @@
+"""Content-addressed on-disk cache of the subgraph responses"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from typing import Optional
+
+
+class QueryCache:
+    """
+    Stores the gzip-compressed responses of the subgraph queries in `directory`,
+    keyed by the hash of the subgraph id and of the normalized query. When the
+    total size of the cache exceeds `max_size_bytes`, the least recently used
+    responses are evicted.
+
+    Only the queries on closed historical windows should be cached, as their
+    responses do not change anymore.
+    """
+
+    def __init__(self, directory: str, max_size_bytes: int = 2 * 1024**3) -> None:
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size_bytes = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def key(api: str, query: str) -> str:
+        # The endpoint url contains the API key: only its subgraph id is hashed
+        endpoint_id = api.rstrip("/").split("/")[-1]
+        normalized_query = " ".join(query.split())
+        return hashlib.sha256(
+            f"{endpoint_id}\n{normalized_query}".encode("utf-8")
+        ).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json.gz")
+
+    def _entries(self) -> list[tuple[str, int, float]]:
+        entries = list()
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith(".json.gz"):
+                    path = os.path.join(root, file)
+                    stat = os.stat(path)
+                    entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get(self, api: str, query: str) -> Optional[dict]:
+        path = self._path(self.key(api, query))
+        try:
+            with gzip.open(path, "rb") as file:
+                output = json.loads(file.read())
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        return output
+
+    def set(self, api: str, query: str, output: dict) -> None:
+        path = self._path(self.key(api, query))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(temporary_path, "wb") as file:
+            file.write(json.dumps(output).encode("utf-8"))
+        with self.lock:
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temporary_path, path)
+            self.size_bytes += os.path.getsize(path) - previous_size
+            if self.size_bytes > self.max_size_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self.size_bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.size_bytes <= self.max_size_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size_bytes -= size
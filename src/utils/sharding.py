@@ -0,0 +1,70 @@
+"""Time-window sharding of the subgraph extractions"""
+
+import concurrent.futures
+from typing import Callable, Union
+import pandas as pd
+from pandas import DataFrame
+from .pagination import time_windows
+
+window_lengths = {"day": 24 * 3600, "hour": 3600}
+
+
+def merge_windows(windows_data: list[DataFrame]) -> DataFrame:
+    windows_data = [data for data in windows_data if len(data) > 0]
+    if len(windows_data) == 0:
+        return pd.DataFrame()
+    data = pd.concat(windows_data, ignore_index=True)
+    data = data.drop_duplicates("id").sort_values("id").reset_index(drop=True)
+    return data
+
+
+def fetch_sharded(
+    fetch_function: Callable[..., Union[DataFrame, dict[str, DataFrame]]],
+    timestamp_min: int,
+    timestamp_max: int,
+    window: str = "day",
+    max_workers: int = 8,
+    **fetch_kwargs,
+) -> Union[DataFrame, dict[str, DataFrame]]:
+    """
+    Splits (timestamp_min, timestamp_max) in day or hour windows and calls
+    `fetch_function` on each window in a bounded thread pool. Each window is
+    paginated on its own cursor, then the outputs are merged and deduplicated
+    by `id`.
+
+    Args:
+        fetch_function (Callable): One of the `fetch_*` functions, called with
+            timestamp_min/timestamp_max set to the window bounds. It can return
+            either a DataFrame or a dict of DataFrames (e.g. `fetch_events_batched`)
+        timestamp_min (int): Used to filter items with a greater timestamp
+        timestamp_max (int): Used to filter items with a lower timestamp
+        window (str): The length of the windows, either "day" or "hour"
+        max_workers (int): The maximum number of windows fetched concurrently
+        **fetch_kwargs: The other arguments of `fetch_function`
+    Returns:
+        DataFrame | dict[str, DataFrame]: The merged outputs, ordered by id.
+    """
+    try:
+        step = window_lengths[window]
+    except KeyError:
+        raise ValueError(f"Unknown window, expected day or hour, got {window}")
+
+    windows = time_windows(timestamp_min, timestamp_max, step=step)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                fetch_function,
+                timestamp_min=window_min,
+                timestamp_max=window_max,
+                **fetch_kwargs,
+            )
+            for window_min, window_max in windows
+        ]
+        windows_data = [future.result() for future in futures]
+
+    if len(windows_data) > 0 and isinstance(windows_data[0], dict):
+        return {
+            key: merge_windows([data[key] for data in windows_data])
+            for key in windows_data[0]
+        }
+    return merge_windows(windows_data)
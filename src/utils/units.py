@@ -0,0 +1,47 @@
+"""Vectorized conversion of the on-chain integer amounts to floats"""
+
+from typing import Union
+import numpy as np
+from pandas import Series
+
+# The rates and indexes are stored as rays (27 decimals)
+RAY = 1e-27
+
+
+def parse_integers(values: Union[Series, np.ndarray, list]) -> np.ndarray:
+    """
+    Vectorized equivalent of `values.apply(int)` followed by a conversion to
+    float64, for the decimal strings (wei amounts, ray indexes...) returned by
+    the subgraphs. The strings are parsed by the float64 cast, which rounds
+    them correctly.
+
+    Args:
+        values (Series | np.ndarray | list): Decimal strings (or integers)
+    Returns:
+        np.ndarray: The float64 values.
+    Raises:
+        ValueError: If a value is not an integer.
+    """
+    floats = np.asarray(values).astype(np.float64)
+    if not np.all(np.isfinite(floats) & (floats == np.trunc(floats))):
+        raise ValueError("The values are not all integers")
+    return floats
+
+
+def to_units(
+    values: Union[Series, np.ndarray, list],
+    decimals: Union[Series, np.ndarray, int],
+) -> np.ndarray:
+    """
+    Vectorized equivalent of `values.apply(int) / 10**decimals`, to convert the
+    token amounts from their smallest unit (e.g. wei) to token units. The
+    results are within 1 ulp of the ones of `apply`, and equal to them in the
+    int64 range.
+
+    Args:
+        values (Series | np.ndarray | list): Decimal strings (or integers)
+        decimals (Series | np.ndarray | int): The decimals of each value
+    Returns:
+        np.ndarray: The float64 amounts.
+    """
+    return parse_integers(values) / 10.0 ** np.asarray(decimals, dtype=np.int64)
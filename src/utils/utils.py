@@ -1,14 +1,307 @@
+import asyncio
+from email.utils import parsedate_to_datetime
+import json
+import os
+import random
+import threading
+import time
+from typing import Optional
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from .query_cache import QueryCache
 
+try:
+    import brotli  # noqa: F401
 
-def run_query(api: str, query: str) -> dict:
-    """A simple function to use requests.post to make the API call."""
-    request = requests.post(api, json={"query": query})
-    if request.status_code == 200:
-        return request.json()
-    else:
-        raise Exception(
-            "Query failed to run by returning code of {}. {}".format(
-                request.status_code, query
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# (connect timeout, read timeout) in seconds
+DEFAULT_TIMEOUT = (10, 120)
+POOL_MAXSIZE = 32
+
+# Retries
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+# GraphQL error messages of transient failures (the other errors, e.g. query
+# validation errors, fail in the same way when retried)
+TRANSIENT_ERROR_MESSAGES = (
+    "unavailable",
+    "timeout",
+    "timed out",
+    "too many",
+    "rate limit",
+    "bad indexers",
+    "try again",
+    "overloaded",
+)
+
+# Gateway quota shared by all the threads of the process
+MAX_QUERIES_PER_SECOND = float(os.getenv("API_MAX_QUERIES_PER_SECOND", 20))
+
+# Closed windows end at least that long ago (in seconds), to leave time for indexing
+CLOSED_WINDOW_DELAY = 3600
+
+_session = None
+_session_lock = threading.Lock()
+_query_cache = None
+_query_cache_lock = threading.Lock()
+
+
+class QueryError(Exception):
+    """Raised when a query fails, `retryable` tells whether it is worth retrying."""
+
+    def __init__(self, message: str, retryable: bool = False) -> None:
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter: allows `rate` queries per second on
+    average, with bursts of up to `capacity` queries.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns the time to wait before using it (in seconds)."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
             )
+            self.updated_at = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self) -> None:
+        time.sleep(self.reserve())
+
+    async def acquire_async(self) -> None:
+        await asyncio.sleep(self.reserve())
+
+
+rate_limiter = TokenBucket(rate=MAX_QUERIES_PER_SECOND)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Returns the time to wait before the next attempt: the `Retry-After` header
+    if the server sent one, else an exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of the failed attempt, starting at 0
+        retry_after (str): The value of the `Retry-After` header, if any
+    Returns:
+        float: The delay in seconds.
+    """
+    if retry_after is not None:
+        try:
+            return min(BACKOFF_MAX, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after).timestamp()
+                return min(BACKOFF_MAX, max(0.0, retry_at - time.time()))
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+def decode_json(content: bytes) -> dict:
+    """Decodes a JSON response body, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def check_response(status_code: int, content: bytes, query: str) -> dict:
+    """
+    Returns the decoded response, or raises a `QueryError`. Throttling, server
+    side errors and transient GraphQL `errors` (indexer unavailable, timeouts,
+    or partial `data` returned with the errors) are flagged as retryable; the
+    other GraphQL errors, such as validation errors, are not.
+    """
+    if status_code == 200:
+        output = decode_json(content)
+        if not output.get("errors"):
+            return output
+        messages = " ".join(
+            str(error.get("message", "")) if isinstance(error, dict) else str(error)
+            for error in output["errors"]
+        ).lower()
+        raise QueryError(
+            f"Query returned errors: {output['errors']}. {query}",
+            retryable=output.get("data") is not None
+            or any(message in messages for message in TRANSIENT_ERROR_MESSAGES),
         )
+    raise QueryError(
+        "Query failed to run by returning code of {}. {}".format(status_code, query),
+        retryable=status_code in RETRY_STATUS_CODES,
+    )
+
+
+def get_query_cache() -> Optional[QueryCache]:
+    """
+    Returns the on-disk response cache, or None if the `QUERY_CACHE_DIRECTORY`
+    environment variable is not set. The maximum size of the cache can be set
+    with `QUERY_CACHE_MAX_BYTES`.
+    """
+    global _query_cache
+    directory = os.getenv("QUERY_CACHE_DIRECTORY")
+    if _query_cache is None and directory:
+        with _query_cache_lock:
+            if _query_cache is None:
+                _query_cache = QueryCache(
+                    directory=directory,
+                    max_size_bytes=int(os.getenv("QUERY_CACHE_MAX_BYTES", 2 * 1024**3)),
+                )
+    return _query_cache
+
+
+def is_closed_window(timestamp_max: float) -> bool:
+    """Whether a query window ended long enough ago for its results to be final."""
+    return float(timestamp_max) < time.time() - CLOSED_WINDOW_DELAY
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide HTTP session, creating it on first use.
+
+    The session keeps connections alive in a pool shared by every thread, so
+    consecutive queries to the same host reuse the TCP/TLS connection instead
+    of doing a new handshake per page.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Accept-Encoding": ACCEPT_ENCODING})
+                _session = session
+    return _session
+
+
+def run_query(
+    api: str,
+    query: str,
+    timeout: tuple = DEFAULT_TIMEOUT,
+    max_retries: int = MAX_RETRIES,
+    cacheable: bool = False,
+) -> dict:
+    """
+    Posts the query through the shared session, under the shared rate limiter.
+    Retryable errors (see `check_response`) and network errors are retried with
+    exponential backoff and jitter, or after the `Retry-After` delay when the
+    gateway sends one.
+
+    Args:
+        api (str): The SubGraph endpoint url
+        query (str): The GraphQL query
+        timeout (tuple): The (connect, read) timeouts in seconds
+        max_retries (int): The maximum number of retries
+        cacheable (bool): Whether the response is final (closed historical
+            window) and can be served from / stored in the on-disk cache
+    Returns:
+        dict: The decoded response.
+    """
+    query_cache = get_query_cache() if cacheable else None
+    if query_cache is not None:
+        output = query_cache.get(api, query)
+        if output is not None:
+            return output
+
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire()
+        retry_after = None
+        try:
+            request = get_session().post(api, json={"query": query}, timeout=timeout)
+            retry_after = request.headers.get("Retry-After")
+            output = check_response(request.status_code, request.content, query)
+            if query_cache is not None:
+                query_cache.set(api, query, output)
+            return output
+        except QueryError as e:
+            if not e.retryable or attempt == max_retries:
+                raise
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == max_retries:
+                raise QueryError(f"Query failed with error: {e}. {query}") from e
+        time.sleep(backoff_delay(attempt, retry_after))
+
+
+def get_async_client(max_connections: int = POOL_MAXSIZE) -> httpx.AsyncClient:
+    """
+    Returns a new async HTTP client with the same connection settings as the
+    shared session. To be used as an async context manager.
+
+    Args:
+        max_connections (int): The size of the connection pool
+    Returns:
+        httpx.AsyncClient: The async client.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+        headers={"Accept-Encoding": ACCEPT_ENCODING},
+        timeout=httpx.Timeout(DEFAULT_TIMEOUT[1], connect=DEFAULT_TIMEOUT[0]),
+    )
+
+
+async def run_query_async(
+    client: httpx.AsyncClient,
+    api: str,
+    query: str,
+    max_retries: int = MAX_RETRIES,
+    cacheable: bool = False,
+) -> dict:
+    """Async version of `run_query`, posting the query with `client`."""
+    query_cache = get_query_cache() if cacheable else None
+    if query_cache is not None:
+        output = query_cache.get(api, query)
+        if output is not None:
+            return output
+
+    for attempt in range(max_retries + 1):
+        await rate_limiter.acquire_async()
+        retry_after = None
+        try:
+            request = await client.post(api, json={"query": query})
+            retry_after = request.headers.get("Retry-After")
+            output = check_response(request.status_code, request.content, query)
+            if query_cache is not None:
+                query_cache.set(api, query, output)
+            return output
+        except QueryError as e:
+            if not e.retryable or attempt == max_retries:
+                raise
+        except httpx.TransportError as e:
+            if attempt == max_retries:
+                raise QueryError(f"Query failed with error: {e}. {query}") from e
+        await asyncio.sleep(backoff_delay(attempt, retry_after))
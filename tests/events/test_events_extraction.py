@@ -0,0 +1,148 @@
+import asyncio
+import random
+import re
+from ...src.events import events_extraction_functions as extraction
+
+query_block_pattern = re.compile(
+    r'(?:(\w+): )?(\w+)\(\s*first: (\d+),.*?id_gt: "([^"]*)"', re.DOTALL
+)
+
+
+def make_items(event, n):
+    items = list()
+    for k in range(n):
+        item = dict()
+        for path in extraction.event_fields(event, version_2=True):
+            *parents, field = path.split(".")
+            node = item
+            for parent in parents:
+                node = node.setdefault(parent, dict())
+            node[field] = f"{event}-{field}-{k}"
+        item["id"] = f"0x{k:04d}"
+        item["timestamp"] = str(1704067200 + k)
+        items.append(item)
+    return items
+
+
+def test_fetch_events_batched(monkeypatch):
+    n_items = {"borrow": 25, "repay": 7, "deposit": 0}
+    items = {
+        response_key: make_items(event, n_items[event])
+        for event, response_key in [
+            ("borrow", "borrows"),
+            ("repay", "repays"),
+            ("deposit", "deposits"),
+        ]
+    }
+    queries = list()
+
+    def run_query(api, query, **kwargs):
+        cursors = dict()
+        output = dict()
+        for alias, response_key, size, last_id in query_block_pattern.findall(query):
+            cursors[alias or response_key] = last_id
+            output[alias or response_key] = [
+                item for item in items[response_key] if item["id"] > last_id
+            ][: int(size)]
+        queries.append(cursors)
+        return {"data": output}
+
+    monkeypatch.setattr(extraction, "run_query", run_query)
+    arguments = dict(
+        api_endpoint="http://subgraph",
+        size=10,
+        max_queries=10,
+        timestamp_min=1704067200,
+        timestamp_max=1706745600,
+        version_2=True,
+    )
+    events_data = extraction.fetch_events_batched(
+        events=["borrow", "repay", "deposit"], **arguments
+    )
+
+    # One alias per event type, each one on its own cursor; the exhausted
+    # types are not queried anymore
+    assert queries == [
+        {"borrow": "", "repay": "", "deposit": ""},
+        {"borrow": "0x0009"},
+        {"borrow": "0x0019"},
+    ]
+    assert [len(events_data[event]) for event in ["borrow", "repay", "deposit"]] == [
+        25,
+        7,
+        0,
+    ]
+
+    queries.clear()
+    for event in ["borrow", "repay", "deposit"]:
+        expected = extraction.fetch_events(event=event, **arguments)
+        assert events_data[event].equals(expected)
+
+
+def test_fetch_events_async(monkeypatch):
+    generator = random.Random(0)
+    # Ids in a different order than the timestamps, and several items per second
+    items = make_items("borrow", 230)
+    for item in items:
+        item["id"] = f"0x{generator.getrandbits(32):08x}"
+        item["timestamp"] = str(1704067200 + generator.randrange(0, 3600))
+
+    def serve_page(size, last_id, timestamp_min, timestamp_max):
+        page = sorted(
+            (
+                item
+                for item in items
+                if timestamp_min < int(item["timestamp"]) < timestamp_max
+                and item["id"] > last_id
+            ),
+            key=lambda item: item["id"],
+        )
+        return page[:size]
+
+    in_flight = 0
+    max_in_flight = 0
+    n_queries = 0
+
+    async def extract_event_async(
+        client,
+        api_endpoint,
+        event,
+        size,
+        last_id,
+        timestamp_min,
+        timestamp_max,
+        **kwargs,
+    ):
+        nonlocal in_flight, max_in_flight, n_queries
+        in_flight += 1
+        n_queries += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+        return serve_page(size, last_id, timestamp_min, timestamp_max)
+
+    def extract_event(
+        api_endpoint, event, size, last_id, timestamp_min, timestamp_max, **kwargs
+    ):
+        return serve_page(size, last_id, timestamp_min, timestamp_max)
+
+    monkeypatch.setattr(extraction, "extract_event_async", extract_event_async)
+    monkeypatch.setattr(extraction, "extract_event", extract_event)
+    arguments = dict(
+        api_endpoint="http://subgraph",
+        size=10,
+        max_queries=100,
+        timestamp_min=1704067199,
+        timestamp_max=1704070800,
+        event="borrow",
+        version_2=True,
+    )
+    expected = extraction.fetch_events(**arguments)
+    assert len(expected) == 230
+
+    events_data = extraction.fetch_events(max_concurrency=3, n_slices=8, **arguments)
+    # Several keyset pages per sub-window, never more than 3 queries in flight
+    assert n_queries > 8 * 2
+    assert max_in_flight == 3
+    assert events_data.id.is_unique
+    assert events_data.equals(expected)
@@ -1,7 +1,12 @@
 import pytest
-from ...src.reserves_features.reserves_features import fill_missing_data
+from ...src.reserves_features.reserves_features import (
+    fill_missing_data,
+    flag_outlier_indexes,
+    get_hourly_granularity,
+)
 from pandas import Timestamp, DataFrame
 import numpy as np
+import pandas as pd
 from ...src.utils.logger import Logger
 
 logger = Logger()
@@ -411,3 +416,131 @@ def test_fill_missing_data(reserves_history_hourly_selected_assets):
         completed_reserves_history.loc[Timestamp("2024-01-06 03:00:00"), "true_value"]
         == 1
     )
+
+
+def merge_fill_missing_data(hourly_reserves_snapshots):
+    """Reference implementation: one merge per reserve on the hours of the panel"""
+    datetimes = pd.to_datetime(hourly_reserves_snapshots.datetime)
+    delta_hours = int((datetimes.max() - datetimes.min()).total_seconds() / 3600)
+    base_output = DataFrame(
+        {
+            "regular_datetime": [
+                datetimes.min() + pd.Timedelta(hours=k) for k in range(delta_hours + 1)
+            ]
+        }
+    )
+    outputs = list()
+    for reserve in hourly_reserves_snapshots.reserve_name.unique():
+        reserve_data = hourly_reserves_snapshots[
+            hourly_reserves_snapshots.reserve_name == reserve
+        ]
+        reserve_output = base_output.merge(
+            reserve_data, how="left", left_on="regular_datetime", right_on="datetime"
+        )
+        reserve_output = reserve_output.infer_objects(copy=False).ffill()
+        reserve_output.reserve_name = reserve
+        true_values = DataFrame(
+            {"regular_datetime": reserve_data.datetime, "true_value": 1}
+        )
+        reserve_output = reserve_output.merge(
+            true_values, how="left", on="regular_datetime"
+        )
+        reserve_output[["true_value"]] = reserve_output[["true_value"]].fillna(0)
+        outputs.append(reserve_output.drop(columns="datetime"))
+    return pd.concat(outputs)
+
+
+def test_fill_missing_data_several_reserves():
+    datetimes = pd.date_range("2024-01-01", periods=12, freq="h", tz="UTC")
+    # Different first and last hours, and gaps, for each reserve
+    kept_hours = {
+        "USD Coin": [0, 1, 4, 5, 11],
+        "Dai Stablecoin": [2, 3, 7],
+        "Wrapped Ether": [5, 6, 8, 9, 10],
+    }
+    snapshots = pd.concat(
+        [
+            DataFrame(
+                {
+                    "reserve_name": reserve_name,
+                    "symbol": reserve_name.upper(),
+                    "timestamp": datetimes[hours].astype(np.int64) // 10**9,
+                    "liquidityRate": np.arange(len(hours)) / 100,
+                    "datetime": datetimes[hours],
+                }
+            )
+            for reserve_name, hours in kept_hours.items()
+        ],
+        ignore_index=True,
+    )
+    completed_reserves = fill_missing_data(snapshots, logger=logger, verbose=False)
+
+    assert len(completed_reserves) == 3 * 12
+    for reserve_name, hours in kept_hours.items():
+        reserve_data = completed_reserves[
+            completed_reserves.reserve_name == reserve_name
+        ]
+        assert reserve_data.regular_datetime.tolist() == datetimes.tolist()
+        assert reserve_data.true_value.tolist() == [
+            float(hour in hours) for hour in range(12)
+        ]
+        # Empty before the first snapshot of the reserve, filled after
+        assert reserve_data.symbol.isna().tolist() == [
+            hour < hours[0] for hour in range(12)
+        ]
+
+    # Same columns, rows and order as the merge based implementation
+    pd.testing.assert_frame_equal(
+        completed_reserves, merge_fill_missing_data(snapshots)
+    )
+
+
+def test_flag_outlier_indexes():
+    rng = np.random.default_rng(0)
+    index = 1 + np.cumsum(rng.exponential(1e-4, 200))
+    outliers = rng.integers(0, 200, 20)
+    index[outliers] += rng.choice([-1, 1], 20) * rng.exponential(1e-2, 20)
+    reserves_data = DataFrame({"timestamp": np.arange(200)[::-1], "index": index[::-1]})
+
+    # Row by row reference implementation
+    expected_mask = np.ones(200, dtype=bool)
+    expected_mask[0] = False
+    last_valid_value = index[1]
+    for position in range(2, 200):
+        if (index[position] < last_valid_value) or (
+            abs(index[position] - last_valid_value) > 5e-3
+        ):
+            expected_mask[position] = False
+        else:
+            last_valid_value = index[position]
+
+    flagged_data = flag_outlier_indexes(reserves_data, "index", 5e-3)
+    assert flagged_data.timestamp.tolist() == list(range(200))
+    assert flagged_data.is_not_outlier_index.tolist() == expected_mask.tolist()
+
+
+def test_get_hourly_granularity():
+    reserves_table = DataFrame(
+        {
+            "reserve_name": ["USD Coin", "Aave Token", "USD Coin", "USD Coin"] * 2,
+            "timestamp": [3600, 3700, 3650, 3650, 7300, 7400, 7200, 7300],
+            "row": list(range(8)),
+        }
+    )
+    hourly_data = get_hourly_granularity(reserves_table, logger, verbose=False)
+    # Last row of each (reserve, hour), the first one in case of ties
+    assert hourly_data.row.tolist() == [1, 2, 4, 5]
+    assert hourly_data.datetime.tolist() == [
+        Timestamp("1970-01-01 01:00:00", tz="UTC"),
+        Timestamp("1970-01-01 01:00:00", tz="UTC"),
+        Timestamp("1970-01-01 02:00:00", tz="UTC"),
+        Timestamp("1970-01-01 02:00:00", tz="UTC"),
+    ]
+
+    reserves_table["liquidityIndex"] = 1.0
+    reserves_table["variableBorrowIndex"] = 1.0
+    hourly_data = get_hourly_granularity(
+        reserves_table, logger, version_2=True, verbose=False
+    )
+    # Ordered by reserve and timestamp
+    assert hourly_data.row.tolist() == [2, 4, 1, 5]
@@ -1,8 +1,11 @@
 import pytest
+import numpy as np
 import pandas as pd
 from pandas import DataFrame, Timestamp
 from ...src.reserves_features.reserves_features_quality_check import (
     add_clean_data_per_asset,
+    remove_indexes_outliers,
+    reserves_quality_report,
 )
 
 
@@ -253,3 +256,51 @@ def test_add_clean_data_per_asset(hourly_asset_reserve_completed):
         clean_data.fixed_variableBorrowRate.tolist()
         == hourly_asset_reserve_completed.variableBorrowRate.tolist()
     )
+
+
+def test_remove_indexes_outliers():
+    index = 1 + np.arange(48) * 1e-4
+    # Outliers in the middle of the first day, and on the first hour of the second
+    index[5] = 1.5
+    index[24] = 0.5
+    reserve_data = DataFrame(
+        {
+            "regular_datetime": pd.date_range("2023-01-01", periods=48, freq="h"),
+            "reserve_name": "Dai Stablecoin",
+            "liquidityIndex": index,
+        }
+    )
+    clean_data = remove_indexes_outliers(reserve_data, "liquidityIndex")
+    fixed_index = clean_data.fixed_liquidityIndex.to_numpy()
+    assert fixed_index[5] == index[4]
+    # The first value of a day takes the maximum fixed value of the previous day
+    assert fixed_index[24] == index[23]
+    assert (
+        np.delete(fixed_index, [5, 24]).tolist() == np.delete(index, [5, 24]).tolist()
+    )
+
+
+def test_reserves_quality_report(hourly_asset_reserve_completed):
+    other_reserve = hourly_asset_reserve_completed.copy()
+    other_reserve["reserve_name"] = "USD Coin"
+    other_reserve["liquidityIndex"] = 1.0
+    panel = pd.concat([hourly_asset_reserve_completed, other_reserve])
+    report = reserves_quality_report(panel, version_2=True)
+    assert report.columns.tolist() == [
+        "reserve_name",
+        "n_rows",
+        "valid_length",
+        "n_duplicates",
+        "index_score",
+        "rate_score",
+        "quality_score",
+        "passed",
+    ]
+    assert report.reserve_name.tolist() == ["Dai Stablecoin", "USD Coin"]
+    assert report.n_rows.tolist() == [15, 15]
+    assert report.valid_length.tolist() == [False, False]
+    assert report.n_duplicates.tolist() == [0, 0]
+    # The liquidity index decreases once, on the 6th row
+    assert report.index_score.tolist() == [(1 + 14 / 15) / 2, 1.0]
+    assert report.rate_score.tolist() == [1.0, 1.0]
+    assert not report.passed.any()
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from ...src.reserves_features.reserves_features import fill_missing_data
+from ...src.reserves_features.reserves_features_quality_check import add_clean_data
+from ...src.reserves_features.reserves_tail_state import ReservesTailState
+from ...src.utils.logger import Logger
+
+logger = Logger()
+
+
+def hourly_snapshots():
+    generator = np.random.default_rng(0)
+    datetimes = pd.date_range("2023-01-01", periods=96, freq="h", tz="UTC")
+    snapshots = list()
+    for reserve_name in ["Dai Stablecoin", "USD Coin"]:
+        kept = np.sort(generator.choice(96, size=60, replace=False))
+        index = 1 + np.cumsum(generator.uniform(0, 1e-4, size=96))
+        # An outlier on the first hour of the third day
+        index[48] = 0.5
+        kept = np.union1d(kept, [48])
+        snapshots.append(
+            DataFrame(
+                {
+                    "reserve_name": reserve_name,
+                    "symbol": reserve_name.upper(),
+                    "timestamp": datetimes[kept].astype(np.int64) // 10**9,
+                    "datetime": datetimes[kept],
+                    "liquidityIndex": index[kept],
+                    "variableBorrowIndex": index[kept] * 1.1,
+                    "liquidityRate": generator.uniform(0, 0.1, size=len(kept)),
+                    "variableBorrowRate": generator.uniform(0, 0.1, size=len(kept)),
+                    "utilizationRate": generator.uniform(0, 1, size=len(kept)),
+                }
+            )
+        )
+    # No snapshot of the second reserve at the beginning of the third day
+    snapshots[1] = snapshots[1][
+        (snapshots[1].datetime < datetimes[48])
+        | (snapshots[1].datetime > datetimes[52])
+    ]
+    return pd.concat(snapshots, ignore_index=True)
+
+
+def test_split_panel_matches_full_panel():
+    snapshots = hourly_snapshots()
+    split_datetime = pd.Timestamp("2023-01-03", tz="UTC")
+    full_panel = add_clean_data(
+        fill_missing_data(snapshots, logger, verbose=False), logger
+    )
+
+    first_panel = add_clean_data(
+        fill_missing_data(
+            snapshots[snapshots.datetime < split_datetime], logger, verbose=False
+        ),
+        logger,
+    )
+    tail_state = ReservesTailState.from_json(
+        ReservesTailState.from_panel(first_panel, version_2=True).to_json()
+    )
+    assert tail_state.version_2 is True
+    last_usdc_row = first_panel[first_panel.reserve_name == "USD Coin"].iloc[-1]
+    assert tail_state.last_index("USD Coin", "liquidityIndex") == (
+        last_usdc_row.liquidityIndex
+    )
+    second_panel = add_clean_data(
+        fill_missing_data(
+            snapshots[snapshots.datetime >= split_datetime],
+            logger,
+            verbose=False,
+            tail_state=tail_state,
+        ),
+        logger,
+        tail_state=tail_state,
+    )
+
+    expected_panel = full_panel[full_panel.regular_datetime >= split_datetime]
+    # The first hours of the second reserve are filled from the previous month
+    assert second_panel.liquidityIndex.notna().all()
+    pd.testing.assert_frame_equal(
+        second_panel.sort_values(["reserve_name", "regular_datetime"]).reset_index(
+            drop=True
+        ),
+        expected_panel.sort_values(["reserve_name", "regular_datetime"]).reset_index(
+            drop=True
+        ),
+        check_dtype=False,
+    )
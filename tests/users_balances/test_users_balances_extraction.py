@@ -0,0 +1,57 @@
+import io
+import re
+from ...src.users_balances import users_balances_extraction_functions as extraction
+
+
+def make_items(n):
+    return [
+        {
+            "id": f"0x{k:04d}",
+            "timestamp": str(1704067200 + (k * 7919) % 86400),
+            "scaledATokenBalance": str(k * 10**18 + 1),
+            "currentATokenBalance": str(k * 10**17 + 3),
+            "index": str(10**27 + k),
+            "userReserve": {
+                "reserve": {
+                    "name": "USD Coin" if k % 2 else "Wrapped Ether",
+                    "decimals": "6" if k % 2 else "18",
+                    "usageAsCollateralEnabled": k % 3 == 0,
+                },
+                "user": {"id": f"0xu{k % 5}"},
+                "pool": {"lendingPool": "0xpool"},
+            },
+        }
+        for k in range(n)
+    ]
+
+
+def test_stream_users_balances(monkeypatch, tmp_path):
+    items = make_items(25)
+
+    def run_query(api, query, **kwargs):
+        size = int(re.search(r"first: (\d+)", query).group(1))
+        last_id = re.search(r'id_gt: "([^"]*)"', query).group(1)
+        page = [item for item in items if item["id"] > last_id][:size]
+        return {"data": {"atokenBalanceHistoryItems": page}}
+
+    monkeypatch.setattr(extraction, "run_query", run_query)
+    arguments = dict(
+        api_endpoint="http://subgraph",
+        size=10,
+        max_queries=10,
+        timestamp_min=1704067200,
+        timestamp_max=1706745600,
+        token="atoken",
+        version_2=True,
+    )
+    users_balances = extraction.clean_users_balances_data(
+        extraction.fetch_users_balances(**arguments), token="atoken"
+    )
+    spool_path = str(tmp_path / "balances.csv")
+    last_item = extraction.stream_users_balances(spool_path=spool_path, **arguments)
+
+    expected_csv = io.StringIO()
+    users_balances.to_csv(expected_csv, index=False)
+    with open(spool_path) as spool:
+        assert spool.read() == expected_csv.getvalue()
+    assert last_item.to_dict("records") == [{"id": "0x0021", "timestamp": 1704147099}]
@@ -1,3 +1,6 @@
+import functools
+import http.server
+import threading
 import pytest
 import numpy as np
 import pandas as pd
@@ -5,6 +8,7 @@ from pandas import DataFrame
 
 
 from ...src.users_balances.users_balances_processing_functions import (
+    extract_events_data,
     clean_atokens_vtokens_balances,
     clean_events,
     clean_liquidation_events,
@@ -809,6 +813,36 @@ def liquidations_events():
     )
 
 
+def test_extract_events_data(tmp_path):
+    events_list = ["borrow", "deposit", "repay", "redeemUnderlying", "liquidationCall"]
+    for position, event_name in enumerate(events_list):
+        (tmp_path / event_name).mkdir()
+        DataFrame({"action": [event_name], "amount": [position]}).to_csv(
+            tmp_path / event_name / f"events_data_{event_name}_2024-1.csv", index=False
+        )
+
+    handler = functools.partial(
+        http.server.SimpleHTTPRequestHandler, directory=str(tmp_path)
+    )
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        for events_inputs_path in [
+            f"{tmp_path}/",
+            f"http://127.0.0.1:{server.server_address[1]}/",
+        ]:
+            interaction_events, liquidations = extract_events_data(
+                events_inputs_path, 2024, 1
+            )
+            assert interaction_events.action.tolist() == events_list[:4]
+            assert interaction_events.amount.tolist() == [0, 1, 2, 3]
+            assert liquidations.action.tolist() == ["liquidationCall"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 def test_clean_atokens_vtokens_balances(atokens):
     combined_abalances = clean_atokens_vtokens_balances(atokens)
     assert combined_abalances.columns.tolist() == [
@@ -984,6 +1018,42 @@ def test_clean_events(events):
     )
 
 
+def test_clean_events_multiple_actions():
+    events = DataFrame(
+        {
+            "txHash": ["0xb", "0xa", "0xb", "0xa", "0xb", "0xc"],
+            "reserve_name": ["Dai", "Dai", "Dai", "Dai", "USD Coin", None],
+            "timestamp": [2, 1, 2, 1, 2, 3],
+            "pool": "0xpool",
+            "user_id": "0xuser",
+            "action": [
+                "Supply",
+                "Borrow",
+                "RedeemUnderlying",
+                "Repay",
+                "Borrow",
+                "Supply",
+            ],
+            "amount": [5.0, 3.0, 2.0, 1.0, 4.0, 1.0],
+        },
+        index=[10, 11, 12, 13, 14, 15],
+    )
+    # The rows with a missing key are dropped, as with `groupby`
+    with pytest.raises(AssertionError):
+        clean_events(events)
+
+    clean_interaction_events = clean_events(events.iloc[:5])
+    assert clean_interaction_events.index.tolist() == [14, 0, 1]
+    assert clean_interaction_events.txHash.tolist() == ["0xb", "0xa", "0xb"]
+    assert clean_interaction_events.action.tolist() == [
+        "Borrow",
+        "Multiple",
+        "Multiple",
+    ]
+    assert clean_interaction_events.a_amount.tolist() == [0.0, 0.0, 3.0]
+    assert clean_interaction_events.v_amount.tolist() == [4.0, 2.0, 0.0]
+
+
 def test_clean_liquidation_events(liquidations_events):
     clean_liq_events = clean_liquidation_events(liquidations_events)
     assert clean_liq_events.columns.tolist() == [
@@ -995,6 +1065,15 @@ def test_clean_liquidation_events(liquidations_events):
         "action",
     ]
     assert len(clean_liq_events) == 4 * len(liquidations_events)
+    assert clean_liq_events.action.dtype == "category"
+
+    # Same collateral and principal reserve: one row per (user, action)
+    same_reserve = liquidations_events.iloc[:1].copy()
+    same_reserve["principal_reserve_name"] = same_reserve.collateral_reserve_name
+    assert clean_liquidation_events(same_reserve).action.tolist() == [
+        "trigger_liquidation",
+        "is_liquidated",
+    ]
 
     clean_liq_events = clean_liq_events.set_index(
         ["user_address", "reserve_name", "txHash"]
@@ -1048,6 +1127,9 @@ def test_match_balances_with_events(balances, events, liquidations_events):
     ]
 
     assert len(matched_balances_events) == len(balances)
+    assert matched_balances_events.attrs["unmatched_ratio"] == np.mean(
+        matched_balances_events.action.isna()
+    )
 
     matched_balances_events = matched_balances_events.set_index(
         ["user_address", "reserve_name", "txHash"]
@@ -0,0 +1,65 @@
+import itertools
+import random
+import numpy as np
+import pandas as pd
+from ...src.utils.fixed_point import (
+    BASE,
+    add_fixed_columns,
+    fixed_add,
+    fixed_compare,
+    fixed_cummax,
+    fixed_diff,
+    fixed_rescale,
+    fixed_sub,
+    get_fixed_columns,
+    parse_fixed,
+)
+
+generator = random.Random(0)
+values = [0, 1, -1, 10**27, 10**27 + 1, 2**63, 9 * 10**36] + [
+    generator.choice([1, -1]) * generator.getrandbits(bits)
+    for bits in generator.choices([40, 64, 90, 118], k=500)
+]
+
+
+def to_ints(fixed):
+    return [int(hi) * BASE + int(lo) for hi, lo in zip(*fixed)]
+
+
+def test_parse_fixed():
+    assert to_ints(parse_fixed([str(value) for value in values])) == values
+    assert to_ints(parse_fixed(np.array([5, -3]))) == [5, -3]
+
+
+def test_fixed_arithmetic():
+    a = parse_fixed([str(value) for value in values])
+    b = parse_fixed([str(value) for value in values[::-1]])
+    pairs = list(zip(values, values[::-1]))
+    assert to_ints(fixed_add(a, b)) == [x + y for x, y in pairs]
+    assert to_ints(fixed_sub(a, b)) == [x - y for x, y in pairs]
+    assert fixed_compare(a, b).tolist() == [(x > y) - (x < y) for x, y in pairs]
+    assert to_ints(fixed_diff(a)) == [y - x for x, y in zip(values, values[1:])]
+    assert to_ints(fixed_cummax(a)) == list(itertools.accumulate(values, max))
+    groups = np.arange(len(values)) % 3
+    assert to_ints(fixed_cummax(a, groups))[::3] == list(
+        itertools.accumulate(values[::3], max)
+    )
+
+
+def test_fixed_rescale():
+    small_values = [value for value in values if abs(value) < 2**80]
+    shifts = [generator.randint(-18, 5) for _ in small_values]
+    rescaled = fixed_rescale(parse_fixed(small_values), np.array(shifts))
+    assert to_ints(rescaled) == [
+        value * 10**shift if shift >= 0 else value // 10**-shift
+        for value, shift in zip(small_values, shifts)
+    ]
+
+
+def test_fixed_columns():
+    data = pd.DataFrame({"index": [str(10**27), str(10**27 + 1)]})
+    add_fixed_columns(data, "index", parse_fixed(data["index"]))
+    data = pd.concat([data, pd.DataFrame({"index": [None]})], ignore_index=True)
+    fixed, valid = get_fixed_columns(data, "index")
+    assert valid.tolist() == [True, True, False]
+    assert to_ints(fixed)[:2] == [10**27, 10**27 + 1]
@@ -0,0 +1,97 @@
+import io
+import pandas as pd
+from ...src.utils.incremental import (
+    WatermarkStore,
+    incremental_months,
+    incremental_timestamp_min,
+    append_rows,
+    read_output,
+)
+
+
+class FakeS3Client:
+    """In-memory stand-in for the `get_object`/`put_object` calls of boto3."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = dict()
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Body, Bucket, Key):
+        self.objects[(Bucket, Key)] = Body.encode() if isinstance(Body, str) else Body
+
+
+def test_watermark_store():
+    client_s3 = FakeS3Client()
+    key = "events/watermarks.json"
+    watermarks = WatermarkStore(client_s3, "bucket", key)
+    assert watermarks.timestamp("events", ["borrow"]) is None
+
+    data = pd.DataFrame({"id": ["a", "c", "b"], "timestamp": ["10", "30", "30"]})
+    watermarks.update("events", "borrow", data)
+    assert watermarks.get("events", "borrow") == {"timestamp": 30, "id": "c"}
+
+    # The watermark never goes backward
+    watermarks.update("events", "borrow", data.iloc[:1])
+    watermarks.update("events", "repay", data.iloc[:1])
+    watermarks = WatermarkStore(client_s3, "bucket", key)
+    assert watermarks.get("events", "borrow") == {"timestamp": 30, "id": "c"}
+    assert watermarks.timestamp("events", ["borrow", "repay"]) == 10
+    assert watermarks.timestamp("events", ["borrow", "deposit"]) is None
+
+
+def test_watermark_store_concurrent_updates():
+    client_s3 = FakeS3Client()
+    key = "events/watermarks.json"
+    first_store = WatermarkStore(client_s3, "bucket", key)
+    second_store = WatermarkStore(client_s3, "bucket", key)
+    first_store.update(
+        "events", "borrow", pd.DataFrame({"id": ["a"], "timestamp": [10]})
+    )
+    second_store.update(
+        "events", "repay", pd.DataFrame({"id": ["b"], "timestamp": [20]})
+    )
+    # The second save keeps the watermark saved by the first store
+    watermarks = WatermarkStore(client_s3, "bucket", key)
+    assert watermarks.get("events", "borrow") == {"timestamp": 10, "id": "a"}
+    assert watermarks.get("events", "repay") == {"timestamp": 20, "id": "b"}
+
+
+def test_read_output():
+    client_s3 = FakeS3Client()
+    assert read_output(client_s3, "bucket", "events/borrow_2024-1.csv") is None
+    client_s3.put_object(
+        Body="id,amount\na,1.5\n", Bucket="bucket", Key="events/borrow_2024-1.csv"
+    )
+    output = read_output(client_s3, "bucket", "events/borrow_2024-1.csv")
+    assert output.to_dict("records") == [{"id": "a", "amount": 1.5}]
+
+
+def test_incremental_months():
+    # 2024-11-15 to 2025-02-03
+    assert incremental_months(1731628800, now=1738540800) == [
+        (2024, 11),
+        (2024, 12),
+        (2025, 1),
+        (2025, 2),
+    ]
+    assert incremental_timestamp_min(2024, 11, None) == 1730419200
+    assert incremental_timestamp_min(2024, 11, 1731628800) == 1731628799
+    assert incremental_timestamp_min(2024, 12, 1731628800) == 1733011200
+
+
+def test_append_rows():
+    previous_data = pd.DataFrame({"id": ["a", "b"], "amount": [1.0, 2.0]})
+    new_data = pd.DataFrame({"id": ["b", "c"], "amount": [3.0, 4.0]})
+    data = append_rows(previous_data, new_data)
+    assert data.id.tolist() == ["a", "b", "c"]
+    assert data.amount.tolist() == [1.0, 3.0, 4.0]
+    assert append_rows(None, new_data).equals(new_data)
+    assert append_rows(previous_data, pd.DataFrame()).equals(previous_data)
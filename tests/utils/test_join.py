@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pandas import DataFrame
+from ...src.utils.join import encode_keys, left_join_unique
+
+
+def test_encode_keys():
+    left = DataFrame({"a": ["x", "y", None, "x"], "b": [1, 2, 3, 1]})
+    right = DataFrame({"a": ["x", None, "z"], "b": [1, 3, 1]})
+    left_keys, right_keys = encode_keys([left, right], on=["a", "b"])
+    assert left_keys[0] == left_keys[3] == right_keys[0]
+    # Missing values are equal, as with `merge`
+    assert left_keys[2] == right_keys[1]
+    assert len(set(left_keys[:3]) | {right_keys[2]}) == 4
+
+
+def test_left_join_unique():
+    generator = np.random.default_rng(0)
+    left = DataFrame(
+        {
+            "a": generator.choice(["x", "y", None], size=200),
+            "b": generator.integers(0, 10, size=200),
+            "value": np.arange(200),
+        },
+        index=generator.permutation(200),
+    )
+    right = (
+        DataFrame(
+            {
+                "a": generator.choice(["x", "y", "z", None], size=30),
+                "b": generator.integers(0, 10, size=30),
+                "other": generator.random(30),
+            }
+        )
+        .drop_duplicates(["a", "b"])
+        .reset_index(drop=True)
+    )
+    left_keys, right_keys = encode_keys([left, right], on=["a", "b"])
+    joined, matched = left_join_unique(
+        left, right, left_keys, right_keys, columns=["other"]
+    )
+    expected = left.merge(right, how="left", on=["a", "b"])
+    pd.testing.assert_frame_equal(joined, expected)
+    assert matched.tolist() == expected.other.notna().tolist()
+
+    with pytest.raises(ValueError):
+        left_join_unique(left, right, left_keys, right_keys[[0, 0]], ["other"])
@@ -0,0 +1,65 @@
+import pandas as pd
+
+from ...src.utils.graphql import selection_paths
+from ...src.utils.page_buffer import PageBuffer
+
+
+QUERY = """{
+    items: vtokenBalanceHistoryItems(
+        first: 2
+        where: { id_gt: "", timestamp_gt: 0 }
+    ) {
+        id
+        userReserve {
+            reserve {
+                name
+                decimals
+            }
+            user {
+                id
+            }
+        }
+        timestamp
+    }
+}"""
+
+PAGE = [
+    {
+        "id": "0xa",
+        "userReserve": {
+            "reserve": {"name": "USD Coin", "decimals": "6"},
+            "user": {"id": "0x1"},
+        },
+        "timestamp": 1704067201,
+    },
+    {
+        "id": "0xb",
+        "userReserve": {
+            "reserve": {"name": "Wrapped Ether", "decimals": "18"},
+            "user": {"id": "0x2"},
+        },
+        "timestamp": 1704067202,
+    },
+]
+
+
+def test_selection_paths():
+    assert selection_paths(QUERY) == {
+        "items": [
+            "id",
+            "timestamp",
+            "userReserve.reserve.name",
+            "userReserve.reserve.decimals",
+            "userReserve.user.id",
+        ]
+    }
+
+
+def test_page_buffer():
+    buffer = PageBuffer(selection_paths(QUERY)["items"])
+    buffer.append(PAGE)
+    buffer.append(PAGE)
+    assert len(buffer) == 4
+    pd.testing.assert_frame_equal(buffer.to_frame(), pd.json_normalize(PAGE + PAGE))
+
+    assert len(PageBuffer(selection_paths(QUERY)["items"]).to_frame()) == 0
@@ -0,0 +1,55 @@
+import pytest
+from ...src.utils.checkpoint import Checkpoint
+from ...src.utils.pagination import paginate, time_windows
+
+
+def test_paginate():
+    items = [{"id": f"{k:03d}"} for k in range(25)]
+    cursors = []
+
+    def fetch_page(last_id):
+        cursors.append(last_id)
+        return [item for item in items if item["id"] > last_id][:10]
+
+    pages = list(paginate(fetch_page=fetch_page, size=10, max_queries=10))
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert cursors == ["", "009", "019"]
+    assert [item for page in pages for item in page] == items
+
+    pages = list(paginate(fetch_page=fetch_page, size=10, max_queries=2))
+    assert [len(page) for page in pages] == [10, 10]
+
+
+def test_paginate_resumes_from_checkpoint(tmp_path):
+    items = [{"id": f"{k:03d}"} for k in range(25)]
+    cursors = []
+
+    def failing_fetch_page(last_id):
+        if last_id == "019":
+            raise RuntimeError("Gateway timeout")
+        return [item for item in items if item["id"] > last_id][:10]
+
+    checkpoint = Checkpoint(directory=str(tmp_path), name="balances")
+    with pytest.raises(RuntimeError):
+        list(
+            paginate(failing_fetch_page, size=10, max_queries=10, checkpoint=checkpoint)
+        )
+
+    def fetch_page(last_id):
+        cursors.append(last_id)
+        return [item for item in items if item["id"] > last_id][:10]
+
+    checkpoint = Checkpoint(directory=str(tmp_path), name="balances")
+    assert (checkpoint.cursor, checkpoint.n_pages) == ("019", 2)
+    pages = list(paginate(fetch_page, size=10, max_queries=10, checkpoint=checkpoint))
+    assert cursors == ["019"]
+    assert [item for page in pages for item in page] == items
+    assert Checkpoint(directory=str(tmp_path), name="balances").done
+
+
+def test_time_windows():
+    windows = time_windows(timestamp_min=100.0, timestamp_max=130.0, step=10)
+    assert windows == [(100, 110), (109, 120), (119, 130)]
+
+    covered = [t for lower, upper in windows for t in range(lower + 1, upper)]
+    assert covered == list(range(101, 130))
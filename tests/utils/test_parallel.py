@@ -0,0 +1,15 @@
+from ...src.utils.parallel import available_memory, workers_for_memory_budget
+
+
+def test_workers_for_memory_budget():
+    gigabyte = 2**30
+    assert workers_for_memory_budget(4 * gigabyte, 8, memory=18 * gigabyte) == 4
+    assert workers_for_memory_budget(4 * gigabyte, 2, memory=18 * gigabyte) == 2
+    # At least one worker, even above the budget
+    assert workers_for_memory_budget(4 * gigabyte, 8, memory=gigabyte) == 1
+    assert 1 <= workers_for_memory_budget(gigabyte, 3) <= 3
+
+
+def test_available_memory():
+    memory = available_memory()
+    assert memory is None or memory > 0
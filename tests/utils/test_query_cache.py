@@ -0,0 +1,31 @@
+import os
+
+from ...src.utils.query_cache import QueryCache
+
+API = "https://gateway.thegraph.com/api/secret/subgraphs/id/Cd2gEDVeqnjBn1hSeqFMitw8Q1iiyV9FYUZkLNRcL87g"
+
+
+def test_query_cache(tmp_path):
+    cache = QueryCache(directory=str(tmp_path))
+    query = "{ borrows(first: 10) { id } }"
+    output = {"data": {"borrows": [{"id": "0x1"}]}}
+
+    assert cache.get(API, query) is None
+    cache.set(API, query, output)
+    assert cache.get(API, "{\n  borrows(first: 10)  { id }\n}") == output
+    assert cache.get(API.replace("secret", "other"), query) == output
+    assert cache.get(API, "{ borrows(first: 20) { id } }") is None
+
+
+def test_query_cache_eviction(tmp_path):
+    cache = QueryCache(directory=str(tmp_path), max_size_bytes=10**9)
+    for k in range(3):
+        cache.set(API, f"{{ q{k} }}", {"data": list(range(100 * k))})
+        os.utime(cache._path(cache.key(API, f"{{ q{k} }}")), (k, k))
+    cache.get(API, "{ q0 }")
+
+    cache.max_size_bytes = cache.size_bytes - 1
+    cache._evict()
+    assert cache.get(API, "{ q1 }") is None
+    assert cache.get(API, "{ q0 }") is not None
+    assert cache.get(API, "{ q2 }") is not None
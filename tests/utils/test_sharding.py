@@ -0,0 +1,99 @@
+import threading
+import pandas as pd
+import pytest
+from pandas import DataFrame
+from ...src.utils.sharding import fetch_sharded, merge_windows
+
+timestamp_min = 1704067200
+timestamp_max = 1704067200 + 2 * 24 * 3600 + 5 * 3600
+items = DataFrame(
+    {
+        "id": [f"0x{(timestamp * 7919) % 100003:06d}" for timestamp in range(100)],
+        "timestamp": [1704067201 + 1800 * timestamp for timestamp in range(100)],
+    }
+)
+
+
+def fetch_items(timestamp_min, timestamp_max, windows, overlap=0):
+    windows.append((timestamp_min, timestamp_max))
+    # With an overlap, the items at the bounds are returned by both windows
+    return items[
+        (items.timestamp > timestamp_min - overlap)
+        & (items.timestamp < timestamp_max + overlap)
+    ].sample(frac=1, random_state=0)
+
+
+def expected_items():
+    return items.sort_values("id").reset_index(drop=True)
+
+
+@pytest.mark.parametrize("window, n_windows", [("day", 3), ("hour", 53)])
+def test_fetch_sharded_windows(window, n_windows):
+    windows = list()
+    data = fetch_sharded(
+        fetch_items,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+        window=window,
+        max_workers=4,
+        windows=windows,
+    )
+    windows.sort()
+    assert len(windows) == n_windows
+    assert windows[0][0] == timestamp_min
+    assert windows[-1][1] == timestamp_max
+    step = 24 * 3600 if window == "day" else 3600
+    # Consecutive windows, both bounds excluded
+    for (_, previous_max), (window_min, window_max) in zip(windows, windows[1:]):
+        assert window_min == previous_max - 1
+        assert window_max - window_min <= step + 1
+    pd.testing.assert_frame_equal(data, expected_items())
+
+
+def test_fetch_sharded_deduplicates_boundaries():
+    windows = list()
+    data = fetch_sharded(
+        fetch_items,
+        timestamp_min=timestamp_min,
+        timestamp_max=timestamp_max,
+        window="hour",
+        windows=windows,
+        overlap=3600,
+    )
+    assert data.id.is_unique
+    pd.testing.assert_frame_equal(data, expected_items())
+
+
+def test_fetch_sharded_dict_of_frames():
+    lock = threading.Lock()
+    windows = list()
+
+    def fetch_batched(timestamp_min, timestamp_max):
+        with lock:
+            page = fetch_items(timestamp_min, timestamp_max, windows)
+        return {"borrow": page, "repay": page.iloc[:0]}
+
+    data = fetch_sharded(
+        fetch_batched, timestamp_min=timestamp_min, timestamp_max=timestamp_max
+    )
+    assert list(data) == ["borrow", "repay"]
+    pd.testing.assert_frame_equal(data["borrow"], expected_items())
+    assert len(data["repay"]) == 0
+
+
+def test_merge_windows():
+    assert len(merge_windows([items.iloc[:0], items.iloc[:0]])) == 0
+    pd.testing.assert_frame_equal(
+        merge_windows([items.iloc[50:], items.iloc[:60]]), expected_items()
+    )
+
+
+def test_fetch_sharded_unknown_window():
+    with pytest.raises(ValueError):
+        fetch_sharded(
+            fetch_items,
+            timestamp_min=timestamp_min,
+            timestamp_max=timestamp_max,
+            window="week",
+            windows=list(),
+        )
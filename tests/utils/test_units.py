@@ -0,0 +1,44 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from ...src.utils.units import parse_integers, to_units
+
+values = [
+    "0",
+    "1",
+    "-5",
+    "000123",
+    str(2**63 - 1),
+    str(2**63),
+    str(10**37),
+    "9" * 38,
+    "9" * 39,
+    "1" + "0" * 49,
+] + [str(random.Random(seed).getrandbits(120)) for seed in range(200)]
+
+
+def test_parse_integers():
+    expected = [float(int(value)) for value in values]
+    assert parse_integers(pd.Series(values)).tolist() == expected
+    assert parse_integers(values[:4]).tolist() == expected[:4]
+    assert parse_integers([]).tolist() == []
+
+
+def test_to_units():
+    decimals = pd.Series([random.Random(seed).choice([0, 6, 8, 18]) for seed in values])
+    expected = (pd.Series(values).apply(int) / 10**decimals).to_numpy(np.float64)
+    np.testing.assert_array_max_ulp(
+        to_units(pd.Series(values), decimals), expected, maxulp=1
+    )
+
+    # Within the int64 range
+    small_values = pd.Series(values[:5])
+    expected = (small_values.apply(int) / 10**18).tolist()
+    assert to_units(small_values, 18).tolist() == expected
+
+
+def test_invalid_strings():
+    for value in ["1.5", "", "0x10"]:
+        with pytest.raises(ValueError):
+            parse_integers(["1", value])
@@ -0,0 +1,97 @@
+import pytest
+
+from ...src.utils import utils
+from ...src.utils.utils import QueryError, TokenBucket, backoff_delay, run_query
+
+
+class FakeResponse:
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def post(self, api, json, timeout):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def no_wait(monkeypatch):
+    delays = []
+    monkeypatch.setattr(utils.time, "sleep", delays.append)
+    return delays
+
+
+def test_run_query_retries(monkeypatch, no_wait):
+    session = FakeSession(
+        [
+            FakeResponse(429, b"", {"Retry-After": "3"}),
+            FakeResponse(200, b'{"errors": [{"message": "indexer unavailable"}]}'),
+            FakeResponse(200, b'{"data": {"borrows": []}}'),
+        ]
+    )
+    monkeypatch.setattr(utils, "get_session", lambda: session)
+    assert run_query("https://api", "{ borrows { id } }") == {"data": {"borrows": []}}
+    assert session.calls == 3
+    assert 3.0 in no_wait
+
+
+def test_run_query_errors(monkeypatch, no_wait):
+    session = FakeSession([FakeResponse(400, b"")])
+    monkeypatch.setattr(utils, "get_session", lambda: session)
+    with pytest.raises(QueryError):
+        run_query("https://api", "{ borrows { id } }")
+    assert session.calls == 1
+
+    session = FakeSession([FakeResponse(503, b"")] * 3)
+    monkeypatch.setattr(utils, "get_session", lambda: session)
+    with pytest.raises(QueryError):
+        run_query("https://api", "{ borrows { id } }", max_retries=2)
+    assert session.calls == 3
+
+
+def test_run_query_validation_errors(monkeypatch, no_wait):
+    session = FakeSession(
+        [
+            FakeResponse(
+                200,
+                b'{"errors": [{"message": "Type `Query` has no field `borowws`"}]}',
+            )
+        ]
+        * 3
+    )
+    monkeypatch.setattr(utils, "get_session", lambda: session)
+    with pytest.raises(QueryError) as error:
+        run_query("https://api", "{ borowws { id } }")
+    assert not error.value.retryable
+    assert session.calls == 1
+
+    # Partial data returned with the errors is retried
+    session = FakeSession(
+        [
+            FakeResponse(200, b'{"data": {"borrows": null}, "errors": ["failed"]}'),
+            FakeResponse(200, b'{"data": {"borrows": []}}'),
+        ]
+    )
+    monkeypatch.setattr(utils, "get_session", lambda: session)
+    assert run_query("https://api", "{ borrows { id } }") == {"data": {"borrows": []}}
+    assert session.calls == 2
+
+
+def test_backoff_delay():
+    assert backoff_delay(0, retry_after="2") == 2.0
+    assert 0 <= backoff_delay(3) <= 8
+    assert backoff_delay(20) <= utils.BACKOFF_MAX
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert 0 < bucket.reserve() <= 0.1
@@ -6,6 +6,13 @@ import concurrent.futures
 from src.users_balances.users_balances_extraction_functions import (
     extract_monthly_users_data,
 )
+from src.utils.incremental import (
+    WatermarkStore,
+    read_output,
+    incremental_months,
+    incremental_timestamp_min,
+    append_rows,
+)
 from src.utils.logger import Logger
 
 global_logger = Logger()
@@ -22,6 +29,17 @@ output_path = "aave-data/data-prod/aave-v2/users-positions/"
 year = 2024
 months = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
 version_2 = True
+# Fetch progress is saved there, so that failed months resume from their last page
+checkpoint_directory = "checkpoints/users-balances/"
+# Incremental mode: only fetch the balances more recent than the last extracted
+# ones (watermarks stored on s3, next to the outputs) and append them to the
+# month's output
+incremental = False
+# Streaming mode: the clean balances are written page by page to local CSV files in
+# `spool_directory`, then uploaded (multipart), instead of being kept in memory.
+# Incremental runs, which fetch a few pages only, are not streamed.
+streaming = True
+spool_directory = "spool/users-balances/"
 
 if version_2:
     api_endpoint = f"https://gateway.thegraph.com/api/{API_SECRET_KEY}/subgraphs/id/8wR23o1zkS4gpLqLNU4kG3JHYVucqGyopL5utGxP2q1N"
@@ -37,76 +55,91 @@ client_s3 = boto3.client(
     aws_session_token=AWS_SESSION_TOKEN,
 )
 
-global_logger.log("Extracting ATokens data...")
-
-with concurrent.futures.ThreadPoolExecutor() as executor:
-    future_to_month = {
-        executor.submit(
-            extract_monthly_users_data,
-            api_endpoint,
-            1000,
-            300,
-            year,
-            month,
-            "atoken",
-            version_2,
-            True,
-        ): f"{year}-{month}"
-        for month in months
-    }
-
-    for future in concurrent.futures.as_completed(future_to_month):
-        month_string = future_to_month[future]
-        try:
-            # Extract outputs
-            atoken_balances = future.result()
-
-            # Write to s3
-            csv_buffer = io.StringIO()
-            atoken_balances.to_csv(csv_buffer, index=False)
-            client_s3.put_object(
-                Body=csv_buffer.getvalue(),
-                Bucket="llatournerie",
-                Key=output_path + f"users_atoken_balances_{month_string}.csv",
-            )
-        except Exception as e:
-            global_logger.log(f"Generated an exeption for {month_string}: {e}")
-
-
-global_logger.log("Extracting VTokens data...")
-
-with concurrent.futures.ThreadPoolExecutor() as executor:
-    future_to_month = {
-        executor.submit(
-            extract_monthly_users_data,
-            api_endpoint,
-            1000,
-            300,
-            year,
-            month,
-            "vtoken",
-            version_2,
-            True,
-        ): f"{year}-{month}"
-        for month in months
-    }
-
-    for future in concurrent.futures.as_completed(future_to_month):
-        month_string = future_to_month[future]
-        try:
-            # Extract outputs
-            vtoken_balances = future.result()
-
-            # Write to s3
-            csv_buffer = io.StringIO()
-            vtoken_balances.to_csv(csv_buffer, index=False)
-            client_s3.put_object(
-                Body=csv_buffer.getvalue(),
-                Bucket="llatournerie",
-                Key=output_path + f"users_vtoken_balances_{month_string}.csv",
-            )
-        except Exception as e:
-            global_logger.log(f"Generated an exeption for {month_string}: {e}")
+
+watermarks = WatermarkStore(client_s3, "llatournerie", output_path + "watermarks.json")
+
+for token in ["atoken", "vtoken"]:
+    global_logger.log(f"Extracting {token}s data...")
+
+    watermark_timestamp = None
+    periods = [(year, month) for month in months]
+    if incremental:
+        watermark_timestamp = watermarks.timestamp(output_path, [token])
+        if watermark_timestamp is not None:
+            periods = incremental_months(watermark_timestamp)
+        global_logger.log(
+            f"Incremental run from watermark {watermark_timestamp}: {periods}"
+        )
+
+    stream = streaming and not incremental
+    monthly_balances = dict()
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        future_to_month = {
+            executor.submit(
+                extract_monthly_users_data,
+                api_endpoint,
+                1000,
+                300,
+                period_year,
+                month,
+                token,
+                version_2,
+                True,
+                checkpoint_directory,
+                (
+                    incremental_timestamp_min(period_year, month, watermark_timestamp)
+                    if incremental
+                    else None
+                ),
+                (
+                    spool_directory
+                    + f"users_{token}_balances_{period_year}-{month}.csv"
+                    if stream
+                    else None
+                ),
+            ): (period_year, month)
+            for period_year, month in periods
+        }
+
+        for future in concurrent.futures.as_completed(future_to_month):
+            period_year, month = future_to_month[future]
+            month_string = f"{period_year}-{month}"
+            try:
+                # Extract outputs
+                token_balances = future.result()
+
+                # Write to s3
+                key = output_path + f"users_{token}_balances_{month_string}.csv"
+                if stream:
+                    spool_path = (
+                        spool_directory + f"users_{token}_balances_{month_string}.csv"
+                    )
+                    client_s3.upload_file(spool_path, "llatournerie", key)
+                    os.remove(spool_path)
+                    monthly_balances[(period_year, month)] = token_balances
+                    continue
+                if incremental:
+                    token_balances = append_rows(
+                        read_output(client_s3, "llatournerie", key), token_balances
+                    )
+                csv_buffer = io.StringIO()
+                token_balances.to_csv(csv_buffer, index=False)
+                client_s3.put_object(
+                    Body=csv_buffer.getvalue(),
+                    Bucket="llatournerie",
+                    Key=key,
+                )
+                monthly_balances[(period_year, month)] = token_balances.filter(
+                    ["id", "timestamp"]
+                )
+            except Exception as e:
+                global_logger.log(f"Generated an exeption for {month_string}: {e}")
+
+    # The watermark moves up to the first failed month, which must be extracted again
+    for period in periods:
+        if period not in monthly_balances:
+            break
+        watermarks.update(output_path, token, monthly_balances[period])
 
 client_s3.put_object(
     Body=global_logger.buffer.getvalue(),